@@ -1,10 +1,17 @@
 import streamlit as st
-import pandas as pd
 import time
 import os
-import re  # Added for Regex Extraction
-# Import the processor logic
-import process_experian
+import itertools
+from resources import LazyModule
+from pan_input import collect_pans
+# Jobs run in a background worker process; the UI only submits and polls them
+import jobs
+from progress import format_duration
+from preview import CsvPreview
+from artifact_server import ARTIFACT_BASE_URL, ARTIFACT_INLINE_MAX_MB, artifact_url, start_artifact_server
+
+# pandas is only needed to show results; it loads on first use instead of on every rerun
+pd = LazyModule('pandas')
 
 # ================================
 # PAGE CONFIG
@@ -34,8 +41,9 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize Session State
-if 'processing' not in st.session_state:
-    st.session_state['processing'] = False
+# A job id in the URL (?job=...) lets a refreshed browser re-attach to a running job.
+if 'job_id' not in st.session_state:
+    st.session_state['job_id'] = st.query_params.get('job')
 
 # ================================
 # HEADER
@@ -50,34 +58,58 @@ st.markdown("---")
 with st.sidebar:
     st.header("⚙️ Settings")
     max_workers = st.slider("Concurrent Threads", min_value=1, max_value=50, value=20, step=1)
-    st.info(f"Currently configured to process **{max_workers}** reports simultaneously.")
+    adaptive = st.checkbox("Adaptive concurrency", value=False,
+                           help="Tune in-flight downloads automatically from object-store latency and errors, up to the slider value.")
+    hedge = st.checkbox("Hedge slow downloads", value=False,
+                        help="Re-send a download that runs longer than most recent ones and use whichever answer arrives first.")
+    if adaptive:
+        st.info(f"Concurrency is tuned automatically, up to **{max_workers}** reports simultaneously.")
+    else:
+        st.info(f"Currently configured to process **{max_workers}** reports simultaneously.")
     
     st.divider()
     
     st.header("📝 Filter Options")
     st.markdown("Enter PANs below. You can copy-paste lists, bullets, or piles of text. The system will auto-extract valid PANs.")
     pan_input = st.text_area("Specific PANs", height=200, placeholder="• ABCDE1234F\n- FGHIJ5678K\nOr just paste an email...")
+    pan_files = st.file_uploader("...or upload PAN lists", type=['csv', 'txt', 'xlsx'], accept_multiple_files=True,
+                                 help="Any layout; PANs are extracted from every cell/line. Large lists run in batches.")
+
+    st.divider()
+
+    st.header("🔗 Re-attach to Job")
+    attach_id = st.text_input("Job ID", value=st.session_state['job_id'] or "")
+    if st.button("Attach") and attach_id.strip():
+        st.session_state['job_id'] = attach_id.strip()
+        st.query_params['job'] = attach_id.strip()
+        st.rerun()
 
 # ================================
 # MAIN INTERFACE
 # ================================
 
+job = jobs.get_job(st.session_state['job_id']) if st.session_state['job_id'] else None
+job_active = job is not None and job['status'] not in jobs.TERMINAL_STATUSES
+
 col1, col2 = st.columns([1, 2])
 
 with col1:
     st.subheader("Control Panel")
     
     # Logic for Buttons based on State
-    if not st.session_state['processing']:
+    if not job_active:
         start_btn = st.button("🚀 START PROCESSING", type="primary")
         stop_btn = st.button("🛑 STOP / CANCEL", disabled=True)
     else:
         start_btn = st.button("🚀 PROCESSING...", disabled=True)
         stop_btn = st.button("🛑 STOP / CANCEL", type="secondary")
 
-    if stop_btn:
-        st.session_state['processing'] = False
-        st.experimental_rerun()
+    if stop_btn and job:
+        jobs.cancel_job(job['id'])
+        st.rerun()
+
+    if job:
+        st.caption(f"Job ID: `{job['id']}`")
 
     st.markdown("### Output")
     output_placeholder = st.empty()
@@ -93,93 +125,156 @@ with col2:
 # ================================
 
 if start_btn:
-    st.session_state['processing'] = True
-    
     # 1. Parse PAN Input (REGEX MODE)
-    specific_pans = []
-    if pan_input:
-        # Regex to find standard Indian PAN pattern: 5 Letters, 4 Digits, 1 Letter
-        # Finds matches anywhere in the text (ignoring bullets, commas, sentences, etc)
-        pattern = r'[A-Za-z]{5}\d{4}[A-Za-z]{1}'
-        matches = re.findall(pattern, pan_input)
-        
-        # Unique and Uppercase
-        specific_pans = sorted(list(set([m.upper() for m in matches])))
+    # Finds standard Indian PANs anywhere in the text and files (ignoring bullets, commas, sentences, etc),
+    # streaming through them chunk by chunk into a compact, deduplicated set.
+    specific_pans = collect_pans(pan_input, pan_files or [])
         
     if specific_pans:
         st.toast(f"✅ Extracted {len(specific_pans)} Valid PANs")
-        st.info(f"Processing {len(specific_pans)} filtered PANs: {', '.join(specific_pans[:5])}...")
+        st.info(f"Processing {len(specific_pans)} filtered PANs: {', '.join(itertools.islice(specific_pans, 5))}...")
     else:
-        if pan_input and len(pan_input.strip()) > 0:
-            st.warning("⚠️ Text entered but NO valid PANs found! Processing ALL records instead?")
-            # Decide: Should we stop? Safe bet: If user entered text but no PANs found, likely typo.
-            # But currently logic falls back to ALL. Let's make it strict if input exists.
-            st.error("Text entered but no valid PAN patterns (ABCDE1234F) found. Please check input.")
-            st.session_state['processing'] = False
+        if (pan_input and len(pan_input.strip()) > 0) or pan_files:
+            # If user entered text but no PANs found, likely typo. Be strict instead of falling back to ALL.
+            st.error("Input given but no valid PAN patterns (ABCDE1234F) found. Please check input.")
             st.stop()
         else:
              st.toast("Processing ALL records from Database")
 
-    # 2. Callback Function for UI Updates
-    def update_ui(current, total, message):
-        # Update Status Text
-        status_text.markdown(f"**Status:** {message}")
-        
-        # Update Progress Bar
-        if total > 0:
-            percent = min(current / total, 1.0)
-            progress_bar.progress(percent)
-        else:
-            progress_bar.progress(0)
-            
-    # 3. Run Processor
+    # 2. Queue the job and hand it to the background worker
+    job_id = jobs.submit_job(max_workers=max_workers, specific_pans=specific_pans, adaptive=adaptive, hedge=hedge)
+    jobs.ensure_worker()
+    st.session_state['job_id'] = job_id
+    st.query_params['job'] = job_id
+    st.rerun()
+
+def render_progress(job):
+    status_text.markdown(f"**Status:** {job['message'] or job['status']}")
+    total = job['progress_total'] or 0
+    if total > 0:
+        progress_bar.progress(min((job['progress_current'] or 0) / total, 1.0))
+    else:
+        progress_bar.progress(0)
+
+    event = (job['stats'] or {}).get('progress') or {}
+    if event.get('tasks_total'):
+        log_area.caption(
+            f"{event.get('completed', 0)}/{event['tasks_total']} reports · {event.get('throughput', 0)}/s · "
+            f"ETA {format_duration(event.get('eta_seconds'))} · {event.get('failed', 0)} failed · "
+            f"{event.get('fallback_hits', 0)} api_server fallbacks · {event.get('rows', 0)} rows"
+        )
+
+@st.cache_resource(max_entries=4, show_spinner="Indexing results...")
+def load_preview(csv_path, mtime):
+    # mtime is part of the cache key, so a rewritten artifact is indexed again.
+    return CsvPreview(csv_path)
+
+@st.cache_resource(show_spinner=False)
+def artifact_server():
+    # One per Streamlit process: large downloads stream from it instead of through the page.
     try:
-        with st.spinner("Processing started... Please wait."):
-            # Check if stopped before running (basic check)
-            if not st.session_state['processing']:
-                st.stop()
-                
-            df = process_experian.run_processor(
-                max_workers=max_workers, 
-                specific_pans=specific_pans, 
-                progress_callback=update_ui
-            )
+        return start_artifact_server()
+    except OSError as e:
+        print(f"[WARN] Artifact server not started: {e}")
+        return None
+
+def artifact_base_url(server):
+    """Where the browser reaches the artifact server, or None if it can't (loopback-only server, remote browser)."""
+    if ARTIFACT_BASE_URL:
+        return ARTIFACT_BASE_URL
+    host = st.context.headers.get('Host', 'localhost').rsplit(':', 1)[0]
+    if server.server_address[0].startswith('127.') and host not in ('localhost', '127.0.0.1'):
+        return None
+    return f"http://{host}:{server.server_address[1]}"
+
+def download_options(artifacts):
+    """Download name -> (path, mime) for the job's artifacts that exist on disk."""
+    xlsx_mime = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    options = {}
+    candidates = [("processed_trade_lines.csv", artifacts.get('csv'), "text/csv"),
+                  ("processed_trade_lines.xlsx", artifacts.get('xlsx'), xlsx_mime)]
+    # Outputs past Excel's row limit are split into several workbooks.
+    candidates += [(os.path.basename(path), path, xlsx_mime) for path in artifacts.get('xlsx_parts', [])]
+    candidates.append(("processed_trade_lines.manifest.json", artifacts.get('manifest'), "application/json"))
+    candidates.append(("pan_rollup.csv", artifacts.get('rollup'), "text/csv"))
+    for name, path, mime in candidates:
+        if path and os.path.exists(path):
+            options[name] = (path, mime)
+    return options
+
+# 3. Poll the job. Widget interactions rerun the script and land back here,
+# re-attaching to the same job instead of throwing the work away.
+if job_active:
+    jobs.ensure_worker()
+    with st.spinner("Processing in background... You can safely refresh this page."):
+        while job and job['status'] not in jobs.TERMINAL_STATUSES:
+            render_progress(job)
+            time.sleep(jobs.POLL_INTERVAL)
+            job = jobs.get_job(job['id'])
+
+# 4. Handle Completion
+if job:
+    artifacts = job['artifacts']
+    if job['status'] == 'completed' and artifacts.get('csv'):
+        st.success("✅ Processing Complete!")
+        status_text.markdown("**Status:** Job Finished Successfully.")
+        progress_bar.progress(100)
         
-        # 4. Handle Completion
-        if df is not None and not df.empty:
-            st.success("✅ Processing Complete!")
-            status_text.markdown("**Status:** Job Finished Successfully.")
-            progress_bar.progress(100)
-            
-            # Show Preview
-            with st.expander("📄 Data Preview (First 50 Rows)", expanded=True):
-                st.dataframe(df.head(50))
-            
-            # Download Button
-            csv = df.to_csv(index=False).encode('utf-8')
-            output_placeholder.download_button(
-                label="📥 Download Excel/CSV Data",
-                data=csv,
-                file_name="processed_trade_lines.csv",
-                mime="text/csv",
-            )
-            
-            excel_path = process_experian.OUTPUT_FILE
-            if os.path.exists(excel_path):
-                with open(excel_path, "rb") as f:
-                    output_placeholder.download_button(
-                        label="📥 Download Excel (.xlsx)",
-                        data=f,
-                        file_name="processed_trade_lines.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
-        elif df is None:
-             st.warning("Job stopped or returned no data.")
-        else:
-            st.error("Processing finished but returned no data. Check inputs.")
-            
-    except Exception as e:
-        st.error(f"An error occurred: {e}")
-    
-    # Reset State after completion
-    st.session_state['processing'] = False
+        # Show Preview (one page at a time, read straight from the CSV artifact)
+        with st.expander("📄 Data Preview", expanded=True):
+            preview = load_preview(artifacts['csv'], os.path.getmtime(artifacts['csv']))
+            pan_query = st.text_input("Filter by PAN", key=f"preview_pan_{job['id']}",
+                                      placeholder="Full PAN or any part of one")
+            page_count = preview.page_count(pan_query)
+            page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1,
+                                   key=f"preview_page_{job['id']}_{pan_query}")
+            st.dataframe(pd.DataFrame(preview.page(page - 1, pan_query), columns=preview.headers))
+            st.caption(f"{preview.count(pan_query)} of {preview.total_rows} rows · page {page}/{page_count}")
+
+        concurrency = job['stats'].get('concurrency', {})
+        if concurrency.get('mode') == 'adaptive' and concurrency.get('samples'):
+            with st.expander("📈 Adaptive Concurrency"):
+                st.line_chart(pd.DataFrame(concurrency['samples'], columns=['seconds', 'in_flight']).set_index('seconds'))
+                st.caption(f"Finished at {concurrency['final']} in-flight downloads "
+                           f"({concurrency['errors']} errors over {concurrency['requests']} requests).")
+        
+        # Downloads: a file is only read once the user asks for it, and only that one file.
+        with output_placeholder.container():
+            downloads = download_options(artifacts)
+            choice = st.selectbox("File", list(downloads), key=f"download_choice_{job['id']}")
+            prepared_key = f"download_ready_{job['id']}"
+            if st.button("📦 Prepare Download"):
+                st.session_state[prepared_key] = choice
+            if choice and st.session_state.get(prepared_key) == choice:
+                path, mime = downloads[choice]
+                size_mb = os.path.getsize(path) / (1024 * 1024)
+                if size_mb <= ARTIFACT_INLINE_MAX_MB:
+                    with open(path, "rb") as f:
+                        st.download_button(
+                            label=f"📥 Download {choice}",
+                            data=f,
+                            file_name=choice,
+                            mime=mime,
+                            key=f"download_{job['id']}_{choice}"
+                        )
+                else:
+                    # download_button would read the whole file into memory; stream it from the artifact server.
+                    server = artifact_server()
+                    base_url = artifact_base_url(server) if server is not None else None
+                    if base_url:
+                        st.link_button(f"📥 Download {choice} ({size_mb:,.0f} MB)",
+                                       artifact_url(base_url, job['id'], path))
+                    else:
+                        st.warning(f"{choice} is {size_mb:,.0f} MB, too large to download through the page. "
+                                   f"It is on the server at `{path}`.")
+    elif job['status'] == 'completed':
+        status_text.markdown(f"**Status:** {job['message']}")
+        st.error("Processing finished but returned no data. Check inputs.")
+    elif job['status'] == 'cancelled':
+        status_text.markdown(f"**Status:** {job['message']}")
+        st.warning("Job stopped or returned no data.")
+    elif job['status'] == 'failed':
+        status_text.markdown(f"**Status:** {job['message']}")
+        st.error(f"An error occurred: {job['error']}")
+elif st.session_state['job_id']:
+    st.warning(f"Job `{st.session_state['job_id']}` was not found.")
@@ -0,0 +1,156 @@
+"""
+Byte-range HTTP server for job artifacts.
+
+Streamlit's download_button reads the whole file into the app's memory (and
+the browser's), which defeats writing large outputs without loading them.
+Artifacts past ARTIFACT_INLINE_MAX_MB are linked to this server instead: it
+streams a job's files from disk in chunks and answers Range requests, so a
+browser can resume an interrupted multi-GB download. Only files listed in a
+job's artifacts can be fetched, and only through a link signed for that job
+(artifact_url), which expires after ARTIFACT_LINK_TTL seconds.
+
+    GET|HEAD /jobs/<job id>/<artifact file name>?expires=<unix time>&token=<HMAC of job id and expiry>
+"""
+import hashlib
+import hmac
+import mimetypes
+import os
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlencode
+
+import jobs
+
+ARTIFACT_HOST = os.getenv('ARTIFACT_HOST', '127.0.0.1')  # Set to 0.0.0.0 only when browsers must reach it directly
+ARTIFACT_PORT = int(os.getenv('ARTIFACT_PORT', '8766'))
+# Base URL the browser uses to reach this server (e.g. behind a reverse proxy); default: the app's host on ARTIFACT_PORT.
+ARTIFACT_BASE_URL = os.getenv('ARTIFACT_BASE_URL', '')
+ARTIFACT_INLINE_MAX_MB = float(os.getenv('ARTIFACT_INLINE_MAX_MB', '50'))  # Larger artifacts are linked, not loaded into the page
+ARTIFACT_LINK_TTL = int(os.getenv('ARTIFACT_LINK_TTL', '86400'))  # Seconds a signed download link stays valid
+# Key for signing links. Set it when links are issued and served by different processes; otherwise a per-process key is used.
+ARTIFACT_SECRET = os.getenv('ARTIFACT_SECRET', '').encode('utf-8') or secrets.token_bytes(32)
+_CHUNK_BYTES = 1024 * 1024
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+mimetypes.add_type('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', '.xlsx')
+
+def artifact_paths(artifacts):
+    """All file paths in a job's artifacts dict (values are paths or lists of paths)."""
+    paths = []
+    for val in artifacts.values():
+        paths.extend(val if isinstance(val, list) else [val])
+    return [path for path in paths if path]
+
+def artifact_token(job_id, expires):
+    return hmac.new(ARTIFACT_SECRET, f"{job_id}:{expires}".encode('utf-8'), hashlib.sha256).hexdigest()
+
+def verify_artifact_token(job_id, expires, token):
+    """True if token was issued for this job by artifact_url and has not expired."""
+    try:
+        if int(expires) < time.time():
+            return False
+    except (TypeError, ValueError):
+        return False
+    return hmac.compare_digest(artifact_token(job_id, expires), token or '')
+
+def artifact_url(base_url, job_id, path, ttl=ARTIFACT_LINK_TTL):
+    """Signed link to one of a job's artifacts, valid for ttl seconds."""
+    expires = int(time.time()) + ttl
+    query = urlencode({'expires': expires, 'token': artifact_token(job_id, expires)})
+    return f"{base_url.rstrip('/')}/jobs/{quote(job_id)}/{quote(os.path.basename(path))}?{query}"
+
+class ArtifactHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _resolve(self):
+        """:return: The artifact path, None for an unknown artifact, or False for a missing/invalid link signature."""
+        path, _, query = self.path.partition('?')
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+        if len(parts) != 3 or parts[0] != 'jobs':
+            return None
+        params = parse_qs(query)
+        if not verify_artifact_token(parts[1], params.get('expires', [None])[0], params.get('token', [None])[0]):
+            return False
+        job = jobs.get_job(parts[1])
+        if not job:
+            return None
+        for path in artifact_paths(job['artifacts'] or {}):
+            if os.path.basename(path) == parts[2] and os.path.isfile(path):
+                return path
+        return None
+
+    def _error(self, status, message):
+        body = message.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        path = self._resolve()
+        if path is False:
+            self._error(403, "Invalid or expired download link")
+            return
+        if path is None:
+            self._error(404, "Unknown artifact")
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        status = 200
+        requested = self.headers.get('Range')
+        if requested:
+            match = _RANGE.match(requested.strip())
+            if not match or not any(match.groups()):
+                self._error(416, "Only single byte ranges are supported")
+                return
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last), size - 1) if last else size - 1
+            else:
+                start = max(0, size - int(last))  # Suffix range: the last N bytes
+            if start > end or start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{size}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        self.send_header('Content-Disposition', f"attachment; filename=\"{os.path.basename(path)}\"")
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        with open(path, 'rb') as fh:
+            fh.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = fh.read(min(_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_artifact_server(host=ARTIFACT_HOST, port=ARTIFACT_PORT):
+    """Serves artifacts on a daemon thread. :return: The ThreadingHTTPServer."""
+    server = ThreadingHTTPServer((host, port), ArtifactHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='artifact-server', daemon=True).start()
+    print(f"Serving job artifacts on {host}:{server.server_address[1]}")
+    return server
@@ -0,0 +1,121 @@
+"""
+Adaptive concurrency control for object-store fetches.
+
+AdaptiveConcurrencyLimiter tunes how many requests may be in flight using
+AIMD (additive increase, multiplicative decrease): every healthy window of
+responses raises the limit by one, while errors, throttling or a latency
+blow-up relative to the observed baseline cut it by a constant factor.
+"""
+import threading
+import time
+
+MAX_SAMPLES = 2000  # Cap on recorded (elapsed, limit) points per run
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(self, min_limit=2, max_limit=50, initial_limit=None, backoff=0.7,
+                 latency_tolerance=2.0, ewma_alpha=0.2, sample_interval=1.0):
+        """
+        :param min_limit: Int, lowest allowed in-flight requests.
+        :param max_limit: Int, highest allowed in-flight requests.
+        :param initial_limit: Int, starting limit. Defaults to halfway between the bounds.
+        :param backoff: Float, factor applied to the limit on congestion.
+        :param latency_tolerance: Float, smoothed latency above baseline * tolerance counts as congestion.
+        :param ewma_alpha: Float, smoothing factor for the latency average.
+        :param sample_interval: Float, minimum seconds between recorded limit samples.
+        """
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        if initial_limit is None:
+            initial_limit = (self.min_limit + self.max_limit) // 2
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial_limit)))
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.ewma_alpha = ewma_alpha
+        self.sample_interval = sample_interval
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._ewma_latency = None
+        self._baseline_latency = None
+        self._completions_since_decrease = 0
+        self._started = time.time()
+        self._last_sample_at = None
+        self.samples = []
+        self.requests = 0
+        self.errors = 0
+        self.decreases = 0
+        self._record_sample(force=True)
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, latency, error=False):
+        with self._cond:
+            self._in_flight -= 1
+            self.requests += 1
+            self._completions_since_decrease += 1
+            if error:
+                self.errors += 1
+
+            if not error:
+                if self._ewma_latency is None:
+                    self._ewma_latency = latency
+                else:
+                    self._ewma_latency += self.ewma_alpha * (latency - self._ewma_latency)
+                if self._baseline_latency is None or latency < self._baseline_latency:
+                    self._baseline_latency = latency
+                else:
+                    # Let the baseline drift up slowly so one lucky response doesn't pin it forever.
+                    self._baseline_latency *= 1.001
+
+            congested = error or (
+                self._baseline_latency is not None
+                and self._ewma_latency > self._baseline_latency * self.latency_tolerance
+            )
+            if congested:
+                # Decrease at most once per window of in-flight requests, otherwise one
+                # burst of failures would collapse the limit to the floor.
+                if self._completions_since_decrease >= int(self.limit):
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._completions_since_decrease = 0
+                    self.decreases += 1
+                    if not error:
+                        self._ewma_latency = self._baseline_latency * self.latency_tolerance
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+            self._record_sample()
+            self._cond.notify_all()
+
+    def _record_sample(self, force=False):
+        now = time.time()
+        current = int(self.limit)
+        if not force:
+            if self.samples and self.samples[-1][1] == current:
+                return
+            if self._last_sample_at is not None and now - self._last_sample_at < self.sample_interval:
+                return
+        self._last_sample_at = now
+        self.samples.append((round(now - self._started, 2), current))
+        if len(self.samples) > MAX_SAMPLES:
+            # Downsample instead of dropping the start of the run.
+            self.samples = self.samples[::2]
+
+    def stats(self):
+        with self._cond:
+            self._record_sample(force=True)
+            return {
+                'mode': 'adaptive',
+                'min': self.min_limit,
+                'max': self.max_limit,
+                'final': int(self.limit),
+                'requests': self.requests,
+                'errors': self.errors,
+                'decreases': self.decreases,
+                'baseline_latency': round(self._baseline_latency, 4) if self._baseline_latency else None,
+                'smoothed_latency': round(self._ewma_latency, 4) if self._ewma_latency else None,
+                'samples': list(self.samples),
+            }
@@ -0,0 +1,217 @@
+"""
+Sharded Excel export.
+
+Large outputs are split into several workbooks (and, within a workbook, into
+several sheets) so no sheet ever passes Excel's 1,048,576-row limit. Rows are
+streamed once: each shard is staged to a temporary columnar file and handed to
+a pool of worker processes that write the workbooks in parallel, while the
+next shard is still being staged. A JSON manifest lists the files, their
+sheets, row counts and PAN ranges.
+"""
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import time
+from datetime import datetime
+
+from result_store import encode_rows, decode_rows
+
+EXCEL_MAX_ROWS = 1048576
+ROWS_PER_SHEET = EXCEL_MAX_ROWS - 1  # One row goes to the header
+EXPORT_ROWS_PER_FILE = int(os.getenv('EXPORT_ROWS_PER_FILE', '250000'))
+EXPORT_PROCESSES = int(os.getenv('EXPORT_PROCESSES', '0')) or None  # Default: one per CPU
+SPLIT_MODES = ('rows', 'pan')
+
+_BLOCK_ROWS = 20000
+_LENGTH = struct.Struct('<Q')
+
+def excel_cell(val):
+    # Same conversions DataFrame.to_excel applies: NaN -> empty, non-scalars -> str.
+    if isinstance(val, float) and val != val:
+        return None
+    if val is None or isinstance(val, (str, int, float, datetime)):
+        return val
+    return str(val)
+
+def excel_date(val):
+    """ISO 'YYYY-MM-DD' text -> datetime, so it is written as a real date; anything else as excel_cell."""
+    if isinstance(val, str):
+        try:
+            return datetime.strptime(val, '%Y-%m-%d')
+        except ValueError:
+            pass
+    return excel_cell(val)
+
+def excel_row(sheet, row, headers, date_columns=()):
+    """
+    Cell values for one row of a write-only sheet. Date columns become date cells
+    shown as YYYY-MM-DD, the way DataFrame.to_excel writes datetime64 columns.
+    """
+    values = []
+    for h in headers:
+        if h not in date_columns:
+            values.append(excel_cell(row.get(h)))
+            continue
+        val = excel_date(row.get(h))
+        if isinstance(val, datetime):
+            from openpyxl.cell import WriteOnlyCell
+
+            val = WriteOnlyCell(sheet, value=val)
+            val.number_format = 'YYYY-MM-DD'
+        values.append(val)
+    return values
+
+def part_path(output_file, index):
+    stem, ext = os.path.splitext(output_file)
+    return f"{stem}.part{index:03d}{ext or '.xlsx'}"
+
+def manifest_path(output_file):
+    return os.path.splitext(output_file)[0] + '.manifest.json'
+
+def _write_workbook(shard_path, xlsx_path, headers, rows_per_sheet, date_columns):
+    """Worker-process entry point: writes one staged shard as a workbook of one or more sheets."""
+    import openpyxl
+
+    date_columns = frozenset(date_columns)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheets = []
+    sheet = None
+    with open(shard_path, 'rb') as fh:
+        while True:
+            header = fh.read(_LENGTH.size)
+            if not header:
+                break
+            for row in decode_rows(fh.read(_LENGTH.unpack(header)[0])):
+                if sheet is None or sheets[-1]['rows'] >= rows_per_sheet:
+                    name = f"Sheet{len(sheets) + 1}"
+                    sheet = workbook.create_sheet(name)
+                    sheet.append(headers)
+                    sheets.append({'name': name, 'rows': 0})
+                sheet.append(excel_row(sheet, row, headers, date_columns))
+                sheets[-1]['rows'] += 1
+    if sheet is None:
+        workbook.create_sheet('Sheet1').append(headers)
+        sheets.append({'name': 'Sheet1', 'rows': 0})
+    workbook.save(xlsx_path)
+    os.remove(shard_path)
+    return sheets
+
+class _ShardStager:
+    """Accumulates rows for the shard being built and writes them to its staging file block by block."""
+
+    def __init__(self, tmpdir, index, headers):
+        self.path = os.path.join(tmpdir, f"shard-{index:04d}.bin")
+        self.headers = headers
+        self.fh = open(self.path, 'wb')
+        self.pending = []
+        self.rows = 0
+        self.first_pan = None
+        self.last_pan = None
+
+    def add(self, row, pan):
+        if self.rows == 0:
+            self.first_pan = pan
+        self.last_pan = pan
+        self.pending.append(row)
+        self.rows += 1
+        if len(self.pending) >= _BLOCK_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            block = encode_rows(self.pending, self.headers)
+            self.fh.write(_LENGTH.pack(len(block)))
+            self.fh.write(block)
+            self.pending = []
+
+    def close(self):
+        self._flush()
+        self.fh.close()
+
+def export_workbooks(chunks, output_file, headers, rows_per_file=EXPORT_ROWS_PER_FILE, rows_per_sheet=ROWS_PER_SHEET,
+                     split_by='rows', pan_column='pan', processes=EXPORT_PROCESSES, date_columns=()):
+    """
+    Writes rows to one or more workbooks and a manifest next to output_file.
+    A run that fits in one file is written to output_file itself; otherwise to
+    output_file.part001.xlsx, .part002.xlsx, ...
+    :param chunks: Iterable of lists of row dicts, in output order.
+    :param output_file: Str, target .xlsx path.
+    :param headers: List[str], columns to write.
+    :param rows_per_file: Int, rows per workbook.
+    :param rows_per_sheet: Int, rows per sheet within a workbook (capped at Excel's limit).
+    :param split_by: 'rows' splits at exactly rows_per_file; 'pan' only splits between PANs, so each PAN lives in one file.
+    :param processes: Int, worker processes writing workbooks. Defaults to one per CPU.
+    :param date_columns: Iterable[str], columns whose ISO date text is written as Excel dates.
+    :return: Dict, the manifest.
+    """
+    if split_by not in SPLIT_MODES:
+        raise ValueError(f"Unknown split mode: {split_by}")
+    rows_per_sheet = max(1, min(int(rows_per_sheet), ROWS_PER_SHEET))
+    rows_per_file = max(1, int(rows_per_file))
+    headers = list(headers)
+    start_time = time.time()
+
+    directory = os.path.dirname(os.path.abspath(output_file))
+    os.makedirs(directory, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(prefix='.export-', dir=directory)
+    # Spawned, not forked: callers are multi-threaded (scheduler pools, SQLite connections).
+    pool = concurrent.futures.ProcessPoolExecutor(
+        max_workers=processes or os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context('spawn')
+    )
+    shards = []
+    futures = []
+
+    def submit(stager):
+        stager.close()
+        tmp_xlsx = os.path.join(tmpdir, f"shard-{len(shards):04d}.xlsx")
+        futures.append(pool.submit(_write_workbook, stager.path, tmp_xlsx, headers, rows_per_sheet, tuple(date_columns)))
+        shards.append({'tmp': tmp_xlsx, 'rows': stager.rows, 'first_pan': stager.first_pan, 'last_pan': stager.last_pan})
+
+    try:
+        stager = _ShardStager(tmpdir, 0, headers)
+        for chunk in chunks:
+            for row in chunk:
+                pan = row.get(pan_column)
+                if stager.rows >= rows_per_file and (split_by == 'rows' or pan != stager.last_pan):
+                    submit(stager)
+                    stager = _ShardStager(tmpdir, len(shards), headers)
+                stager.add(row, pan)
+        if stager.rows or not shards:
+            submit(stager)
+        else:
+            stager.close()
+
+        files = []
+        for idx, (shard, future) in enumerate(zip(shards, futures)):
+            sheets = future.result()
+            target = output_file if len(shards) == 1 else part_path(output_file, idx + 1)
+            os.replace(shard['tmp'], target)
+            files.append({
+                'path': os.path.basename(target),
+                'rows': shard['rows'],
+                'first_pan': shard['first_pan'],
+                'last_pan': shard['last_pan'],
+                'sheets': sheets,
+            })
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    manifest = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'total_rows': sum(f['rows'] for f in files),
+        'split_by': split_by,
+        'rows_per_file': rows_per_file,
+        'rows_per_sheet': rows_per_sheet,
+        'elapsed_seconds': round(time.time() - start_time, 2),
+        'files': files,
+    }
+    with open(manifest_path(output_file), 'w') as fh:
+        json.dump(manifest, fh, indent=2, default=str)
+    print(f"Exported {manifest['total_rows']} rows to {len(files)} workbook(s); manifest at {manifest_path(output_file)}")
+    return manifest
@@ -0,0 +1,270 @@
+"""
+Hedged object-store downloads.
+
+A download that has been outstanding longer than a percentile of recent
+download latencies gets a duplicate request; whichever response arrives first
+is used and the other one is cancelled: its socket is shut down whether it is
+still connecting, waiting for headers or reading the body. Hedges are capped at
+a fraction of all requests, so a slow object store is not hit with twice the
+traffic. One fetcher is shared by every run in the process (get_hedged_fetcher),
+so latency samples and unused hedge budget carry over from run to run.
+"""
+import collections
+import concurrent.futures
+import json
+import os
+import socket
+import threading
+import time
+
+from resources import requests
+
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '0.95'))  # Hedge once a request outlives this share of recent ones
+HEDGE_MAX_RATE = float(os.getenv('HEDGE_MAX_RATE', '0.05'))  # Hedges issued per request, at most
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '0.25'))  # Seconds; never hedge sooner than this
+HEDGE_MIN_SAMPLES = 20  # Latencies needed before hedging starts
+HEDGE_WINDOW = 500  # Recent latencies the percentile is taken over
+HEDGE_MAX_BURST = 10  # Unused hedge budget is banked up to this many hedges
+HEDGE_POOL_SIZE = int(os.getenv('HEDGE_POOL_SIZE', '64'))  # Threads running primary and hedge downloads
+_CHUNK_BYTES = 64 * 1024
+
+class _Cancelled(Exception):
+    pass
+
+_current = threading.local()  # The _Attempt running on this download thread
+_owner_lock = threading.Lock()
+
+class _Attempt:
+    """One request of a hedged download, and the connection it is using right now."""
+
+    def __init__(self, label):
+        self.label = label
+        self.cancelled = threading.Event()
+        self.started = threading.Event()  # Set once a download thread picks the attempt up
+        self.started_at = None
+        self.conn = None
+
+    def attach(self, conn):
+        with _owner_lock:
+            if self.cancelled.is_set():
+                raise _Cancelled()
+            self.conn = conn
+            conn.hedge_attempt = self
+
+    def detach(self):
+        with _owner_lock:
+            if self.conn is not None and getattr(self.conn, 'hedge_attempt', None) is self:
+                self.conn.hedge_attempt = None
+            self.conn = None
+
+    def cancel(self):
+        with _owner_lock:
+            self.cancelled.set()
+            conn = self.conn
+            # A connection already handed back to the pool may belong to another request by now.
+            if conn is None or getattr(conn, 'hedge_attempt', None) is not self or conn.sock is None:
+                return
+            try:
+                # Wakes up the blocked connect/recv on the download thread; urllib3 then discards the connection.
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+def _register(conn):
+    attempt = getattr(_current, 'attempt', None)
+    if attempt is not None:
+        attempt.attach(conn)
+
+def _cancellable_session(pool_size):
+    """
+    requests.Session whose connections register with the attempt running on the current
+    thread (on connect and on every request), so _Attempt.cancel can shut their socket.
+    """
+    import urllib3
+
+    def tracked(pool_cls):
+        class TrackedConnection(pool_cls.ConnectionCls):
+            def connect(self):
+                _register(self)
+                return super().connect()
+
+            def request(self, *args, **kwargs):
+                _register(self)
+                return super().request(*args, **kwargs)
+
+        class TrackedPool(pool_cls):
+            ConnectionCls = TrackedConnection
+
+        return TrackedPool
+
+    class CancellableAdapter(requests.adapters.HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            # A copy: urllib3's default mapping is module-wide.
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': tracked(urllib3.HTTPConnectionPool),
+                'https': tracked(urllib3.HTTPSConnectionPool),
+            }
+
+    session = requests.Session()
+    adapter = CancellableAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+class FetchedResponse:
+    """Fully read response: the parts of requests.Response that callers use."""
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+def _download(session, url, timeout, attempt, record=None):
+    """
+    Runs one attempt on a download thread.
+    :param record: Optional callable(seconds), receives the attempt's own latency, timed from when it left the queue.
+    """
+    _current.attempt = attempt
+    attempt.started_at = time.monotonic()
+    attempt.started.set()
+    try:
+        if attempt.cancelled.is_set():
+            raise _Cancelled()
+        resp = session.get(url, timeout=timeout, stream=True)
+        try:
+            chunks = []
+            for chunk in resp.iter_content(_CHUNK_BYTES):
+                if attempt.cancelled.is_set():
+                    raise _Cancelled()
+                chunks.append(chunk)
+            fetched = FetchedResponse(resp.status_code, b''.join(chunks))
+        finally:
+            resp.close()
+        if record is not None:
+            record(time.monotonic() - attempt.started_at)
+        return fetched
+    finally:
+        attempt.detach()
+        _current.attempt = None
+
+class HedgedFetcher:
+    def __init__(self, percentile=HEDGE_PERCENTILE, max_rate=HEDGE_MAX_RATE, min_delay=HEDGE_MIN_DELAY,
+                 pool_size=HEDGE_POOL_SIZE):
+        """
+        :param percentile: Float (0-1), hedge a request once it has been outstanding longer than this
+                           percentile of the recent latencies.
+        :param max_rate: Float, hedges may be at most this fraction of requests (budget banked up to HEDGE_MAX_BURST).
+        :param min_delay: Float, lower bound on the hedge delay in seconds.
+        :param pool_size: Int, threads performing downloads (primaries and hedges).
+        """
+        self.percentile = min(max(percentile, 0.5), 0.999)
+        self.max_rate = max(0.0, max_rate)
+        self.min_delay = min_delay
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='hedged-fetch')
+        self._session = _cancellable_session(pool_size)
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=HEDGE_WINDOW)
+        self._delay = None
+        self._samples_since_delay = 0
+        self._budget = 0.0
+        self.requests = 0
+        self.hedges_issued = 0
+        self.hedges_won = 0
+
+    def _record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self._samples_since_delay += 1
+
+    def hedge_delay(self):
+        """Current hedge delay in seconds, or None while there are too few samples."""
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            if self._delay is None or self._samples_since_delay >= 20:
+                ordered = sorted(self._latencies)
+                self._delay = max(self.min_delay, ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))])
+                self._samples_since_delay = 0
+            return self._delay
+
+    def _take_hedge_budget(self):
+        with self._lock:
+            if self._budget < 1:
+                return False
+            self._budget -= 1
+            self.hedges_issued += 1
+            return True
+
+    def _start(self, url, timeout, attempts, label):
+        attempt = _Attempt(label)
+        future = self._pool.submit(_download, self._session, url, timeout, attempt, self._record)
+        attempts[future] = attempt
+        return future
+
+    def get(self, url, timeout=30):
+        """
+        Downloads url, hedging it if it runs long.
+        :return: FetchedResponse from whichever request finished first.
+        """
+        with self._lock:
+            self.requests += 1
+            self._budget = min(self._budget + self.max_rate, HEDGE_MAX_BURST)
+        attempts = {}
+        primary = self._start(url, timeout, attempts, 'primary')
+        delay = self.hedge_delay()
+        if delay is not None:
+            # The hedge clock starts when the primary is actually sent, not while it waits for a download thread.
+            while not attempts[primary].started.wait(0.05) and not primary.done():
+                pass
+            started_at = attempts[primary].started_at
+            remaining = delay - (time.monotonic() - started_at) if started_at is not None else 0
+            done, _ = concurrent.futures.wait([primary], timeout=max(0.0, remaining))
+            if not done and self._take_hedge_budget():
+                self._start(url, timeout, attempts, 'hedge')
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                # First response wins; the other request is cut off wherever it is.
+                for other in pending:
+                    if not other.cancel():
+                        attempts[other].cancel()
+                if attempts[future].label == 'hedge':
+                    with self._lock:
+                        self.hedges_won += 1
+                return result
+        raise error
+
+    def stats(self):
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hedges_issued': self.hedges_issued,
+                'hedges_won': self.hedges_won,
+                'hedge_delay_seconds': round(delay, 3) if delay is not None else None,
+            }
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._session.close()
+
+_shared_fetcher = None
+_shared_lock = threading.Lock()
+
+def get_hedged_fetcher():
+    """Process-wide HedgedFetcher, so latency samples and hedge budget carry over between runs."""
+    global _shared_fetcher
+    with _shared_lock:
+        if _shared_fetcher is None:
+            _shared_fetcher = HedgedFetcher()
+        return _shared_fetcher
@@ -0,0 +1,428 @@
+"""
+Local job queue for run_processor.
+
+Job state, progress and output artifacts are persisted in a SQLite database
+under JOBS_DIR. The Streamlit UI submits jobs and polls them by id, while a
+single background worker process (`python jobs.py worker`) executes them, so
+long runs survive UI reruns and concurrent load is capped in one place.
+
+Jobs are classified as 'interactive' (a handful of specific PANs) or 'bulk'.
+Interactive jobs are claimed first, each class has its own job slots, and all
+running jobs share one scheduler.PriorityScheduler so interactive fetches run
+ahead of queued bulk work.
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from export import manifest_path
+from pan_input import write_pans_file
+from rollup import PanRollup
+from scheduler import PRIORITY_CLASSES, DEFAULT_TOTAL_WORKERS, PriorityScheduler
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+JOBS_DIR = os.getenv('JOBS_DIR', 'jobs')
+JOBS_DB = os.path.join(JOBS_DIR, 'jobs.sqlite3')
+INTERACTIVE_PAN_LIMIT = int(os.getenv('INTERACTIVE_PAN_LIMIT', '50'))  # Jobs with up to this many PANs are interactive
+JOB_SLOTS = {  # Concurrently running jobs per priority class
+    'interactive': int(os.getenv('INTERACTIVE_JOB_SLOTS', '4')),
+    'bulk': int(os.getenv('BULK_JOB_SLOTS', '1')),
+}
+JOB_PAN_BATCH_SIZE = int(os.getenv('JOB_PAN_BATCH_SIZE', '5000'))  # Larger PAN lists are stored in a file and run in batches of this size
+PREFETCH_ENABLED = os.getenv('PREFETCH', '0') == '1'  # Run the background prefetcher (prefetch.py) inside the worker
+POLL_INTERVAL = 1.0  # Seconds between queue polls
+HEARTBEAT_TIMEOUT = 15  # Seconds before a silent worker is considered dead
+
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    priority_class TEXT NOT NULL DEFAULT 'bulk',
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    progress_current INTEGER DEFAULT 0,
+    progress_total INTEGER DEFAULT 0,
+    message TEXT,
+    cancel_requested INTEGER DEFAULT 0,
+    artifacts TEXT,
+    stats TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority_class, created_at);
+CREATE TABLE IF NOT EXISTS worker (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    pid INTEGER,
+    heartbeat REAL
+);
+"""
+
+# ==========================================
+# STORAGE HELPERS
+# ==========================================
+
+def _connect():
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+    if columns and 'priority_class' not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN priority_class TEXT NOT NULL DEFAULT 'bulk'")
+    conn.executescript(_SCHEMA)
+    return conn
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job['params'] = json.loads(job['params']) if job['params'] else {}
+    job['artifacts'] = json.loads(job['artifacts']) if job['artifacts'] else {}
+    job['stats'] = json.loads(job['stats']) if job['stats'] else {}
+    return job
+
+def _update_job(job_id, **fields):
+    if not fields:
+        return
+    assignments = ", ".join(f"{key} = ?" for key in fields)
+    conn = _connect()
+    try:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", list(fields.values()) + [job_id])
+    finally:
+        conn.close()
+
+def job_dir(job_id):
+    return os.path.join(JOBS_DIR, job_id)
+
+# ==========================================
+# PUBLIC API (used by the UI)
+# ==========================================
+
+def classify_job(specific_pans):
+    if specific_pans and len(specific_pans) <= INTERACTIVE_PAN_LIMIT:
+        return 'interactive'
+    return 'bulk'
+
+def submit_job(max_workers=20, specific_pans=None, priority_class=None, adaptive=False, hedge=False):
+    """
+    Queues a run_processor job.
+    :param specific_pans: Sized iterable of PANs (list or pan_input.PanSet). Lists longer than
+                          JOB_PAN_BATCH_SIZE are written to the job's pans.txt and processed in batches.
+    :param adaptive: Bool, let run_processor tune download concurrency up to max_workers.
+    :param hedge: Bool, let run_processor send a duplicate request for straggling downloads.
+    :param priority_class: Str, 'interactive' or 'bulk'. Derived from the PAN count if omitted.
+    :return: Str, the job id used to poll and re-attach.
+    """
+    job_id = uuid.uuid4().hex[:12]
+    specific_pans = specific_pans or []
+    priority_class = priority_class or classify_job(specific_pans)
+    if priority_class not in JOB_SLOTS:
+        raise ValueError(f"Unknown job priority class: {priority_class}")
+    params = {
+        'max_workers': int(max_workers),
+        'specific_pans': [],
+        'adaptive': bool(adaptive),
+        'hedge': bool(hedge),
+    }
+    if len(specific_pans) > JOB_PAN_BATCH_SIZE:
+        # Keeps the jobs table small and lets the worker stream the list batch by batch.
+        os.makedirs(job_dir(job_id), exist_ok=True)
+        params['pans_file'] = os.path.join(job_dir(job_id), 'pans.txt')
+        params['pan_count'] = write_pans_file(specific_pans, params['pans_file'])
+    else:
+        params['specific_pans'] = list(specific_pans)
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, status, params, priority_class, created_at, message) VALUES (?, 'queued', ?, ?, ?, ?)",
+            (job_id, json.dumps(params), priority_class, time.time(), "Queued. Waiting for a worker slot...")
+        )
+    finally:
+        conn.close()
+    return job_id
+
+def get_job(job_id):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return _row_to_job(row)
+
+def list_jobs(limit=20):
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [_row_to_job(row) for row in rows]
+
+def cancel_job(job_id):
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ?, message = 'Cancelled before start.' "
+            "WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id)
+        )
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+    finally:
+        conn.close()
+
+def is_worker_alive():
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT heartbeat FROM worker WHERE id = 1").fetchone()
+    finally:
+        conn.close()
+    return bool(row and row['heartbeat'] and time.time() - row['heartbeat'] < HEARTBEAT_TIMEOUT)
+
+def ensure_worker():
+    """Starts a detached worker process unless a live one is already heartbeating."""
+    if is_worker_alive():
+        return False
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    with open(os.path.join(JOBS_DIR, 'worker.log'), 'a') as log_file:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'worker'],
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            cwd=os.getcwd(),
+            start_new_session=True
+        )
+    return True
+
+# ==========================================
+# WORKER
+# ==========================================
+
+def _register_worker():
+    """Claims the single worker slot. Returns False if another worker is alive."""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT pid, heartbeat FROM worker WHERE id = 1").fetchone()
+        now = time.time()
+        if row and row['heartbeat'] and now - row['heartbeat'] < HEARTBEAT_TIMEOUT and row['pid'] != os.getpid():
+            conn.execute("ROLLBACK")
+            return False
+        conn.execute("INSERT OR REPLACE INTO worker (id, pid, heartbeat) VALUES (1, ?, ?)", (os.getpid(), now))
+        # Jobs left 'running' by a dead worker are picked up again.
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', message = 'Re-queued after worker restart.' WHERE status = 'running'"
+        )
+        conn.execute("COMMIT")
+        return True
+    finally:
+        conn.close()
+
+def _heartbeat():
+    conn = _connect()
+    try:
+        conn.execute("UPDATE worker SET heartbeat = ? WHERE id = 1 AND pid = ?", (time.time(), os.getpid()))
+    finally:
+        conn.close()
+
+def _claim_next_job(open_classes):
+    """Claims the oldest queued job of the highest-priority class that has a free slot."""
+    open_classes = [cls for cls in PRIORITY_CLASSES if cls in open_classes]
+    if not open_classes:
+        return None
+    placeholders = ", ".join(["?"] * len(open_classes))
+    rank = " ".join(f"WHEN '{cls}' THEN {idx}" for idx, cls in enumerate(PRIORITY_CLASSES))
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            f"SELECT * FROM jobs WHERE status = 'queued' AND priority_class IN ({placeholders}) "
+            f"ORDER BY CASE priority_class {rank} END, created_at LIMIT 1",
+            open_classes
+        ).fetchone()
+        if row is None:
+            conn.execute("ROLLBACK")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', started_at = ?, message = 'Starting...' WHERE id = ?",
+            (time.time(), row['id'])
+        )
+        conn.execute("COMMIT")
+        return _row_to_job(row)
+    finally:
+        conn.close()
+
+def _merge_batch_stats(run_stats, batch_stats):
+    for key, value in batch_stats.items():
+        if key == 'payload_shapes':
+            shapes = run_stats.setdefault(key, {})
+            for name, count in value.items():
+                shapes[name] = shapes.get(name, 0) + count
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            run_stats[key] = run_stats.get(key, 0) + value
+        else:
+            run_stats[key] = value
+
+def _run_pan_batches(process_experian, params, csv_path, xlsx_path, progress_callback, run_stats, **run_options):
+    """
+    Large PAN lists: one run_processor call per JOB_PAN_BATCH_SIZE PANs read from the job's
+    pans file, every batch streaming its rows into the same CSV and workbook.
+    """
+    from sinks import TeeSink, open_sink
+
+    headers = process_experian.TARGET_HEADERS
+    sink = TeeSink(open_sink('csv', csv_path, headers), open_sink('xlsx', xlsx_path, headers, date_columns=process_experian.DATE_COLUMNS))
+    batch_count = -(-(params.get('pan_count') or 0) // JOB_PAN_BATCH_SIZE)
+    pans_done = 0
+    try:
+        pans = process_experian.iter_pans([params['pans_file']])
+        for batch_no, batch in enumerate(process_experian.iter_batches(pans, JOB_PAN_BATCH_SIZE), start=1):
+            if run_options['should_stop']():
+                break
+            prefix = f"Batch {batch_no}/{batch_count} ({pans_done} PANs done)"
+
+            def on_batch_progress(current, total, message, event=None, prefix=prefix):
+                progress_callback(current, total, f"{prefix}: {message}", event)
+
+            batch_stats = {}
+            process_experian.run_processor(
+                specific_pans=batch, progress_callback=on_batch_progress, row_sink=sink,
+                run_stats=batch_stats, **run_options
+            )
+            _merge_batch_stats(run_stats, batch_stats)
+            run_stats['batches'] = batch_no
+            pans_done += len(batch)
+    finally:
+        sink.close()
+
+def _execute_job(job, scheduler):
+    import process_experian
+
+    job_id = job['id']
+    params = job['params']
+    out_dir = job_dir(job_id)
+    os.makedirs(out_dir, exist_ok=True)
+    xlsx_path = os.path.join(out_dir, 'processed_trade_lines.xlsx')
+    csv_path = os.path.join(out_dir, 'processed_trade_lines.csv')
+    rollup_path = os.path.join(out_dir, 'pan_rollup.csv')
+
+    cancel_state = {'checked_at': 0.0, 'cancelled': False}
+
+    def on_progress(current, total, message, event=None):
+        # Already rate-limited and coalesced by run_processor's progress reporter.
+        fields = dict(progress_current=current, progress_total=total, message=message)
+        if event:
+            fields['stats'] = json.dumps({'progress': event})
+        _update_job(job_id, **fields)
+
+    def should_stop():
+        now = time.time()
+        if now - cancel_state['checked_at'] >= POLL_INTERVAL:
+            cancel_state['checked_at'] = now
+            current = get_job(job_id)
+            cancel_state['cancelled'] = bool(current and current['cancel_requested'])
+        return cancel_state['cancelled']
+
+    run_stats = {}
+    run_options = dict(
+        max_workers=params.get('max_workers') or 20,
+        should_stop=should_stop,
+        scheduler=scheduler,
+        priority_class=job['priority_class'],
+        adaptive=params.get('adaptive', False),
+        hedge=params.get('hedge', False),
+        rollup=PanRollup(),
+    )
+    try:
+        if params.get('pans_file'):
+            _run_pan_batches(process_experian, params, csv_path, xlsx_path, on_progress, run_stats, **run_options)
+        else:
+            process_experian.run_processor(
+                specific_pans=params.get('specific_pans') or None,
+                progress_callback=on_progress,
+                output_file=xlsx_path,
+                csv_file=csv_path,
+                run_stats=run_stats,
+                **run_options
+            )
+        if should_stop():
+            _update_job(job_id, status='cancelled', finished_at=time.time(), message="Job cancelled.")
+            return
+
+        # Large or batched runs never build a DataFrame (spilled / streamed to sinks), so go by the files written.
+        artifacts = {}
+        if run_stats.get('rows') and os.path.exists(csv_path):
+            artifacts['csv'] = csv_path
+            export_files = run_stats.get('export', {}).get('files') or []
+            if len(export_files) > 1:
+                artifacts['xlsx_parts'] = [os.path.join(out_dir, name) for name in export_files]
+                artifacts['manifest'] = manifest_path(xlsx_path)
+            elif os.path.exists(xlsx_path):
+                artifacts['xlsx'] = xlsx_path
+            artifacts['rollup'] = run_options['rollup'].write(rollup_path)
+        _update_job(
+            job_id,
+            status='completed',
+            finished_at=time.time(),
+            artifacts=json.dumps(artifacts),
+            stats=json.dumps(run_stats),
+            message="Job Finished Successfully." if artifacts else "Job finished with no data."
+        )
+    except Exception as e:
+        traceback.print_exc()
+        _update_job(job_id, status='failed', finished_at=time.time(), error=str(e), message=f"Error: {e}")
+
+def run_worker(job_slots=None, total_workers=DEFAULT_TOTAL_WORKERS, prefetch=PREFETCH_ENABLED):
+    """
+    Worker main loop. Runs up to job_slots[cls] jobs per priority class at once,
+    all sharing one PriorityScheduler of total_workers fetch threads.
+    :param prefetch: Bool, also warm the result store with newly landed reports in the scheduler's background class.
+    """
+    if not _register_worker():
+        print("Another job worker is already running. Exiting.")
+        return
+
+    job_slots = job_slots or JOB_SLOTS
+    scheduler = PriorityScheduler(total_workers=total_workers, name='job-fetch')
+    print(f"Job worker started (pid {os.getpid()}), job slots {job_slots}, {total_workers} shared fetch threads.")
+    if prefetch:
+        from prefetch import Prefetcher
+
+        Prefetcher(scheduler).start()
+        print("Background prefetcher started.")
+    running = {}  # job_id -> (priority_class, thread)
+
+    while True:
+        _heartbeat()
+        for job_id in [jid for jid, (_, thread) in running.items() if not thread.is_alive()]:
+            del running[job_id]
+
+        while True:
+            busy = {cls: 0 for cls in job_slots}
+            for cls, _ in running.values():
+                busy[cls] = busy.get(cls, 0) + 1
+            job = _claim_next_job([cls for cls, slots in job_slots.items() if busy.get(cls, 0) < slots])
+            if job is None:
+                break
+            print(f"Starting {job['priority_class']} job {job['id']}.")
+            thread = threading.Thread(target=_execute_job, args=(job, scheduler), daemon=True)
+            thread.start()
+            running[job['id']] = (job['priority_class'], thread)
+
+        time.sleep(POLL_INTERVAL)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        run_worker(prefetch=PREFETCH_ENABLED or '--prefetch' in sys.argv[2:])
+    else:
+        print("Usage: python jobs.py worker [--prefetch]")
@@ -0,0 +1,378 @@
+"""
+Local HTTP/JSON lookup service for single PANs and small batches.
+
+Serves tradeline rows for a PAN with the same resolution and transform logic
+as run_processor (latest qfinance report first, api_server fallback), without
+a DataFrame or an output file. The database connection pool, HTTP session,
+result store and single-flight layer are shared with the processor, and recent
+answers are kept in an in-memory LRU with a TTL, so repeat lookups are
+answered from memory.
+
+    python lookup_service.py                       # serve on LOOKUP_HOST:LOOKUP_PORT
+    python lookup_service.py bench --requests 5000 # load test against a local stand-in backend
+
+Endpoints:
+    GET  /pan/<PAN>              -> {"pan", "source", "rows", "cached"}
+    POST /pans {"pans": [...]}   -> {"results": {pan: {...}}} (at most LOOKUP_MAX_BATCH PANs)
+    GET  /health                 -> cache and request counters
+    A backend failure (including any PAN whose report could not be downloaded) is answered with
+    503 {"error", "detail"}. Only answers with rows are cached, so a PAN is retried once the store recovers.
+"""
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import random
+import sys
+import threading
+import time
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from resources import PAN_PATTERN, get_db_connection
+
+LOOKUP_HOST = os.getenv('LOOKUP_HOST', '127.0.0.1')
+LOOKUP_PORT = int(os.getenv('LOOKUP_PORT', '8765'))
+LOOKUP_CACHE_SIZE = int(os.getenv('LOOKUP_CACHE_SIZE', '20000'))  # PAN results kept in memory
+LOOKUP_CACHE_TTL = float(os.getenv('LOOKUP_CACHE_TTL', '300'))  # Seconds a cached PAN result is served
+LOOKUP_WORKERS = int(os.getenv('LOOKUP_WORKERS', '16'))  # Parallel report downloads for cache misses
+LOOKUP_MAX_BATCH = int(os.getenv('LOOKUP_MAX_BATCH', '1000'))
+
+class LookupBackendError(Exception):
+    """Some PANs of a lookup could not be resolved (their report failed to download)."""
+
+class TTLCache:
+    """Thread-safe LRU of at most max_entries values, each served for ttl seconds."""
+
+    def __init__(self, max_entries=LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+# ==========================================
+# RESOLUTION
+# ==========================================
+
+class ProcessorBackend:
+    """
+    Resolves PANs exactly like run_processor: latest qfinance report per PAN
+    (PAN index or direct query), then the api_server fallback for the rest.
+    """
+
+    def __init__(self, workers=LOOKUP_WORKERS):
+        import process_experian
+
+        self.pe = process_experian
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='lookup-fetch')
+
+    def _latest_qfinance(self, cursor, index, pans):
+        latest = {}
+        for raw_pan, json_filename in self.pe.resolve_qfinance_records(cursor, index, pans):
+            pan = str(raw_pan).strip().upper()
+            if pan in latest or not json_filename or str(json_filename).lower() == 'null':
+                continue
+            latest[pan] = (raw_pan, json_filename)
+        return latest
+
+    def __call__(self, pans):
+        """
+        :return: Dict pan -> {'source': source key or None, 'rows': [...]}, plus 'error' for a PAN whose
+                 report failed to download (its empty rows are not an answer).
+        """
+        pe = self.pe
+        store = pe.get_result_store()
+        conn = get_db_connection(pe.DB_CONFIG)
+        cursor = conn.cursor()
+        try:
+            index = pe.get_ready_pan_index(cursor) if pe.USE_PAN_INDEX else None
+            latest = self._latest_qfinance(cursor, index, pans)
+            futures = {
+                pan: self._pool.submit(pe.fetch_and_process_task, task, result_store=store, raise_errors=True)
+                for pan, task in latest.items()
+            }
+            results = {}
+            for pan, future in futures.items():
+                raw_pan, json_filename = latest[pan]
+                results[pan] = {'source': pe.qfinance_source_key(json_filename, raw_pan), 'rows': []}
+                try:
+                    results[pan]['rows'] = future.result()
+                except pe.ReportFetchError as e:
+                    results[pan]['error'] = str(e)
+
+            missing = [pan for pan in pans if pan not in latest]
+            if missing:
+                groups = []
+                pe.fetch_api_server_fallback_rows(
+                    cursor, missing, result_store=store,
+                    latest_reports=pe.resolve_api_server_reports(cursor, index, missing) if index is not None else None,
+                    row_groups=groups
+                )
+                for source_key, rows in groups:
+                    if rows:
+                        results[rows[0]['pan']] = {'source': source_key, 'rows': rows}
+        finally:
+            cursor.close()
+            conn.close()
+        for pan in pans:
+            results.setdefault(pan, {'source': None, 'rows': []})
+        return results
+
+class PanLookup:
+    def __init__(self, backend=None, cache=None):
+        """
+        :param backend: Callable(list of normalized PANs) -> {pan: {'source', 'rows'[, 'error']}}. Defaults to ProcessorBackend;
+                        pass a stand-in to load-test the service without the databases.
+        :param cache: TTLCache for recent PAN results.
+        """
+        self.backend = backend or ProcessorBackend()
+        self.cache = cache or TTLCache()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.backend_calls = 0
+
+    def lookup_many(self, pans):
+        """
+        :param pans: Iterable of PANs in any case/spacing; invalid ones are reported as such.
+        :return: Dict pan -> {'pan', 'source', 'rows', 'cached'} (or {'pan', 'error'} for an invalid PAN).
+        :raises LookupBackendError: If any PAN's report failed to download. The PANs that did resolve are cached first,
+                                    so a retry only goes back to the backend for the failed ones.
+        """
+        results = {}
+        misses = {}  # Ordered set
+        for raw in pans:
+            pan = str(raw).strip().upper()
+            if pan in results or pan in misses:
+                continue
+            if not PAN_PATTERN.fullmatch(pan):
+                results[pan] = {'pan': pan, 'error': 'not a valid PAN'}
+                continue
+            cached = self.cache.get(pan)
+            if cached is not None:
+                results[pan] = {'pan': pan, **cached, 'cached': True}
+            else:
+                misses[pan] = None
+        with self._lock:
+            self.requests += 1
+            if misses:
+                self.backend_calls += 1
+        failed = {}
+        if misses:
+            for pan, result in self.backend(list(misses)).items():
+                if result.get('error'):
+                    failed[pan] = result['error']
+                    continue
+                entry = {'source': result.get('source'), 'rows': result.get('rows') or []}
+                # A PAN without rows may only be missing for now (e.g. a report still being written); ask again next time.
+                if entry['rows']:
+                    self.cache.put(pan, entry)
+                results[pan] = {'pan': pan, **entry, 'cached': False}
+        if failed:
+            raise LookupBackendError(f"{len(failed)} of {len(misses)} reports failed to download: "
+                                     + "; ".join(list(failed.values())[:5]))
+        return results
+
+    def lookup(self, pan):
+        return next(iter(self.lookup_many([pan]).values()))
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'backend_calls': self.backend_calls, 'cache': self.cache.stats()}
+
+# ==========================================
+# HTTP SERVER
+# ==========================================
+
+class LookupHandler(BaseHTTPRequestHandler):
+    lookup = None  # Set by make_server
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so clients don't reconnect per lookup
+    disable_nagle_algorithm = True  # Headers and body go out as separate writes; don't hold the body for an ACK
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _run_lookup(self, fn, arg):
+        """
+        Runs a lookup; a backend failure (database, object store, result store) is logged and answered
+        with a JSON 503 instead of killing the handler thread and resetting the connection.
+        :return: The lookup result, or None if the error response was already sent.
+        """
+        try:
+            return fn(arg)
+        except Exception as e:
+            print(f"[WARN] Lookup failed: {e}")
+            self._send(503, {'error': 'lookup backend failed', 'detail': str(e)})
+            return None
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0].rstrip('/')
+        if path == '/health':
+            self._send(200, {'status': 'ok', **self.lookup.stats()})
+        elif path.startswith('/pan/'):
+            result = self._run_lookup(self.lookup.lookup, path[len('/pan/'):])
+            if result is not None:
+                self._send(400 if 'error' in result else 200, result)
+        else:
+            self._send(404, {'error': 'unknown endpoint'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/pans':
+            self._send(404, {'error': 'unknown endpoint'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            pans = body.get('pans') if isinstance(body, dict) else body
+            if not isinstance(pans, list):
+                raise ValueError("expected {\"pans\": [...]}")
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+            return
+        if len(pans) > LOOKUP_MAX_BATCH:
+            self._send(413, {'error': f"at most {LOOKUP_MAX_BATCH} PANs per request"})
+            return
+        results = self._run_lookup(self.lookup.lookup_many, pans)
+        if results is not None:
+            self._send(200, {'results': results})
+
+    def log_message(self, format, *args):
+        pass  # One line per request would dominate the cost of a cached lookup
+
+def make_server(lookup, host=LOOKUP_HOST, port=LOOKUP_PORT):
+    handler = type('BoundLookupHandler', (LookupHandler,), {'lookup': lookup})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+# ==========================================
+# LOAD TEST
+# ==========================================
+
+def standin_backend(latency=0.05, rows_per_pan=8):
+    """Backend stand-in for load tests: sleeps like a cold fetch and returns synthetic rows."""
+    def backend(pans):
+        time.sleep(latency)
+        return {pan: {'source': f"standin:{pan}", 'rows': [{'pan': pan, 'fiName': f"Lender {i}", 'EMI': 1000.0 * i}
+                                                           for i in range(rows_per_pan)]} for pan in pans}
+    return backend
+
+def _random_pan(rng):
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    return ''.join(rng.choice(letters) for _ in range(5)) + f"{rng.randrange(10000):04d}" + rng.choice(letters)
+
+def run_benchmark(url, requests=5000, concurrency=16, distinct_pans=200, seed=1):
+    """
+    Fires GET /pan/<PAN> requests over a fixed set of PANs from concurrency keep-alive clients.
+    :return: Dict with request counts and latency percentiles in milliseconds, separately for cached and uncached answers.
+    """
+    rng = random.Random(seed)
+    pans = [_random_pan(rng) for _ in range(distinct_pans)]
+    target = urlsplit(url)
+    latencies = []
+    lock = threading.Lock()
+
+    def client(count, client_seed):
+        local_rng = random.Random(client_seed)
+        conn = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+        mine = []
+        try:
+            for _ in range(count):
+                started = time.perf_counter()
+                conn.request('GET', f"/pan/{local_rng.choice(pans)}")
+                cached = json.loads(conn.getresponse().read()).get('cached', False)
+                mine.append((time.perf_counter() - started, cached))
+        finally:
+            conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    per_client = max(1, requests // concurrency)
+    started = time.time()
+    threads = [threading.Thread(target=client, args=(per_client, seed + i)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    def percentiles(values):
+        values = sorted(values)
+        if not values:
+            return {}
+        pct = lambda p: round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2)
+        return {'count': len(values), 'p50_ms': pct(0.50), 'p99_ms': pct(0.99), 'max_ms': round(values[-1] * 1000, 2)}
+
+    return {
+        'requests': len(latencies),
+        'elapsed_seconds': round(elapsed, 2),
+        'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'cached': percentiles([latency for latency, cached in latencies if cached]),
+        'uncached': percentiles([latency for latency, cached in latencies if not cached]),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve tradeline lookups for single PANs over HTTP/JSON.")
+    parser.add_argument('command', nargs='?', choices=('serve', 'bench'), default='serve')
+    parser.add_argument('--host', default=LOOKUP_HOST)
+    parser.add_argument('--port', type=int, default=LOOKUP_PORT)
+    parser.add_argument('--requests', type=int, default=5000, help="bench: total requests.")
+    parser.add_argument('--concurrency', type=int, default=16, help="bench: parallel clients.")
+    parser.add_argument('--pans', type=int, default=200, help="bench: distinct PANs requested.")
+    parser.add_argument('--standin-latency', type=float, default=0.05, help="bench: seconds per stand-in backend call.")
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        # Port 0: any free port, so a benchmark never collides with a running service.
+        lookup = PanLookup(backend=standin_backend(args.standin_latency))
+        server = make_server(lookup, '127.0.0.1', 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            result = run_benchmark(f"http://127.0.0.1:{server.server_address[1]}", args.requests, args.concurrency, args.pans)
+        finally:
+            server.shutdown()
+        print(json.dumps({**result, **lookup.stats()}, indent=2))
+        return 0
+
+    server = make_server(PanLookup(), args.host, args.port)
+    print(f"Lookup service listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
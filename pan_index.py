@@ -0,0 +1,351 @@
+"""
+Local PAN -> latest report index.
+
+Mirrors, in an embedded SQLite file, the latest qfinance.q_report
+recommendationJsonFile and the latest SUCCESS api_server.credit_reports id
+for every normalized PAN. The mirror is refreshed incrementally using a
+createdAt watermark, so filtered runs resolve their task list with indexed
+local lookups instead of the UPPER(TRIM(...)) IN (...) scans on production.
+
+Rows that are not usable yet when they are first read (a q_report row whose
+recommendationJsonFile is filled in later, a credit_reports row that
+is still in progress) are kept as pending and re-read by key on every refresh
+until they resolve, fail, are superseded by a newer report, or age out.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+PAN_INDEX_PATH = os.getenv('PAN_INDEX_PATH', os.path.join('cache', 'pan_index.sqlite3'))
+REFRESH_INTERVAL = int(os.getenv('PAN_INDEX_REFRESH_INTERVAL', '60'))  # Seconds between incremental refreshes
+PENDING_MAX_AGE_DAYS = int(os.getenv('PAN_INDEX_PENDING_DAYS', '7'))  # Stop re-checking unresolved rows after this many days
+API_IN_PROGRESS_STATUSES = {
+    status.strip().upper()
+    for status in os.getenv('PAN_INDEX_IN_PROGRESS_STATUSES', 'PENDING,INITIATED,IN_PROGRESS,PROCESSING').split(',')
+    if status.strip()
+}  # credit_reports statuses that may still reach SUCCESS; any other non-SUCCESS status is final
+FETCH_BATCH_SIZE = 5000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS qfinance_latest (
+    pan TEXT PRIMARY KEY,
+    raw_pan TEXT NOT NULL,
+    json_filename TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS api_server_latest (
+    pan TEXT PRIMARY KEY,
+    report_id TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_qfinance_latest_created ON qfinance_latest (created_at);
+CREATE INDEX IF NOT EXISTS idx_api_server_latest_created ON api_server_latest (created_at);
+CREATE TABLE IF NOT EXISTS qfinance_pending (
+    raw_pan TEXT NOT NULL,
+    pan TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (raw_pan, created_at)
+);
+CREATE TABLE IF NOT EXISTS api_server_pending (
+    report_id TEXT PRIMARY KEY,
+    pan TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    source TEXT PRIMARY KEY,
+    created_at TEXT,
+    refreshed_at REAL
+);
+"""
+
+def _normalize_pan(pan):
+    return str(pan).strip().upper() if pan is not None else ''
+
+def _timestamp(val):
+    if isinstance(val, datetime):
+        return val.isoformat(sep=' ')
+    return str(val) if val is not None else ''
+
+class PanIndex:
+    def __init__(self, path=PAN_INDEX_PATH, refresh_interval=REFRESH_INTERVAL):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _watermark(self, source):
+        row = self._conn().execute("SELECT created_at, refreshed_at FROM watermarks WHERE source = ?", (source,)).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def is_built(self):
+        """True once a refresh of both sources has completed (refreshed_at is only set at the end of one)."""
+        return all(self._watermark(source)[1] for source in ('qfinance', 'api_server'))
+
+    def is_fresh(self, max_age=None):
+        """
+        True if both sources finished a refresh within max_age seconds.
+        :param max_age: Float, default twice refresh_interval (a run that has just skipped a refresh is still fresh).
+        """
+        max_age = 2 * self.refresh_interval if max_age is None else max_age
+        refreshed = [self._watermark(source)[1] for source in ('qfinance', 'api_server')]
+        return all(refreshed) and time.time() - min(refreshed) < max_age
+
+    # ------------------------------------------
+    # REFRESH
+    # ------------------------------------------
+
+    def refresh(self, cursor, force=False, full=False):
+        """
+        Pulls rows created since the last watermark from both source tables, then re-reads pending rows.
+        Skipped if the index was refreshed within refresh_interval unless force/full.
+        :param full: Bool, ignore watermarks and rescan both tables.
+        :return: Dict, rows seen per source plus pending rows still unresolved (empty if skipped).
+        """
+        with self._refresh_lock:
+            if not (force or full) and self.is_fresh(self.refresh_interval):
+                return {}
+
+            counts = {}
+            since, _ = self._watermark('qfinance')
+            counts['qfinance'] = self._refresh_source(
+                cursor, 'qfinance',
+                "SELECT pancardNumber, recommendationJsonFile, createdAt FROM qfinance.q_report",
+                None if full else since,
+                self._upsert_qfinance
+            )
+            since, _ = self._watermark('api_server')
+            counts['api_server'] = self._refresh_source(
+                cursor, 'api_server',
+                "SELECT panNumber, id, createdAt, status FROM api_server.credit_reports",
+                None if full else since,
+                self._upsert_api_server
+            )
+            counts['pending'] = self._recheck_pending(cursor)
+            now = time.time()
+            for source in ('qfinance', 'api_server'):
+                self._conn().execute(
+                    "INSERT INTO watermarks (source, refreshed_at) VALUES (?, ?) "
+                    "ON CONFLICT(source) DO UPDATE SET refreshed_at = excluded.refreshed_at",
+                    (source, now)
+                )
+            return counts
+
+    def _refresh_source(self, cursor, source, select, since, upsert):
+        params = ()
+        query = select
+        if since:
+            # >= rather than >: rows sharing the watermark second are re-read, upserts are idempotent.
+            query += " WHERE createdAt >= %s"
+            params = (since,)
+        query += " ORDER BY createdAt ASC"
+
+        cursor.execute(query, params)
+        seen = 0
+        watermark = since
+        conn = self._conn()
+        while True:
+            batch = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not batch:
+                break
+            seen += len(batch)
+            conn.execute("BEGIN")
+            upsert(conn, batch)
+            watermark = _timestamp(batch[-1][2]) or watermark
+            # Keeps refreshed_at: an interrupted first build must not look like a built index.
+            conn.execute(
+                "INSERT INTO watermarks (source, created_at) VALUES (?, ?) "
+                "ON CONFLICT(source) DO UPDATE SET created_at = excluded.created_at",
+                (source, watermark)
+            )
+            conn.execute("COMMIT")
+        return seen
+
+    def _recheck_pending(self, cursor):
+        """
+        Re-reads pending rows by key and upserts whatever became usable. Pending rows are dropped once the
+        index holds a report for their PAN at least as new (their own, or a newer one), once an api_server
+        report reaches a final non-SUCCESS status, or after PENDING_MAX_AGE_DAYS.
+        :return: Int, pending rows left.
+        """
+        conn = self._conn()
+        cutoff = _timestamp(datetime.now() - timedelta(days=PENDING_MAX_AGE_DAYS))
+        conn.execute("DELETE FROM qfinance_pending WHERE created_at < ?", (cutoff,))
+        conn.execute("DELETE FROM api_server_pending WHERE created_at < ?", (cutoff,))
+
+        pending = conn.execute("SELECT raw_pan, MIN(created_at) FROM qfinance_pending GROUP BY raw_pan").fetchall()
+        for start in range(0, len(pending), 500):
+            chunk = pending[start:start + 500]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(
+                "SELECT pancardNumber, recommendationJsonFile, createdAt FROM qfinance.q_report "
+                f"WHERE pancardNumber IN ({placeholders}) AND createdAt >= %s",
+                [raw_pan for raw_pan, _ in chunk] + [min(created_at for _, created_at in chunk)]
+            )
+            rows = cursor.fetchall()
+            conn.execute("BEGIN")
+            self._upsert_qfinance(conn, rows)
+            conn.execute("COMMIT")
+
+        pending = [row[0] for row in conn.execute("SELECT report_id FROM api_server_pending").fetchall()]
+        for start in range(0, len(pending), 500):
+            chunk = [_coerce_id(report_id) for report_id in pending[start:start + 500]]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(
+                f"SELECT panNumber, id, createdAt, status FROM api_server.credit_reports WHERE id IN ({placeholders})",
+                chunk
+            )
+            rows = cursor.fetchall()
+            conn.execute("BEGIN")
+            self._upsert_api_server(conn, rows)
+            conn.execute("COMMIT")
+
+        conn.execute(
+            "DELETE FROM qfinance_pending WHERE EXISTS (SELECT 1 FROM qfinance_latest l "
+            "WHERE l.pan = qfinance_pending.pan AND l.created_at >= qfinance_pending.created_at)"
+        )
+        conn.execute(
+            "DELETE FROM api_server_pending WHERE EXISTS (SELECT 1 FROM api_server_latest l "
+            "WHERE l.pan = api_server_pending.pan AND l.created_at >= api_server_pending.created_at)"
+        )
+        return sum(
+            conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ('qfinance_pending', 'api_server_pending')
+        )
+
+    @staticmethod
+    def _upsert_qfinance(conn, batch):
+        rows = []
+        pending = []
+        for pan, json_filename, created_at in batch:
+            normalized = _normalize_pan(pan)
+            if not normalized:
+                continue
+            # Same rule as run_processor: reports without a JSON file never win, but the file may arrive later.
+            if not json_filename or str(json_filename).lower() == 'null':
+                pending.append((pan, normalized, _timestamp(created_at)))
+                continue
+            rows.append((normalized, pan, json_filename, _timestamp(created_at)))
+        conn.executemany(
+            "INSERT OR IGNORE INTO qfinance_pending (raw_pan, pan, created_at) VALUES (?, ?, ?)", pending
+        )
+        conn.executemany(
+            """
+            INSERT INTO qfinance_latest (pan, raw_pan, json_filename, created_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(pan) DO UPDATE SET
+                raw_pan = excluded.raw_pan,
+                json_filename = excluded.json_filename,
+                created_at = excluded.created_at
+            WHERE excluded.created_at >= qfinance_latest.created_at
+            """,
+            rows
+        )
+
+    @staticmethod
+    def _upsert_api_server(conn, batch):
+        rows = []
+        pending = []
+        failed = []
+        for pan, report_id, created_at, status in batch:
+            normalized = _normalize_pan(pan)
+            if not normalized:
+                continue
+            status = str(status or '').strip().upper()
+            if status != 'SUCCESS':
+                # Only SUCCESS reports are served; an in-progress one may still get there, a failed one never will.
+                if status in API_IN_PROGRESS_STATUSES:
+                    pending.append((str(report_id), normalized, _timestamp(created_at)))
+                else:
+                    failed.append((str(report_id),))
+                continue
+            rows.append((normalized, str(report_id), _timestamp(created_at)))
+        conn.executemany(
+            "INSERT OR IGNORE INTO api_server_pending (report_id, pan, created_at) VALUES (?, ?, ?)", pending
+        )
+        conn.executemany("DELETE FROM api_server_pending WHERE report_id = ?", failed)
+        conn.executemany(
+            """
+            INSERT INTO api_server_latest (pan, report_id, created_at) VALUES (?, ?, ?)
+            ON CONFLICT(pan) DO UPDATE SET
+                report_id = excluded.report_id,
+                created_at = excluded.created_at
+            WHERE excluded.created_at >= api_server_latest.created_at
+            """,
+            rows
+        )
+
+    # ------------------------------------------
+    # LOOKUPS
+    # ------------------------------------------
+
+    def _lookup(self, table, columns, pans):
+        conn = self._conn()
+        if pans is None:
+            return conn.execute(f"SELECT {columns} FROM {table} ORDER BY created_at DESC").fetchall()
+        normalized = [_normalize_pan(p) for p in pans if p and _normalize_pan(p)]
+        results = []
+        for start in range(0, len(normalized), 500):
+            chunk = normalized[start:start + 500]
+            placeholders = ", ".join(["?"] * len(chunk))
+            results.extend(conn.execute(
+                f"SELECT {columns} FROM {table} WHERE pan IN ({placeholders}) ORDER BY created_at DESC", chunk
+            ).fetchall())
+        return results
+
+    def resolve_qfinance(self, pans=None):
+        """Returns [(pancardNumber, recommendationJsonFile)] latest-first, for the given PANs or all of them."""
+        return self._lookup('qfinance_latest', 'raw_pan, json_filename', pans)
+
+    def resolve_api_server(self, pans):
+        """Returns [(pan, report_id)] of the latest SUCCESS api_server report for the given PANs."""
+        return [(pan, _coerce_id(report_id)) for pan, report_id in self._lookup('api_server_latest', 'pan, report_id', pans)]
+
+    def created_since(self, source, since=None, limit=None):
+        """
+        Latest-report entries created strictly after since, oldest first.
+        :param source: 'qfinance' -> [(pancardNumber, recommendationJsonFile, created_at)],
+                       'api_server' -> [(pan, report_id, created_at)].
+        """
+        if source == 'qfinance':
+            query = "SELECT raw_pan, json_filename, created_at FROM qfinance_latest"
+        else:
+            query = "SELECT pan, report_id, created_at FROM api_server_latest"
+        params = []
+        if since:
+            query += " WHERE created_at > ?"
+            params.append(since)
+        query += " ORDER BY created_at ASC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        rows = self._conn().execute(query, params).fetchall()
+        if source == 'api_server':
+            rows = [(pan, _coerce_id(report_id), created_at) for pan, report_id, created_at in rows]
+        return rows
+
+    def watermark(self, source):
+        """createdAt of the newest row pulled for source (or stored with set_watermark), or None."""
+        return self._watermark(source)[0]
+
+    def set_watermark(self, source, created_at):
+        """Records a consumer's own position (e.g. the prefetcher's) in the watermarks table."""
+        self._conn().execute(
+            "INSERT OR REPLACE INTO watermarks (source, created_at, refreshed_at) VALUES (?, ?, ?)",
+            (source, created_at, time.time())
+        )
+
+def _coerce_id(report_id):
+    return int(report_id) if str(report_id).isdigit() else report_id
@@ -0,0 +1,157 @@
+"""
+Streaming PAN extraction from pasted text and uploaded files.
+
+Text, CSV and TXT input is scanned in fixed-size chunks and XLSX input row by
+row, so a portfolio list of any size is never held as one string. Matches are
+deduplicated in a PanSet, which packs each PAN into one 64-bit integer
+instead of keeping a Python string per PAN.
+"""
+import bisect
+import heapq
+import io
+import os
+from array import array
+
+from resources import PAN_PATTERN
+
+CHUNK_CHARS = 1 << 20  # Characters of text scanned per regex pass
+_PAN_LENGTH = 10
+_RADIXES = (26, 26, 26, 26, 26, 10, 10, 10, 10, 26)
+
+def pack_pan(pan):
+    """Order-preserving integer for a PAN: sorting the integers sorts the PANs."""
+    value = 0
+    for radix, ch in zip(_RADIXES, pan.upper()):
+        value = value * radix + (int(ch) if radix == 10 else ord(ch) - 65)
+    return value
+
+def unpack_pan(value):
+    chars = []
+    for radix in reversed(_RADIXES):
+        value, digit = divmod(value, radix)
+        chars.append(str(digit) if radix == 10 else chr(65 + digit))
+    return ''.join(reversed(chars))
+
+class PanSet:
+    """
+    Set of PANs stored as a sorted array of packed integers (8 bytes per PAN),
+    plus a small set of recent additions that is merged in once it grows past a
+    quarter of the array.
+    """
+
+    def __init__(self, pans=()):
+        self._sorted = array('q')
+        self._pending = set()
+        for pan in pans:
+            self.add(pan)
+
+    def _contains_packed(self, value):
+        if value in self._pending:
+            return True
+        idx = bisect.bisect_left(self._sorted, value)
+        return idx < len(self._sorted) and self._sorted[idx] == value
+
+    def add(self, pan):
+        """Adds a PAN; returns True if it was not in the set yet."""
+        value = pack_pan(pan)
+        if self._contains_packed(value):
+            return False
+        self._pending.add(value)
+        if len(self._pending) >= max(65536, len(self._sorted) // 4):
+            self._merge()
+        return True
+
+    def _merge(self):
+        if self._pending:
+            self._sorted = array('q', heapq.merge(self._sorted, sorted(self._pending)))
+            self._pending = set()
+
+    def __contains__(self, pan):
+        return self._contains_packed(pack_pan(pan))
+
+    def __len__(self):
+        return len(self._sorted) + len(self._pending)
+
+    def __iter__(self):
+        """PANs in sorted order."""
+        self._merge()
+        return (unpack_pan(value) for value in self._sorted)
+
+# ==========================================
+# EXTRACTION
+# ==========================================
+
+def iter_text_pans(fh, chunk_chars=CHUNK_CHARS):
+    """
+    Yields uppercased PAN matches from a text stream, in order, exactly as one
+    PAN_PATTERN.findall over the whole text would, while reading it in chunks.
+    """
+    tail = ''
+    while True:
+        chunk = fh.read(chunk_chars)
+        if not chunk:
+            break
+        text = tail + chunk
+        consumed = 0
+        for match in PAN_PATTERN.finditer(text):
+            consumed = match.end()
+            yield match.group().upper()
+        # A match starting in the last 9 characters may still complete with the next chunk.
+        tail = text[max(consumed, len(text) - (_PAN_LENGTH - 1)):]
+    for match in PAN_PATTERN.finditer(tail):
+        yield match.group().upper()
+
+def iter_xlsx_pans(fh):
+    """Yields uppercased PAN matches from every text cell of every sheet, streaming rows."""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(fh, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            for row in sheet.iter_rows(values_only=True):
+                for value in row:
+                    if isinstance(value, str):
+                        for match in PAN_PATTERN.findall(value):
+                            yield match.upper()
+    finally:
+        workbook.close()
+
+def iter_file_pans(fh, name=''):
+    """
+    :param fh: Binary file object (an open file or an uploaded file).
+    :param name: Str, file name; '.xlsx'/'.xlsm' files are read as workbooks, anything else as UTF-8 text.
+    """
+    if os.path.splitext(name)[1].lower() in ('.xlsx', '.xlsm'):
+        yield from iter_xlsx_pans(fh)
+        return
+    text = io.TextIOWrapper(fh, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        yield from iter_text_pans(text)
+    finally:
+        text.detach()  # Leave the caller's file object open
+
+def collect_pans(text=None, files=()):
+    """
+    Unique PANs from pasted text and uploaded files.
+    :param text: Str, free-form text (bullets, emails, CSV...).
+    :param files: Iterable of binary file objects with a .name (e.g. Streamlit UploadedFile).
+    :return: PanSet.
+    """
+    pans = PanSet()
+    if text:
+        for pan in iter_text_pans(io.StringIO(text)):
+            pans.add(pan)
+    for fh in files:
+        for pan in iter_file_pans(fh, getattr(fh, 'name', '')):
+            pans.add(pan)
+    return pans
+
+def write_pans_file(pans, path):
+    """Writes one PAN per line; returns the count."""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as fh:
+        for pan in pans:
+            fh.write(pan)
+            fh.write('\n')
+            count += 1
+    return count
@@ -0,0 +1,156 @@
+"""
+Background prefetcher.
+
+Tails qfinance.q_report and api_server.credit_reports through the local PAN
+index (incremental createdAt refresh) and transforms newly landed reports
+into the result store ahead of time, so an analyst's first lookup of a new
+customer is served hot. Object-store downloads run as 'background' tasks on
+the shared scheduler, below every foreground job and within the background
+quota; api_server reports are only pulled while no foreground work is queued.
+"""
+import os
+import threading
+import time
+
+import process_experian
+from resources import get_db_connection
+
+PREFETCH_INTERVAL = int(os.getenv('PREFETCH_INTERVAL', '60'))  # Seconds between polls for new reports
+PREFETCH_BATCH = int(os.getenv('PREFETCH_BATCH', '500'))  # New reports per source handled per poll
+PREFETCH_IN_FLIGHT = int(os.getenv('PREFETCH_IN_FLIGHT', '4'))  # Background download tasks queued at once
+_API_CHUNK = 50
+_FOREGROUND_CLASSES = ('interactive', 'bulk')
+
+class Prefetcher:
+    def __init__(self, scheduler, interval=PREFETCH_INTERVAL, batch_size=PREFETCH_BATCH, max_in_flight=PREFETCH_IN_FLIGHT):
+        """
+        :param scheduler: scheduler.PriorityScheduler shared with the jobs; downloads run in its 'background' class.
+        :param interval: Int, seconds between polls.
+        :param batch_size: Int, new reports per source handled per poll; the rest wait for the next poll.
+        :param max_in_flight: Int, background tasks queued on the scheduler at once.
+        """
+        self.scheduler = scheduler
+        self.interval = interval
+        self.batch_size = max(1, int(batch_size))
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.counters = {'qfinance': 0, 'api_server': 0, 'already_cached': 0, 'no_rows': 0, 'failed': 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='prefetcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                counts = self.run_once()
+                if any(counts.values()):
+                    print(f"Prefetched {counts}")
+            except Exception as e:
+                print(f"[WARN] Prefetch cycle failed: {e}")
+            self._stop.wait(self.interval)
+
+    def _foreground_busy(self):
+        stats = self.scheduler.stats()
+        return any(stats[cls]['queued'] for cls in _FOREGROUND_CLASSES if cls in stats)
+
+    def run_once(self):
+        """One poll: refresh the PAN index, then prefetch reports created since the last poll."""
+        index = process_experian.get_pan_index()
+        store = process_experian.get_result_store()
+        conn = get_db_connection(process_experian.DB_CONFIG)
+        cursor = conn.cursor()
+        try:
+            index.refresh(cursor, force=True)
+            return {
+                'qfinance': self._prefetch_qfinance(index, store),
+                'api_server': self._prefetch_api_server(index, store, cursor),
+            }
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _pending(self, index, source):
+        """
+        New index entries for source after the prefetcher's own watermark; the first poll only sets it.
+        A report landing later within the watermark's second is skipped, which only means it is fetched cold.
+        """
+        mark = f"prefetch:{source}"
+        since = index.watermark(mark)
+        if since is None:
+            # Start tailing from now instead of prefetching the whole history.
+            index.set_watermark(mark, index.watermark(source) or '')
+            return mark, []
+        entries = index.created_since(source, since, self.batch_size)
+        if len(entries) >= self.batch_size:
+            # Leave the last createdAt second to the next poll, so a full batch never splits it.
+            entries = [entry for entry in entries if entry[2] != entries[-1][2]] or entries
+        return mark, entries
+
+    def _prefetch_qfinance(self, index, store):
+        mark, entries = self._pending(index, 'qfinance')
+        if not entries:
+            return 0
+        keys = {process_experian.qfinance_source_key(json_filename, pan): (pan, json_filename)
+                for pan, json_filename, _ in entries}
+        cached = store.get_many(keys)
+        self.counters['already_cached'] += len(cached)
+        tasks = [task for key, task in keys.items() if key not in cached]
+        submit = lambda task: self.scheduler.submit(
+            'background', process_experian.fetch_and_process_task, task, None, store
+        )
+        done = 0
+        completed = process_experian._iter_completed(submit, tasks, window=self.max_in_flight)
+        try:
+            for future, _ in completed:
+                if self._stop.is_set():
+                    return done
+                try:
+                    if future.result():
+                        done += 1
+                    else:
+                        self.counters['no_rows'] += 1  # Empty report, or a failed download (logged by the task)
+                except Exception:
+                    self.counters['failed'] += 1
+        finally:
+            completed.close()
+        index.set_watermark(mark, entries[-1][2])
+        self.counters['qfinance'] += done
+        return done
+
+    def _prefetch_api_server(self, index, store, cursor):
+        mark, entries = self._pending(index, 'api_server')
+        if not entries:
+            return 0
+        # Only PANs without a qfinance report ever fall back to api_server.
+        in_qfinance = {str(pan).strip().upper() for pan, _ in index.resolve_qfinance([pan for pan, _, _ in entries])}
+        reports = [(pan, report_id) for pan, report_id, _ in entries if pan not in in_qfinance]
+        keys = {process_experian.api_server_source_key(report_id, pan): (pan, report_id) for pan, report_id in reports}
+        cached = store.get_many(keys)
+        self.counters['already_cached'] += len(cached)
+        reports = [report for key, report in keys.items() if key not in cached]
+        done = 0
+        for start in range(0, len(reports), _API_CHUNK):
+            while self._foreground_busy() and not self._stop.is_set():
+                time.sleep(1)
+            if self._stop.is_set():
+                return done
+            chunk = reports[start:start + _API_CHUNK]
+            try:
+                _, hits = process_experian.fetch_api_server_fallback_rows(
+                    cursor, [pan for pan, _ in chunk], result_store=store, latest_reports=chunk
+                )
+                done += len(hits)
+            except Exception as e:
+                self.counters['failed'] += len(chunk)
+                print(f"[WARN] api_server prefetch failed for {len(chunk)} report(s): {e}")
+        index.set_watermark(mark, entries[-1][2])
+        self.counters['api_server'] += done
+        return done
@@ -0,0 +1,122 @@
+"""
+Paginated preview over a job's CSV artifact.
+
+The CSV is scanned once to record where every page and every PAN's rows start.
+Afterwards any page, with or without a PAN filter, is read by seeking straight
+to it, so the UI never holds more than one page of the result in memory.
+"""
+import csv
+import os
+
+PREVIEW_PAGE_ROWS = int(os.getenv('PREVIEW_PAGE_ROWS', '50'))
+
+class _Lines:
+    """Line iterator over a binary file that tracks the byte offset of the next line."""
+
+    def __init__(self, fh, offset=0):
+        self.fh = fh
+        self.offset = offset
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.fh.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode('utf-8')
+
+class CsvPreview:
+    def __init__(self, path, page_rows=PREVIEW_PAGE_ROWS, pan_column='pan'):
+        """
+        :param path: Str, CSV file with a header row.
+        :param page_rows: Int, rows per preview page.
+        :param pan_column: Str, column used by the PAN filter.
+        """
+        self.path = path
+        self.page_rows = max(1, int(page_rows))
+        self.headers = []
+        self.total_rows = 0
+        self._page_offsets = []
+        self._pan_spans = {}  # pan -> [[offset, rows], ...]; a report's rows are contiguous
+        self._scan(pan_column)
+
+    def _scan(self, pan_column):
+        with open(self.path, 'rb') as fh:
+            lines = _Lines(fh)
+            reader = csv.reader(lines)
+            self.headers = next(reader, [])
+            pan_idx = self.headers.index(pan_column) if pan_column in self.headers else None
+            last_pan = None
+            span = None
+            while True:
+                # csv.reader pulls exactly the lines of one record, so this is where the next record starts.
+                offset = lines.offset
+                row = next(reader, None)
+                if row is None:
+                    break
+                if self.total_rows % self.page_rows == 0:
+                    self._page_offsets.append(offset)
+                self.total_rows += 1
+                if pan_idx is None:
+                    continue
+                pan = row[pan_idx].strip().upper() if pan_idx < len(row) else ''
+                if span is not None and pan == last_pan:
+                    span[1] += 1
+                else:
+                    span = [offset, 1]
+                    self._pan_spans.setdefault(pan, []).append(span)
+                    last_pan = pan
+
+    def _read(self, offset, count):
+        rows = []
+        with open(self.path, 'rb') as fh:
+            fh.seek(offset)
+            for row in csv.reader(_Lines(fh, offset)):
+                rows.append(row)
+                if len(rows) >= count:
+                    break
+        return rows
+
+    def _spans(self, query):
+        query = (query or '').strip().upper()
+        if query in self._pan_spans:
+            spans = list(self._pan_spans[query])
+        else:
+            spans = [span for pan, pan_spans in self._pan_spans.items() if query in pan for span in pan_spans]
+        return sorted(spans)
+
+    def count(self, query=''):
+        """Rows matching a PAN filter (exact PAN or substring); all rows if query is empty."""
+        if not (query or '').strip():
+            return self.total_rows
+        return sum(rows for _, rows in self._spans(query))
+
+    def page_count(self, query=''):
+        return max(1, -(-self.count(query) // self.page_rows))
+
+    def page(self, number, query=''):
+        """
+        :param number: Int, 0-based page number.
+        :param query: Str, PAN filter; empty for all rows.
+        :return: List[list], the page's rows as CSV strings, in file order.
+        """
+        if number < 0:
+            return []
+        if not (query or '').strip():
+            if number >= len(self._page_offsets):
+                return []
+            return self._read(self._page_offsets[number], self.page_rows)
+        skip = number * self.page_rows
+        rows = []
+        for offset, span_rows in self._spans(query):
+            if skip >= span_rows:
+                skip -= span_rows
+                continue
+            take = min(span_rows - skip, self.page_rows - len(rows))
+            rows.extend(self._read(offset, skip + take)[skip:])
+            skip = 0
+            if len(rows) >= self.page_rows:
+                break
+        return rows
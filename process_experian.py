@@ -1,15 +1,36 @@
 import json
-import pandas as pd
 from datetime import datetime, timedelta
 import os
-import traceback
-import requests
 import concurrent.futures
 import time
-# Placeholder for DB connection - User can swap with mysql.connector or pymysql
-import mysql.connector 
+import hashlib
+import inspect
+import threading
+import collections
+import argparse
+import sys
+import zlib
+import types
+from dataclasses import dataclass
+from typing import Optional, Union
 from dotenv import load_dotenv
 
+from resources import LazyModule, get_db_connection, get_http_session
+from concurrency import AdaptiveConcurrencyLimiter
+from result_store import ResultStore
+from pan_index import PanIndex
+from spill import RowBuffer
+from progress import ProgressReporter
+from export import export_workbooks, excel_date, EXPORT_ROWS_PER_FILE
+from sinks import SINK_FORMATS, infer_format, open_sink
+from pan_input import PanSet, iter_file_pans, iter_text_pans
+from rollup import PanRollup, ROLLUP_AGGREGATES
+from singleflight import SingleFlight
+from hedging import get_hedged_fetcher
+
+# pandas is only needed once rows are assembled; loading it on first use keeps imports cheap.
+pd = LazyModule('pandas')
+
 # Load environment variables
 load_dotenv()
 
@@ -23,10 +44,21 @@ DB_CONFIG = {
     'database': os.getenv('DB_NAME', 'qfinance')
 }
 
+# Target of the mysql output sink: same server by default, but never the source database.
+OUTPUT_DB_CONFIG = {
+    'host': os.getenv('OUTPUT_DB_HOST', os.getenv('DB_HOST')),
+    'user': os.getenv('OUTPUT_DB_USER', os.getenv('DB_USER')),
+    'password': os.getenv('OUTPUT_DB_PASSWORD', os.getenv('DB_PASSWORD')),
+    'database': os.getenv('OUTPUT_DB_NAME')
+}
+
 BASE_URL = "https://mum-objectstore.e2enetworks.net/production-finqy/"
 # OUTPUT_FILE: Relative path
 OUTPUT_FILE = "processed_trade_lines.xlsx"
 MAX_WORKERS = 20  # Number of parallel threads
+USE_PAN_INDEX = os.getenv('USE_PAN_INDEX', '0') == '1'  # Resolve tasks from the local PAN index (pan_index.py)
+HEDGE_REQUESTS = os.getenv('HEDGE_REQUESTS', '0') == '1'  # Default for run_processor(hedge=...): duplicate straggling downloads (hedging.py)
+MEMORY_BUDGET_MB = int(os.getenv('MEMORY_BUDGET_MB', '0')) or None  # Buffered rows above this spill to disk (spill.py); unset = unlimited
 
 # Target Headers (36 Columns)
 TARGET_HEADERS = [
@@ -41,6 +73,20 @@ TARGET_HEADERS = [
     'currentDpd', 'settledLast30Days', 'settledLast60Days', 'settledLast90Days'
 ]
 
+# Column dtypes for the final DataFrame (see apply_dtype_schema).
+CATEGORY_COLUMNS = ['fiName', 'creditLineType', 'status', 'SuitFiled', 'SuitFiledStatus', 'WrittenOffFlag', 'totalTenure']
+MONEY_COLUMNS = [
+    'totalSanctionedAmount', 'currentOutstanding', 'WrittenOffAmount', 'paidPrincipalAmount', 'EMI', 'Balance',
+    'lastPaymentAmount', 'accountPastDueAmount', 'OverdueAmount', 'currentDpd'
+]
+COUNTER_COLUMNS = [
+    'pendingTenure', 'totalDelinquencies', 'delinquencies30Days', 'delinquencies60Days', 'delinquencies90Days',
+    'Recent_Missed_30DPD', 'Recent_Missed_60DPD', 'Recent_Missed_90DPD',
+    'Enq_30Days', 'Enq_60Days', 'Enq_90Days', 'Enq_1Year', 'settledLast30Days', 'settledLast60Days', 'settledLast90Days'
+]
+DATE_COLUMNS = ['startDate', 'lastPaymentDate']
+SQL_COLUMN_TYPES = {**{col: 'float' for col in MONEY_COLUMNS}, **{col: 'int' for col in COUNTER_COLUMNS}}
+
 # ==========================================
 # HELPER FUNCTIONS
 # ==========================================
@@ -77,7 +123,10 @@ def calculate_enquiries(enquiries_list, days):
         try:
             enq_date_str = enq.get('date')
             if enq_date_str:
-                enq_date = datetime.strptime(enq_date_str, "%Y-%m-%d")
+                if isinstance(enq_date_str, datetime):
+                    enq_date = enq_date_str
+                else:
+                    enq_date = datetime.strptime(enq_date_str, "%Y-%m-%d")
                 if enq_date >= cutoff_date:
                     count += 1
         except Exception:
@@ -104,95 +153,195 @@ def get_pending_tenure(total_tenure, open_date_str):
     except Exception:
         return 0
 
-def get_delinquency_buckets(payment_history):
+# Memo tables for the payment-history kernel. Both are keyed by the raw value
+# found in the report and filled lazily from the same parsing rules, so a month
+# string or status token is only parsed once per process.
+_MONTH_CACHE = {}
+_STATUS_DPD_CACHE = {}
+_KERNEL_CACHE_LIMIT = 4096
+
+def _parse_history_month(month_str):
+    if not isinstance(month_str, str):
+        return None
+    parsed = _MONTH_CACHE.get(month_str, _MONTH_CACHE)
+    if parsed is _MONTH_CACHE:
+        try:
+            parsed = datetime.strptime(month_str, '%m-%y')
+        except Exception:
+            parsed = None
+        if len(_MONTH_CACHE) < _KERNEL_CACHE_LIMIT:
+            _MONTH_CACHE[month_str] = parsed
+    return parsed
+
+def classify_payment_status(status):
+    """
+    Maps a payment-history status string to its DPD value, or None if the month is not delinquent.
+    Numeric statuses are DPD; SUB/DBT/LSS count as 90, SMA* as 30, anything else unknown as 1.
+    """
+    dpd_val = _STATUS_DPD_CACHE.get(status, _STATUS_DPD_CACHE)
+    if dpd_val is not _STATUS_DPD_CACHE:
+        return dpd_val
+
+    status_raw = status.replace('*', '').upper()
+    if status_raw.isdigit():
+        dpd_val = int(status_raw)
+        if dpd_val <= 0:
+            dpd_val = None
+    elif status_raw in ["STD", "STANDARD", "CURRENT", "0", ""]:
+        dpd_val = None
+    elif status_raw in ['SUB', 'DBT', 'LSS']:
+        dpd_val = 90
+    elif status_raw.startswith('SMA'):
+        dpd_val = 30
+    else:
+        dpd_val = 1
+
+    if len(_STATUS_DPD_CACHE) < _KERNEL_CACHE_LIMIT:
+        _STATUS_DPD_CACHE[status] = dpd_val
+    return dpd_val
+
+for _status in ('', '0', '00', '000', 'STD', 'STANDARD', 'CURRENT', 'SUB', 'DBT', 'LSS', 'SMA', 'SMA0', 'SMA1', 'SMA2',
+                'XXX', 'None', *[str(_dpd) for _dpd in range(1, 181)], *[f"{_dpd:03d}" for _dpd in range(1, 181)]):
+    classify_payment_status(_status)
+del _status
+
+def scan_payment_history(payment_history, strict=True):
+    """
+    Single pass over an account's payment history.
+    :param strict: Bool, re-raise a status that cannot be classified (as the delinquency rules always did).
+                   With strict=False the suit-filed result is still returned.
+    :return: (delinquency stats dict, SuitFiled flag, latest SuitFiledStatus)
+    """
     stats = {
         'totalDelinquencies': 0,
-        'delinquencies': [],
+        'delinquencies': '',
         'delinq30': 0, 'delinq60': 0, 'delinq90': 0,
         'recent30': 0, 'recent60': 0, 'recent90': 0
     }
-    
+    suit_filed_flag, suit_filed_status = "No", None
+
     if not payment_history:
-        return stats
-        
-    parsed_history = []
+        # Kept as an (empty) list here, as the row output always had it for missing histories.
+        stats['delinquencies'] = []
+        return stats, suit_filed_flag, suit_filed_status
+    # Suit-filed info is only read from well-formed (list) histories.
+    track_suit = isinstance(payment_history, list)
+
+    three_months_ago = datetime.now() - timedelta(days=90)
+    delinquent_months = []  # (dt, month_str), in history order
+    newest_first = True
+    suit_dt = None
+    undated_suit_status = None
+    status_error = None
+
     for rec in payment_history:
+        if not isinstance(rec, dict):
+            continue
+        month_str = rec.get('month')
+        dt = _parse_history_month(month_str)
+
+        if track_suit:
+            suit_status = clean_nullable_str(rec.get('suitFiledStatus'))
+            if suit_status:
+                if dt is None:
+                    if undated_suit_status is None:
+                        undated_suit_status = suit_status
+                elif suit_dt is None or dt > suit_dt:
+                    suit_dt, suit_filed_status = dt, suit_status
+
+        if dt is None or status_error is not None:
+            continue
         try:
-            m_str = rec.get('month')
-            dt = datetime.strptime(m_str, '%m-%y')
-            parsed_history.append({'dt': dt, 'status': str(rec.get('status', '')), 'month_str': m_str})
-        except:
+            dpd_val = classify_payment_status(str(rec.get('status', '')))
+        except ValueError as e:
+            status_error = e
+            continue
+        if dpd_val is None:
             continue
-            
-    parsed_history.sort(key=lambda x: x['dt'], reverse=True)
-    
-    now = datetime.now()
-    three_months_ago = now - timedelta(days=90)
 
-    for i, rec in enumerate(parsed_history):
-        status_raw = rec['status'].replace('*', '').upper()
-        
-        dpd_val = 0
-        is_delinquent = False
-        
-        if status_raw.isdigit():
-            dpd_val = int(status_raw)
-            if dpd_val > 0:
-                is_delinquent = True
-        elif status_raw in ["STD", "STANDARD", "CURRENT", "0", ""]:
-             dpd_val = 0
-        else:
-            is_delinquent = True
-            if status_raw in ['SUB', 'DBT', 'LSS']: dpd_val = 90
-            elif status_raw.startswith('SMA'): dpd_val = 30
-            else: dpd_val = 1 
-        
-        if is_delinquent:
-            stats['totalDelinquencies'] += 1
-            stats['delinquencies'].append(rec['month_str'])
-            
-            if dpd_val >= 30: stats['delinq30'] += 1
-            if dpd_val >= 60: stats['delinq60'] += 1
-            if dpd_val >= 90: stats['delinq90'] += 1
-            
-            if rec['dt'] >= three_months_ago:
-                if dpd_val >= 30: stats['recent30'] += 1
-                if dpd_val >= 60: stats['recent60'] += 1
-                if dpd_val >= 90: stats['recent90'] += 1
+        stats['totalDelinquencies'] += 1
+        if delinquent_months and dt > delinquent_months[-1][0]:
+            newest_first = False
+        delinquent_months.append((dt, month_str))
 
-    stats['delinquencies'] = ",".join(stats['delinquencies'])
-    return stats
+        if dpd_val >= 30: stats['delinq30'] += 1
+        if dpd_val >= 60: stats['delinq60'] += 1
+        if dpd_val >= 90: stats['delinq90'] += 1
 
-def get_suit_filed_info(payment_history):
-    if not isinstance(payment_history, list) or len(payment_history) == 0:
-        return "No", None
+        if dt >= three_months_ago:
+            if dpd_val >= 30: stats['recent30'] += 1
+            if dpd_val >= 60: stats['recent60'] += 1
+            if dpd_val >= 90: stats['recent90'] += 1
 
-    dated_statuses = []
-    undated_status = None
+    if status_error is not None and strict:
+        raise status_error
 
-    for rec in payment_history:
-        if not isinstance(rec, dict):
-            continue
-        suit_status = clean_nullable_str(rec.get('suitFiledStatus'))
-        if not suit_status:
+    if delinquent_months:
+        if not newest_first:
+            delinquent_months.sort(key=lambda x: x[0], reverse=True)
+        stats['delinquencies'] = ",".join(month_str for _, month_str in delinquent_months)
+
+    if suit_filed_status is not None or undated_suit_status:
+        suit_filed_flag = "Yes"
+        if suit_filed_status is None:
+            suit_filed_status = undated_suit_status
+    return stats, suit_filed_flag, suit_filed_status
+
+def scan_typed_payment_history(months, suit_filed_status=None):
+    """
+    scan_payment_history over parse_api_payment_history output ([(month_index, status)]),
+    comparing integer month indexes instead of parsing month strings.
+    """
+    stats = {
+        'totalDelinquencies': 0,
+        'delinquencies': '',
+        'delinq30': 0, 'delinq60': 0, 'delinq90': 0,
+        'recent30': 0, 'recent60': 0, 'recent90': 0
+    }
+    if not months:
+        stats['delinquencies'] = []
+        return stats, "No", None
+
+    # A month counts as recent when its first day is on/after the 90-day cutoff.
+    cutoff = datetime.now() - timedelta(days=90)
+    cutoff_index = cutoff.year * 12 + cutoff.month - 1
+    if cutoff != datetime(cutoff.year, cutoff.month, 1):
+        cutoff_index += 1
+
+    delinquent_months = []
+    for month_index, status in months:
+        dpd_val = classify_payment_status(status)
+        if dpd_val is None:
             continue
 
-        month_str = rec.get('month')
-        try:
-            parsed_month = datetime.strptime(month_str, '%m-%y')
-            dated_statuses.append((parsed_month, suit_status))
-        except Exception:
-            if undated_status is None:
-                undated_status = suit_status
+        stats['totalDelinquencies'] += 1
+        delinquent_months.append(month_index)
+
+        if dpd_val >= 30: stats['delinq30'] += 1
+        if dpd_val >= 60: stats['delinq60'] += 1
+        if dpd_val >= 90: stats['delinq90'] += 1
+
+        if month_index >= cutoff_index:
+            if dpd_val >= 30: stats['recent30'] += 1
+            if dpd_val >= 60: stats['recent60'] += 1
+            if dpd_val >= 90: stats['recent90'] += 1
 
-    if dated_statuses:
-        dated_statuses.sort(key=lambda x: x[0], reverse=True)
-        return "Yes", dated_statuses[0][1]
+    if delinquent_months:
+        delinquent_months.sort(reverse=True)
+        stats['delinquencies'] = ",".join(
+            f"{month_index % 12 + 1:02d}-{(month_index // 12) % 100:02d}" for month_index in delinquent_months
+        )
+
+    if suit_filed_status:
+        return stats, "Yes", suit_filed_status
+    return stats, "No", None
 
-    if undated_status:
-        return "Yes", undated_status
+def get_delinquency_buckets(payment_history):
+    return scan_payment_history(payment_history)[0]
 
-    return "No", None
+def get_suit_filed_info(payment_history):
+    _, suit_filed_flag, suit_filed_status = scan_payment_history(payment_history, strict=False)
+    return suit_filed_flag, suit_filed_status
 
 def get_written_off_info(account, status_raw=None):
     written_off_amount = clean_money(account.get('writtenOffAmtTotal'))
@@ -206,11 +355,15 @@ def get_written_off_info(account, status_raw=None):
 
     return ("Yes" if is_written_off else "No"), written_off_amount
 
-def parse_flexible_date(val):
+def parse_flexible_datetime(val):
+    """
+    Parses the date formats seen in api_server payloads to a datetime at midnight.
+    Unparseable text is returned as-is (stripped); empty/null values as None.
+    """
     if not val:
         return None
     if isinstance(val, datetime):
-        return val.strftime("%Y-%m-%d")
+        return datetime(val.year, val.month, val.day)
 
     s_val = str(val).strip()
     if not s_val or s_val.lower() == 'null':
@@ -221,13 +374,19 @@ def parse_flexible_date(val):
             parsed = datetime.strptime(s_val, fmt)
             if fmt == "%Y-%m":
                 parsed = parsed.replace(day=1)
-            return parsed.strftime("%Y-%m-%d")
+            return parsed
         except Exception:
             continue
     if "T" in s_val:
-        return parse_flexible_date(s_val.split("T", 1)[0])
+        return parse_flexible_datetime(s_val.split("T", 1)[0])
     return s_val
 
+def parse_flexible_date(val):
+    parsed = parse_flexible_datetime(val)
+    if isinstance(parsed, datetime):
+        return parsed.strftime("%Y-%m-%d")
+    return parsed
+
 def _build_in_clause(values):
     return ", ".join(["%s"] * len(values))
 
@@ -254,6 +413,28 @@ def normalize_api_suit_filed_status(val):
         return None
     return status
 
+def _parse_api_history_month(rec):
+    date_val = rec.get('date') or rec.get('month')
+    if not date_val:
+        return None
+    date_str = str(date_val).strip()
+    for fmt in ("%Y-%m", "%Y-%m-%d", "%m-%y"):
+        try:
+            return datetime.strptime(date_str, fmt)
+        except Exception:
+            continue
+    return None
+
+def _api_payment_status(rec):
+    days_late = clean_money(rec.get('daysLate'))
+    if days_late > 0:
+        return str(int(days_late))
+    status_token = clean_nullable_str(rec.get('status')) or clean_nullable_str(rec.get('assetClassification'))
+    status_upper = status_token.upper() if status_token else ''
+    if status_upper in {'S', 'STD', 'STANDARD', 'CURRENT', '?', '0'}:
+        return '0'
+    return status_token or '0'
+
 def normalize_api_payment_history(payment_history, suit_filed_status=None):
     normalized = []
 
@@ -261,32 +442,11 @@ def normalize_api_payment_history(payment_history, suit_filed_status=None):
         if not isinstance(rec, dict):
             continue
 
-        month_str = None
-        date_val = rec.get('date') or rec.get('month')
-        if date_val:
-            date_str = str(date_val).strip()
-            for fmt in ("%Y-%m", "%Y-%m-%d", "%m-%y"):
-                try:
-                    parsed = datetime.strptime(date_str, fmt)
-                    month_str = parsed.strftime("%m-%y")
-                    break
-                except Exception:
-                    continue
-        if not month_str:
+        parsed = _parse_api_history_month(rec)
+        if not parsed:
             continue
 
-        days_late = clean_money(rec.get('daysLate'))
-        if days_late > 0:
-            status = str(int(days_late))
-        else:
-            status_token = clean_nullable_str(rec.get('status')) or clean_nullable_str(rec.get('assetClassification'))
-            status_upper = status_token.upper() if status_token else ''
-            if status_upper in {'S', 'STD', 'STANDARD', 'CURRENT', '?', '0'}:
-                status = '0'
-            else:
-                status = status_token or '0'
-
-        entry = {'month': month_str, 'status': status}
+        entry = {'month': parsed.strftime("%m-%y"), 'status': _api_payment_status(rec)}
         if idx == 0 and suit_filed_status:
             entry['suitFiledStatus'] = suit_filed_status
         normalized.append(entry)
@@ -300,12 +460,44 @@ def normalize_api_payment_history(payment_history, suit_filed_status=None):
 
     return normalized
 
-def normalize_api_enquiries(enquiries):
+def parse_api_payment_history(payment_history, suit_filed_status=None):
+    """
+    Typed counterpart of normalize_api_payment_history.
+    :return: ([(month_index, status)], suit_filed_status) where month_index = year * 12 + month - 1
+             and suit_filed_status is kept only where the dict form would attach it to a month.
+    """
+    months = []
+    suit_attached = False
+
+    for idx, rec in enumerate(payment_history or []):
+        if not isinstance(rec, dict):
+            continue
+
+        parsed = _parse_api_history_month(rec)
+        if not parsed:
+            continue
+
+        months.append((parsed.year * 12 + parsed.month - 1, _api_payment_status(rec)))
+        if idx == 0 and suit_filed_status:
+            suit_attached = True
+
+    if suit_filed_status and not months:
+        now = datetime.now()
+        months.append((now.year * 12 + now.month - 1, '0'))
+        suit_attached = True
+
+    return months, (suit_filed_status if suit_attached else None)
+
+def normalize_api_enquiries(enquiries, typed=False):
+    """
+    :param typed: Bool, keep parsed enquiry dates as datetimes instead of ISO strings.
+    """
+    parse_date = parse_flexible_datetime if typed else parse_flexible_date
     normalized = []
     for enq in enquiries or []:
         if not isinstance(enq, dict):
             continue
-        date_str = parse_flexible_date(
+        date_str = parse_date(
             enq.get('date') or enq.get('enquiryDate') or enq.get('applicationDate') or enq.get('inquiryDate')
         )
         lender = clean_str(
@@ -358,7 +550,39 @@ def build_api_raw_account_lookup(raw_report_data):
             lookup[account_number] = raw_account
     return lookup
 
-def transform_api_account(account, raw_account):
+@dataclass(slots=True)
+class TypedAccount:
+    """
+    api_server account with every value already parsed, consumed directly by
+    process_single_record (see transform_api_account(typed=True)).
+    Dates are datetimes, or the raw text when unparseable; amounts are floats.
+    """
+    provider: Optional[str]
+    account_type: Optional[str]
+    sanctioned_amount: float
+    total_sanction_amount: float
+    outstanding: float
+    total_balance: float
+    paid_principal: float
+    emi: float
+    payment_history: list  # [(month_index, status)], see parse_api_payment_history
+    suit_filed_status: Optional[str]
+    total_tenure: Optional[str]
+    tenure_months: Optional[int]
+    open_date: Union[datetime, str, None]
+    close_date: Union[datetime, str, None]
+    account_status: Optional[str]
+    last_payment_date: Union[datetime, str, None]
+    last_payment_amount: float
+    past_due_amount: float
+    written_off_amount: float
+    no_write_off_amount: float
+
+def transform_api_account(account, raw_account, typed=False):
+    """
+    Maps an api_server detailedReport account (plus its raw CAIS record) to the qfinance account shape.
+    :param typed: Bool, return a TypedAccount instead of a qfinance-style dict.
+    """
     if not isinstance(account, dict):
         return None
 
@@ -366,7 +590,6 @@ def transform_api_account(account, raw_account):
     suit_filed_status = normalize_api_suit_filed_status(
         raw_account.get('suitFiledWillfulDefaultWrittenOffStatus') or raw_account.get('suitFiledWilfulDefault')
     )
-    payment_history = normalize_api_payment_history(account.get('paymentHistory', []), suit_filed_status=suit_filed_status)
 
     credit_limit = clean_money(raw_account.get('creditLimitAmount'))
     sanctioned_amount = credit_limit if credit_limit > 0 else clean_money(account.get('sanctioned'))
@@ -376,6 +599,39 @@ def transform_api_account(account, raw_account):
 
     detailed_emi = clean_money(account.get('emi'))
     raw_emi = clean_money(raw_account.get('scheduledMonthlyPaymentAmount'))
+    emi = detailed_emi if detailed_emi > 0 else (raw_emi if raw_emi > 0 else 0)
+    repayment_tenure = normalize_positive_tenure(raw_account.get('repaymentTenure'))
+
+    if typed:
+        payment_history, attached_suit_status = parse_api_payment_history(
+            account.get('paymentHistory', []), suit_filed_status=suit_filed_status
+        )
+        try:
+            tenure_months = int(float(str(repayment_tenure).replace('*', '').strip()))
+        except Exception:
+            tenure_months = None
+        return TypedAccount(
+            provider=clean_str(account.get('provider')) or clean_str(raw_account.get('subscriberName')),
+            account_type=clean_str(account.get('productName')),
+            sanctioned_amount=float(sanctioned_amount),
+            total_sanction_amount=float(clean_money(raw_account.get('highestCreditOrOrignalLoanAmount'))),
+            outstanding=float(clean_money(account.get('outstanding'))),
+            total_balance=float(clean_money(raw_account.get('currentBalance'))),
+            paid_principal=float(clean_money(account.get('paidPrincipal'))),
+            emi=float(emi),
+            payment_history=payment_history,
+            suit_filed_status=attached_suit_status,
+            total_tenure=clean_str(repayment_tenure),
+            tenure_months=tenure_months,
+            open_date=parse_flexible_datetime(account.get('accountOpenDate') or raw_account.get('openDate')),
+            close_date=parse_flexible_datetime(account.get('accountCloseDate') or raw_account.get('dateClosed')),
+            account_status=normalize_api_account_status(account.get('accountStatus')),
+            last_payment_date=parse_flexible_datetime(raw_account.get('dateOfLastPayment')),
+            last_payment_amount=float(clean_money(raw_account.get('valueOfCreditsLastMonth'))),
+            past_due_amount=float(clean_money(raw_account.get('amountPastDue'))),
+            written_off_amount=float(clean_money(raw_account.get('writtenOffAmtTotal'))),
+            no_write_off_amount=float(no_write_off_amount)
+        )
 
     transformed = {
         'provider': clean_str(account.get('provider')) or clean_str(raw_account.get('subscriberName')),
@@ -385,9 +641,9 @@ def transform_api_account(account, raw_account):
         'outstanding': clean_money(account.get('outstanding')),
         'totalBalance': clean_money(raw_account.get('currentBalance')),
         'paidPrincipal': clean_money(account.get('paidPrincipal')),
-        'emi': detailed_emi if detailed_emi > 0 else (raw_emi if raw_emi > 0 else 0),
-        'paymentHistory': payment_history,
-        'repaymentTenure': normalize_positive_tenure(raw_account.get('repaymentTenure')),
+        'emi': emi,
+        'paymentHistory': normalize_api_payment_history(account.get('paymentHistory', []), suit_filed_status=suit_filed_status),
+        'repaymentTenure': repayment_tenure,
         'accountOpenDate': parse_flexible_date(account.get('accountOpenDate') or raw_account.get('openDate')),
         'accountCloseDate': parse_flexible_date(account.get('accountCloseDate') or raw_account.get('dateClosed')),
         'accountStatus': normalize_api_account_status(account.get('accountStatus')),
@@ -400,7 +656,11 @@ def transform_api_account(account, raw_account):
 
     return transformed
 
-def build_qfinance_like_payload_from_api(report_data, raw_report_data, pan):
+def build_qfinance_like_payload_from_api(report_data, raw_report_data, pan, typed=False):
+    """
+    Wraps an api_server report in the qfinance payload layout read by process_single_record.
+    :param typed: Bool, emit TypedAccount objects and datetime enquiry dates instead of string-encoded dicts.
+    """
     if not isinstance(report_data, dict):
         return None
 
@@ -415,7 +675,7 @@ def build_qfinance_like_payload_from_api(report_data, raw_report_data, pan):
     transformed_others = {}
 
     for account in detailed_report.get('cards', []) or []:
-        transformed = transform_api_account(account, raw_account_lookup.get(clean_str(account.get('accountNumber'))))
+        transformed = transform_api_account(account, raw_account_lookup.get(clean_str(account.get('accountNumber'))), typed=typed)
         if transformed:
             transformed_credit_cards.append(transformed)
 
@@ -424,7 +684,7 @@ def build_qfinance_like_payload_from_api(report_data, raw_report_data, pan):
             continue
         transformed_accounts = []
         for account in accounts:
-            transformed = transform_api_account(account, raw_account_lookup.get(clean_str(account.get('accountNumber'))))
+            transformed = transform_api_account(account, raw_account_lookup.get(clean_str(account.get('accountNumber'))), typed=typed)
             if transformed:
                 transformed_accounts.append(transformed)
         if loan_type == 'otherLoans':
@@ -437,14 +697,14 @@ def build_qfinance_like_payload_from_api(report_data, raw_report_data, pan):
             continue
         transformed_accounts = []
         for account in accounts:
-            transformed = transform_api_account(account, raw_account_lookup.get(clean_str(account.get('accountNumber'))))
+            transformed = transform_api_account(account, raw_account_lookup.get(clean_str(account.get('accountNumber'))), typed=typed)
             if transformed:
                 transformed_accounts.append(transformed)
         transformed_others[section_name] = transformed_accounts
 
     enquiries = detailed_report.get('enquiries', {}) if isinstance(detailed_report.get('enquiries'), dict) else {}
-    normalized_recent = normalize_api_enquiries(enquiries.get('recent', []))
-    normalized_all = normalize_api_enquiries(enquiries.get('all', []))
+    normalized_recent = normalize_api_enquiries(enquiries.get('recent', []), typed=typed)
+    normalized_all = normalize_api_enquiries(enquiries.get('all', []), typed=typed)
 
     summary = {}
     if isinstance(enquiries.get('summary'), dict):
@@ -582,17 +842,11 @@ def fetch_api_server_view_fallback_rows(cursor, report_ids, requested_pans):
 
     return all_rows, sorted(set(hits))
 
-def fetch_api_server_fallback_rows(cursor, specific_pans):
-    if not specific_pans:
-        return [], []
-
-    normalized_pans = [str(p).strip().upper() for p in specific_pans if p and str(p).strip()]
-    if not normalized_pans:
-        return [], []
-
+def fetch_latest_api_report_ids(cursor, normalized_pans):
+    """Returns [(panNumber, id)] of the latest SUCCESS api_server report per PAN, without the report blobs."""
     placeholders = _build_in_clause(normalized_pans)
     latest_reports_query = f"""
-        SELECT cr.panNumber, cr.id, cr.reportData, cr.rawReportData, cr.createdAt
+        SELECT cr.panNumber, cr.id
         FROM api_server.credit_reports cr
         INNER JOIN (
             SELECT UPPER(TRIM(panNumber)) AS pan_key, MAX(createdAt) AS max_created
@@ -606,7 +860,23 @@ def fetch_api_server_fallback_rows(cursor, specific_pans):
         WHERE cr.status = 'SUCCESS'
     """
     cursor.execute(latest_reports_query, normalized_pans)
-    latest_reports = cursor.fetchall()
+    return cursor.fetchall()
+
+def fetch_api_server_fallback_rows(cursor, specific_pans, result_store=None, latest_reports=None, row_groups=None):
+    """
+    Builds rows for PANs missing in qfinance from their latest api_server report.
+    latest_reports: optional [(pan, report_id)] already resolved (e.g. from the PAN index).
+    row_groups: optional list; receives (source_key, rows) for every PAN that returned rows.
+    """
+    if not specific_pans:
+        return [], []
+
+    normalized_pans = [str(p).strip().upper() for p in specific_pans if p and str(p).strip()]
+    if not normalized_pans:
+        return [], []
+
+    if latest_reports is None:
+        latest_reports = fetch_latest_api_report_ids(cursor, normalized_pans)
 
     if not latest_reports:
         return [], []
@@ -631,18 +901,68 @@ def fetch_api_server_fallback_rows(cursor, specific_pans):
 
         return False
 
-    rows_by_pan = {}
-    report_ids = []
-    for pan, report_id, report_data_raw, raw_report_data_raw, _ in latest_reports:
-        normalized_pan = str(pan).strip().upper()
-        report_ids.append(report_id)
+    # Serve already-transformed reports from the result store; only the misses
+    # have their (large) reportData/rawReportData blobs pulled and decoded.
+    report_ids = [report_id for _, report_id in latest_reports]
+    source_keys = {report_id: api_server_source_key(report_id, str(pan).strip().upper()) for pan, report_id in latest_reports}
+    cached = result_store.get_many(source_keys.values()) if result_store is not None else {}
+
+    # Reports another run is already pulling are waited for instead of fetched again (single-flight).
+    led = {}
+    joined = {}
+    for pan, report_id in latest_reports:
+        source_key = source_keys[report_id]
+        if source_key in cached or source_key in led or source_key in joined:
+            continue
+        call, leader = _report_flights.begin(source_key)
+        (led if leader else joined)[source_key] = call
+
+    computed = {}
+    try:
+        led_ids = [report_id for report_id in report_ids if source_keys[report_id] in led]
+        report_blobs = {}
+        if led_ids:
+            blobs_query = f"""
+                SELECT id, reportData, rawReportData
+                FROM api_server.credit_reports
+                WHERE id IN ({_build_in_clause(led_ids)})
+            """
+            cursor.execute(blobs_query, led_ids)
+            for report_id, report_data_raw, raw_report_data_raw in cursor.fetchall():
+                report_blobs[report_id] = (report_data_raw, raw_report_data_raw)
+
+        for pan, report_id in latest_reports:
+            normalized_pan = str(pan).strip().upper()
+            source_key = source_keys[report_id]
+            if source_key not in led or source_key in computed:
+                continue
+            try:
+                report_data_raw, raw_report_data_raw = report_blobs[report_id]
+                report_data = json.loads(report_data_raw) if isinstance(report_data_raw, str) else report_data_raw
+                raw_report_data = json.loads(raw_report_data_raw) if isinstance(raw_report_data_raw, str) else raw_report_data_raw
+                transformed_payload = build_qfinance_like_payload_from_api(report_data, raw_report_data, normalized_pan, typed=True)
+                computed[source_key] = process_single_record(transformed_payload, pan_from_db=normalized_pan)
+                if result_store is not None:
+                    result_store.put(source_key, computed[source_key])
+            except Exception:
+                computed[source_key] = []
+    finally:
+        # Always release waiters, even if the blob query failed.
+        for source_key, call in led.items():
+            _report_flights.finish(source_key, call, result=computed.get(source_key, []))
+    for source_key, call in joined.items():
         try:
-            report_data = json.loads(report_data_raw) if isinstance(report_data_raw, str) else report_data_raw
-            raw_report_data = json.loads(raw_report_data_raw) if isinstance(raw_report_data_raw, str) else raw_report_data_raw
-            transformed_payload = build_qfinance_like_payload_from_api(report_data, raw_report_data, normalized_pan)
-            rows_by_pan[normalized_pan] = process_single_record(transformed_payload, pan_from_db=normalized_pan)
+            computed[source_key] = _copy_rows(call.wait())
         except Exception:
-            rows_by_pan[normalized_pan] = []
+            computed[source_key] = []
+
+    rows_by_pan = {}
+    source_by_pan = {}
+    for pan, report_id in latest_reports:
+        normalized_pan = str(pan).strip().upper()
+        source_key = source_keys[report_id]
+        source_by_pan[normalized_pan] = source_key
+        rows_by_pan[normalized_pan] = cached[source_key] if source_key in cached else computed.get(source_key, [])
 
     unresolved_pans = [pan for pan in normalized_pans if not has_meaningful_tradeline_rows(rows_by_pan.get(pan))]
     if unresolved_pans:
@@ -660,44 +980,246 @@ def fetch_api_server_fallback_rows(cursor, specific_pans):
         if rows_by_pan.get(pan):
             all_rows.extend(rows_by_pan[pan])
             fallback_hits.append(pan)
+            if row_groups is not None:
+                row_groups.append((source_by_pan.get(pan), rows_by_pan[pan]))
 
     return all_rows, sorted(set(fallback_hits))
 
+# ==========================================
+# TYPED ACCOUNT ROWS
+# ==========================================
+def _typed_date_text(val):
+    if isinstance(val, datetime):
+        return val.strftime("%Y-%m-%d")
+    return clean_str(val)
+
+def build_typed_account_row(account, pan, enq_30, enq_60, enq_90, enq_365):
+    """Builds the tradeline row for a TypedAccount without re-parsing any of its values."""
+    delinq_stats, suit_filed_flag, suit_filed_status = scan_typed_payment_history(
+        account.payment_history, account.suit_filed_status
+    )
+
+    now = datetime.now()
+    pending_tenure = 0
+    if account.tenure_months is not None and isinstance(account.open_date, datetime):
+        months_passed = (now.year - account.open_date.year) * 12 + (now.month - account.open_date.month)
+        pending_tenure = max(0, account.tenure_months - months_passed)
+
+    sanctioned_amt = account.sanctioned_amount or account.total_sanction_amount
+    outstanding_amt = account.outstanding or account.total_balance
+    status_raw = account.account_status
+
+    written_off_amount = account.written_off_amount
+    if written_off_amount <= 0 and account.no_write_off_amount > 0:
+        written_off_amount = account.no_write_off_amount
+    status_text = (status_raw or '').upper()
+    written_off_flag = "Yes" if written_off_amount > 0 or ('WRITTEN' in status_text and 'OFF' in status_text) else "No"
+
+    settled30, settled60, settled90 = 0, 0, 0
+    if status_raw and 'SETTLED' in status_text and isinstance(account.close_date, datetime):
+        days_diff = (now - account.close_date).days
+        if days_diff <= 30: settled30 = 1
+        if days_diff <= 60: settled60 = 1
+        if days_diff <= 90: settled90 = 1
+
+    overdue_amount = account.past_due_amount
+    return {
+        'pan': pan,
+        'fiName': account.provider,
+        'creditLineType': account.account_type or None,
+        'totalSanctionedAmount': sanctioned_amt,
+        'currentOutstanding': outstanding_amt,
+        'status': status_raw,
+        'SuitFiled': suit_filed_flag,
+        'SuitFiledStatus': suit_filed_status,
+        'WrittenOffFlag': written_off_flag,
+        'WrittenOffAmount': written_off_amount,
+        'paidPrincipalAmount': account.paid_principal,
+        'EMI': account.emi,
+        'totalTenure': account.total_tenure,
+        'pendingTenure': pending_tenure,
+        'startDate': _typed_date_text(account.open_date),
+        'Balance': outstanding_amt,
+        'lastPaymentDate': _typed_date_text(account.last_payment_date),
+        'lastPaymentAmount': account.last_payment_amount,
+        'accountPastDueAmount': overdue_amount,
+        'OverdueAmount': overdue_amount,
+        'totalDelinquencies': delinq_stats['totalDelinquencies'],
+        'delinquencies': delinq_stats['delinquencies'],
+        'delinquencies30Days': delinq_stats['delinq30'],
+        'delinquencies60Days': delinq_stats['delinq60'],
+        'delinquencies90Days': delinq_stats['delinq90'],
+        'Recent_Missed_30DPD': delinq_stats['recent30'],
+        'Recent_Missed_60DPD': delinq_stats['recent60'],
+        'Recent_Missed_90DPD': delinq_stats['recent90'],
+        'Enq_30Days': enq_30,
+        'Enq_60Days': enq_60,
+        'Enq_90Days': enq_90,
+        'Enq_1Year': enq_365,
+        'currentDpd': overdue_amount,
+        'settledLast30Days': settled30,
+        'settledLast60Days': settled60,
+        'settledLast90Days': settled90
+    }
+
+# ==========================================
+# PAYLOAD SHAPE DETECTION
+# ==========================================
+# Section kinds used in shape descriptions.
+_LIST, _DICT, _ABSENT, _OTHER = 'list', 'dict', '-', '?'
+
+class _Missing:
+    pass
+
+_MISSING = _Missing()  # Default for sections a payload doesn't have; its type marks them absent in a fingerprint
+_KINDS = {list: _LIST, dict: _DICT, _Missing: _ABSENT}
+_shape_local = threading.local()
+_shape_counters = []  # (thread, {fingerprint: count}) per thread that has extracted reports
+_SHAPE_COUNTS = collections.Counter()  # Counts of threads that have exited, by shape description
+_SHAPE_NAMES = {}  # fingerprint -> shape description
+_SHAPE_LOCK = threading.Lock()
+
+def describe_shape(fingerprint):
+    """
+    :param fingerprint: Tuple of section value types, as recorded by extract_report_sections; None for malformed payloads.
+    """
+    if fingerprint is None:
+        return 'malformed'
+    (personal_kind, ce_recent, ce_all, ce_previous, ce_summary, re_recent, re_all, re_summary,
+     cards_kind, loans_kind, other_loans_kind, overdraft_kind) = [_KINDS.get(kind, _OTHER) for kind in fingerprint]
+    accounts = [name for name, kind in (('creditCards', cards_kind), ('otherLoans', other_loans_kind), ('overdraft', overdraft_kind)) if kind == _LIST]
+    if loans_kind in (_LIST, _DICT):
+        accounts.insert(1, f"loans:{loans_kind}")
+    ce = [key for key, kind in zip(('recent', 'all', 'previous', 'summary'), (ce_recent, ce_all, ce_previous, ce_summary)) if kind != _ABSENT]
+    rs = [key for key, kind in zip(('recent', 'all', 'summary'), (re_recent, re_all, re_summary)) if kind != _ABSENT]
+    return f"accounts[{','.join(accounts)}] analysisEnq[{','.join(ce)}] summaryEnq[{','.join(rs)}]"
+
+def _shape_counter():
+    # Each thread counts into its own dict, so extraction never takes a lock.
+    counts = getattr(_shape_local, 'counts', None)
+    if counts is None:
+        counts = _shape_local.counts = {}
+        with _SHAPE_LOCK:
+            _shape_counters.append((threading.current_thread(), counts))
+    return counts
+
+def get_payload_shape_counts():
+    """Payload shapes seen by process_single_record since process start: {shape description: count}."""
+    with _SHAPE_LOCK:
+        merged = collections.Counter(_SHAPE_COUNTS)
+        live = []
+        for thread, counts in _shape_counters:
+            alive = thread.is_alive()
+            by_name = collections.Counter()
+            for fingerprint, count in dict(counts).items():  # dict() copies in one step while the owner keeps counting
+                name = _SHAPE_NAMES.get(fingerprint)
+                if name is None:
+                    name = _SHAPE_NAMES[fingerprint] = describe_shape(fingerprint)
+                by_name[name] += count
+            merged.update(by_name)
+            if alive:
+                live.append((thread, counts))
+            else:
+                _SHAPE_COUNTS.update(by_name)
+        _shape_counters[:] = live
+        return dict(merged)
+
+def extract_report_sections(data_obj, pan_from_db=None):
+    """
+    Pulls (pan, raw enquiries, enquiry summary, accounts) out of a report payload, with every
+    section type-checked, and counts the payload's shape on the way. Returns None for payloads that aren't reports.
+    """
+    try:
+        counts = _shape_local.counts
+    except AttributeError:
+        counts = _shape_counter()
+    data = data_obj.get('data', {})
+    if not isinstance(data, dict):
+        counts[None] = counts.get(None, 0) + 1
+        return None
+
+    report_data = data.get('reportData', {})
+    report_summary = report_data.get('reportSummary', {})
+    personal_details = report_summary.get('personalDetails', _MISSING)
+    credit_analysis = report_data.get('creditAnalysis', {})
+
+    if pan_from_db:
+        pan = pan_from_db
+    else:
+        pan = (personal_details if personal_details is not _MISSING else {}).get('pan')
+
+    # ENQUIRIES
+    raw_enqs = []
+    enquiry_summary = {}
+    ce_section = credit_analysis.get('enquiries', {})
+    if isinstance(ce_section, dict):
+        ce_recent = ce_section.get('recent', _MISSING)
+        ce_all = ce_section.get('all', _MISSING)
+        ce_previous = ce_section.get('previous', _MISSING)
+        ce_summary = ce_section.get('summary', _MISSING)
+        if ce_recent is not _MISSING: raw_enqs.extend(ce_recent)
+        if ce_all is not _MISSING: raw_enqs.extend(ce_all)
+        if ce_previous is not _MISSING: raw_enqs.extend(ce_previous)
+    else:
+        ce_recent = ce_all = ce_previous = ce_summary = _MISSING
+
+    re_section = report_summary.get('enquiries', {})
+    if isinstance(re_section, dict):
+        re_recent = re_section.get('recent', _MISSING)
+        re_all = re_section.get('all', _MISSING)
+        re_summary = re_section.get('summary', _MISSING)
+        if re_recent is not _MISSING: raw_enqs.extend(re_recent)
+        if re_all is not _MISSING: raw_enqs.extend(re_all)
+    else:
+        re_recent = re_all = re_summary = _MISSING
+
+    if isinstance(ce_summary, dict):
+        enquiry_summary.update(ce_summary)
+    if isinstance(re_summary, dict):
+        enquiry_summary.update(re_summary)
+
+    # ACCOUNTS
+    all_accounts = []
+
+    credit_cards = credit_analysis.get('creditCards', _MISSING)
+    if isinstance(credit_cards, list):
+        all_accounts.extend(credit_cards)
+
+    loans_data = credit_analysis.get('loans', _MISSING)
+    if isinstance(loans_data, dict):
+        for _, val in loans_data.items():
+            if isinstance(val, list):
+                all_accounts.extend(val)
+    elif isinstance(loans_data, list):
+        all_accounts.extend(loans_data)
+
+    # Newer report payloads place many consumer/retail tradelines here.
+    other_loans = credit_analysis.get('otherLoans', _MISSING)
+    if isinstance(other_loans, list):
+        all_accounts.extend(other_loans)
+
+    others = credit_analysis.get('others', {})
+    overdraft_accounts = others.get('overdraft', _MISSING) if isinstance(others, dict) else _MISSING
+    if isinstance(overdraft_accounts, list):
+        all_accounts.extend(overdraft_accounts)
+
+    fingerprint = (
+        type(personal_details), type(ce_recent), type(ce_all), type(ce_previous), type(ce_summary),
+        type(re_recent), type(re_all), type(re_summary),
+        type(credit_cards), type(loans_data), type(other_loans), type(overdraft_accounts),
+    )
+    counts[fingerprint] = counts.get(fingerprint, 0) + 1
+    return pan, raw_enqs, enquiry_summary, all_accounts
+
 # ==========================================
 # CORE PROCESSING LOGIC (Single JSON Record)
 # ==========================================
 def process_single_record(data_obj, pan_from_db=None):
     rows = []
     try:
-        data = data_obj.get('data', {})
-        if not isinstance(data, dict): return []
-
-        report_data = data.get('reportData', {})
-        report_summary = report_data.get('reportSummary', {})
-        personal_details = report_summary.get('personalDetails', {})
-        credit_analysis = report_data.get('creditAnalysis', {})
-        enquiries_section = credit_analysis.get('enquiries', {})
-        
-        pan = pan_from_db if pan_from_db else personal_details.get('pan')
-
-        # ENQUIRIES
-        raw_enqs = []
-        ce_section = credit_analysis.get('enquiries', {})
-        if isinstance(ce_section, dict):
-            raw_enqs.extend(ce_section.get('recent', []))
-            raw_enqs.extend(ce_section.get('all', []))
-            raw_enqs.extend(ce_section.get('previous', []))
-
-        re_section = report_summary.get('enquiries', {})
-        if isinstance(re_section, dict):
-             raw_enqs.extend(re_section.get('recent', []))
-             raw_enqs.extend(re_section.get('all', []))
-
-        enquiry_summary = {}
-        if isinstance(ce_section, dict) and isinstance(ce_section.get('summary'), dict):
-            enquiry_summary.update(ce_section.get('summary'))
-        if isinstance(re_section, dict) and isinstance(re_section.get('summary'), dict):
-            enquiry_summary.update(re_section.get('summary'))
+        extracted = extract_report_sections(data_obj, pan_from_db)
+        if extracted is None: return []
+        pan, raw_enqs, enquiry_summary, all_accounts = extracted
 
         unique_enqs_map = {}
         for enq in raw_enqs:
@@ -720,32 +1242,6 @@ def process_single_record(data_obj, pan_from_db=None):
         if enq_90 is None: enq_90 = calculate_enquiries(enq_list, 90)
         if enq_365 is None: enq_365 = calculate_enquiries(enq_list, 365)
 
-        # ACCOUNTS
-        all_accounts = []
-
-        credit_cards = credit_analysis.get('creditCards', [])
-        if isinstance(credit_cards, list):
-            all_accounts.extend(credit_cards)
-
-        loans_data = credit_analysis.get('loans', {})
-        if isinstance(loans_data, dict):
-            for _, val in loans_data.items():
-                if isinstance(val, list):
-                    all_accounts.extend(val)
-        elif isinstance(loans_data, list):
-            all_accounts.extend(loans_data)
-
-        # Newer report payloads place many consumer/retail tradelines here.
-        other_loans = credit_analysis.get('otherLoans', [])
-        if isinstance(other_loans, list):
-            all_accounts.extend(other_loans)
-
-        others = credit_analysis.get('others', {})
-        if isinstance(others, dict):
-            overdraft_accounts = others.get('overdraft', [])
-            if isinstance(overdraft_accounts, list):
-                all_accounts.extend(overdraft_accounts)
-        
         if not all_accounts:
              row = {header: None for header in TARGET_HEADERS}
              row['pan'] = pan
@@ -765,11 +1261,13 @@ def process_single_record(data_obj, pan_from_db=None):
              rows.append(row)
 
         for account in all_accounts:
+            if isinstance(account, TypedAccount):
+                rows.append(build_typed_account_row(account, pan, enq_30, enq_60, enq_90, enq_365))
+                continue
             if not isinstance(account, dict): continue
 
             payment_history = account.get('paymentHistory', [])
-            delinq_stats = get_delinquency_buckets(payment_history)
-            suit_filed_flag, suit_filed_status = get_suit_filed_info(payment_history)
+            delinq_stats, suit_filed_flag, suit_filed_status = scan_payment_history(payment_history)
             
             total_tenure_raw = account.get('repaymentTenure')
             open_date_raw = account.get('accountOpenDate')
@@ -845,74 +1343,466 @@ def process_single_record(data_obj, pan_from_db=None):
         pass
     return rows
 
-def fetch_and_process_task(item):
+# ==========================================
+# RESULT STORE (Memoized per-report rows)
+# ==========================================
+
+# Everything that shapes the rows built from one report. The transform version
+# is a hash of their source, so editing any of them invalidates stored results.
+TRANSFORM_FUNCTIONS = (
+    clean_money, clean_str, clean_nullable_str, calculate_enquiries, get_pending_tenure,
+    _parse_history_month, classify_payment_status, scan_payment_history,
+    get_delinquency_buckets, get_suit_filed_info, get_written_off_info, parse_flexible_date,
+    parse_flexible_datetime, get_enquiry_summary_count, normalize_api_suit_filed_status,
+    _parse_api_history_month, _api_payment_status, normalize_api_payment_history, parse_api_payment_history,
+    normalize_api_enquiries, normalize_api_account_status, normalize_positive_tenure,
+    build_api_raw_account_lookup, TypedAccount, transform_api_account, build_qfinance_like_payload_from_api,
+    scan_typed_payment_history, _typed_date_text, build_typed_account_row,
+    extract_report_sections, process_single_record,
+)
+
+def _code_fingerprint(code):
+    """Bytecode, names and constants of a code object and its nested functions."""
+    parts = [code.co_code, repr(code.co_names).encode('utf-8')]
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            parts.append(_code_fingerprint(const))
+        elif isinstance(const, frozenset):
+            parts.append(repr(sorted(map(repr, const))).encode('utf-8'))  # Set order varies between processes
+        else:
+            parts.append(repr(const).encode('utf-8'))
+    return b''.join(parts)
+
+def _transform_fingerprint(obj):
+    try:
+        return inspect.getsource(obj).encode('utf-8')
+    except (OSError, TypeError):
+        # No source shipped (frozen or .pyc-only deploy): hash the compiled code instead.
+        if inspect.isclass(obj):
+            members = sorted((name, val) for name, val in vars(obj).items() if inspect.isfunction(val))
+            return repr(getattr(obj, '__annotations__', {})).encode('utf-8') + b''.join(
+                _code_fingerprint(val.__code__) for _, val in members
+            )
+        return _code_fingerprint(obj.__code__)
+
+def compute_transform_version():
+    digest = hashlib.sha1(repr(TARGET_HEADERS).encode('utf-8'))
+    for func in TRANSFORM_FUNCTIONS:
+        digest.update(_transform_fingerprint(func))
+    return digest.hexdigest()[:16]
+
+TRANSFORM_VERSION = compute_transform_version()
+
+_result_store = None
+_local_store_lock = threading.Lock()
+
+def get_result_store():
+    """Process-wide ResultStore for the current transform version."""
+    global _result_store
+    with _local_store_lock:
+        if _result_store is None:
+            _result_store = ResultStore(TRANSFORM_VERSION, TARGET_HEADERS)
+        return _result_store
+
+_pan_index = None
+
+def get_pan_index():
+    """Process-wide local PAN -> latest report index."""
+    global _pan_index
+    with _local_store_lock:
+        if _pan_index is None:
+            _pan_index = PanIndex()
+        return _pan_index
+
+_pan_index_build = None
+
+def _start_pan_index_build(index):
+    """Builds the PAN index on a daemon thread with its own pooled connection (at most one build at a time)."""
+    global _pan_index_build
+    with _local_store_lock:
+        if _pan_index_build is not None and _pan_index_build.is_alive():
+            return
+        def build():
+            conn = get_db_connection(DB_CONFIG)
+            cursor = conn.cursor()
+            try:
+                started = time.time()
+                counts = index.refresh(cursor, force=True)
+                print(f"PAN index built in {time.time() - started:.1f}s: {counts}")
+            except Exception as e:
+                print(f"[WARN] PAN index build failed: {e}")
+            finally:
+                cursor.close()
+                conn.close()
+        _pan_index_build = threading.Thread(target=build, name='pan-index-build', daemon=True)
+        _pan_index_build.start()
+
+def get_ready_pan_index(cursor):
+    """
+    Process-wide PAN index after an incremental refresh, or None if it cannot be used for this run.
+    An index that was never built is built in the background; until then callers query the database directly.
+    """
+    index = get_pan_index()
+    if not index.is_built():
+        print("PAN index not built yet; building it in the background and querying the database directly.")
+        _start_pan_index_build(index)
+        return None
+    try:
+        counts = index.refresh(cursor)  # Incremental, at most every PAN_INDEX_REFRESH_INTERVAL seconds
+        if counts:
+            print(f"PAN index refreshed: {counts}")
+    except Exception as e:
+        print(f"[WARN] PAN index refresh failed, querying the database directly: {e}")
+        return None
+    return index
+
+def resolve_qfinance_records(cursor, pan_index, normalized_pans=None):
+    """
+    [(pancardNumber, recommendationJsonFile)] latest-first for normalized_pans (None = every PAN).
+    A freshly refreshed index is trusted: a PAN it lacks has no usable report. PANs missing from a stale
+    index are looked up directly, so a lagging index never drops a PAN.
+    """
+    query = "SELECT pancardNumber, recommendationJsonFile FROM qfinance.q_report"
+    if pan_index is None:
+        if normalized_pans is None:
+            cursor.execute(query + " ORDER BY createdAt DESC")
+        else:
+            cursor.execute(
+                query + f" WHERE UPPER(TRIM(pancardNumber)) IN ({_build_in_clause(normalized_pans)}) ORDER BY createdAt DESC",
+                normalized_pans
+            )
+        return cursor.fetchall()
+    records = pan_index.resolve_qfinance(normalized_pans)
+    if normalized_pans is not None and not pan_index.is_fresh():
+        found = {str(pan).strip().upper() for pan, _ in records}
+        missing = [pan for pan in dict.fromkeys(normalized_pans) if pan not in found]
+        if missing:
+            records.extend(resolve_qfinance_records(cursor, None, missing))
+    return records
+
+def resolve_api_server_reports(cursor, pan_index, normalized_pans):
+    """[(panNumber, id)] of the latest SUCCESS api_server report per PAN: index first, database for the rest if it is stale."""
+    if pan_index is None:
+        return fetch_latest_api_report_ids(cursor, normalized_pans)
+    reports = pan_index.resolve_api_server(normalized_pans)
+    if pan_index.is_fresh():
+        return reports
+    found = {str(pan).strip().upper() for pan, _ in reports}
+    missing = [pan for pan in dict.fromkeys(normalized_pans) if pan not in found]
+    if missing:
+        reports.extend(fetch_latest_api_report_ids(cursor, missing))
+    return reports
+
+# Concurrent runs asking for the same report (by source key) share one download + transform.
+_report_flights = SingleFlight()
+
+def _copy_rows(rows):
+    # Each run gets its own row dicts, as it would from its own fetch.
+    return [dict(row) for row in rows]
+
+def get_single_flight_stats():
+    return _report_flights.stats()
+
+def qfinance_source_key(json_filename, pan):
+    return f"qfinance:{json_filename}:{pan}"
+
+def api_server_source_key(report_id, pan):
+    return f"api_server:{report_id}:{pan}"
+
+class ReportFetchError(Exception):
+    """A report could not be downloaded (error status, transport failure or unreadable body)."""
+
+def fetch_and_process_task(item, limiter=None, result_store=None, hedger=None, raise_errors=False):
     """
     Worker function to be executed in parallel.
     item is a tuple: (pan, json_filename)
+    limiter: optional concurrency.AdaptiveConcurrencyLimiter gating the download.
+    result_store: optional ResultStore; stored rows are returned without downloading.
+    hedger: optional hedging.HedgedFetcher; slow downloads get a duplicate request and the first response wins.
+    raise_errors: Bool, raise ReportFetchError for a failed download instead of logging it and returning [].
     """
     pan, json_filename = item
     full_url = BASE_URL + json_filename
-    
+    source_key = qfinance_source_key(json_filename, pan)
+
+    if result_store is not None:
+        cached_rows = result_store.get(source_key)
+        if cached_rows is not None:
+            return cached_rows
+
     try:
-        resp = requests.get(full_url, timeout=30)
-        if resp.status_code == 200:
-            json_data = resp.json()
-            return process_single_record(json_data, pan_from_db=pan)
-        else:
-            print(f"[ERROR] Failed download for {pan}: {resp.status_code}")
-            return []
-    except Exception as e:
-        print(f"[ERROR] Exception for {pan}: {e}")
+        return _report_flights.do(
+            source_key,
+            lambda: _download_and_process(pan, full_url, source_key, limiter, result_store, hedger),
+            share=_copy_rows
+        )
+    except ReportFetchError as e:
+        if raise_errors:
+            raise
+        print(f"[ERROR] {e}")
         return []
 
+def _download_and_process(pan, full_url, source_key, limiter, result_store, hedger):
+    try:
+        if limiter:
+            limiter.acquire()
+        started = time.time()
+        throttled = True
+        try:
+            resp = (hedger or get_http_session()).get(full_url, timeout=30)
+            throttled = resp.status_code == 429 or resp.status_code >= 500
+        finally:
+            if limiter:
+                limiter.release(time.time() - started, error=throttled)
+
+        if resp.status_code != 200:
+            raise ReportFetchError(f"Failed download for {pan}: {resp.status_code}")
+        json_data = resp.json()
+    except ReportFetchError:
+        raise
+    except Exception as e:
+        raise ReportFetchError(f"Exception for {pan}: {e}") from e
+
+    rows = process_single_record(json_data, pan_from_db=pan)
+    if result_store is not None:
+        result_store.put(source_key, rows)
+    return rows
+
+def _iter_completed(submit, tasks, window=None):
+    """
+    Submits (pan, json_filename) tasks and yields (future, task) as they finish.
+    With a window, at most that many tasks are submitted at once.
+    Pending futures are cancelled when the generator is closed early.
+    """
+    in_flight = {}
+    try:
+        if window is None:
+            in_flight = {submit(task): task for task in tasks}
+            for future in concurrent.futures.as_completed(in_flight):
+                yield future, in_flight[future]
+            return
+
+        task_iter = iter(tasks)
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < window:
+                task = next(task_iter, None)
+                if task is None:
+                    exhausted = True
+                    break
+                in_flight[submit(task)] = task
+            if not in_flight:
+                return
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future, in_flight.pop(future)
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+# ==========================================
+# DATAFRAME SCHEMA
+# ==========================================
+def apply_dtype_schema(df):
+    """
+    Converts the tradeline columns to compact dtypes in place: categoricals for
+    repeated labels, nullable small ints for counters, float64 for money and
+    datetime64 for dates. A column whose values don't fit its dtype is left as is.
+    """
+    for col in CATEGORY_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype('category')
+    for col in MONEY_COLUMNS:
+        if col in df:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    for col in COUNTER_COLUMNS:
+        if col not in df:
+            continue
+        for dtype in ('Int16', 'Int32', 'Int64'):
+            try:
+                df[col] = df[col].astype(dtype)
+                break
+            except (TypeError, ValueError, OverflowError):
+                continue
+    for col in DATE_COLUMNS:
+        if col not in df:
+            continue
+        parsed = pd.to_datetime(df[col], format="%Y-%m-%d", errors='coerce')
+        # Only convert when every date is ISO; otherwise the raw text would be lost.
+        if parsed.notna().sum() == df[col].notna().sum():
+            df[col] = parsed
+    return df
+
+def build_frame(rows):
+    df = pd.DataFrame(rows).reindex(columns=TARGET_HEADERS)
+    return apply_dtype_schema(df)
+
+def frame_to_rows(df):
+    """Row dicts of plain Python values (None for missing, dates as YYYY-MM-DD) for the streaming writers."""
+    out = df.copy()
+    for col in DATE_COLUMNS:
+        if col in out and pd.api.types.is_datetime64_any_dtype(out[col]):
+            out[col] = out[col].dt.strftime("%Y-%m-%d")
+    out = out.astype(object)
+    return out.where(out.notna(), None).to_dict('records')
+
+def excel_frame(df):
+    """
+    df for to_excel: date columns apply_dtype_schema had to leave as text (not every value ISO) get their
+    ISO values as datetimes, cell by cell, like the streaming writers (export.excel_row) do.
+    """
+    text_dates = [col for col in DATE_COLUMNS if col in df and not pd.api.types.is_datetime64_any_dtype(df[col])]
+    if not text_dates:
+        return df
+    out = df.copy()
+    for col in text_dates:
+        out[col] = out[col].map(excel_date)
+    return out
+
 # ==========================================
 # MAIN EXECUTION ROUTINE (Refactored for UI)
 # ==========================================
-def run_processor(max_workers=20, specific_pans=None, progress_callback=None):
+class WrittenOutput:
+    """
+    run_processor's result when the rows went straight to files instead of a DataFrame:
+    spilled to disk and streamed into the outputs (spilled=True), or written to a row_sink.
+    """
+
+    def __init__(self, rows, files, manifest=None, spilled=False):
+        self.rows = rows
+        self.files = files  # Paths written
+        self.manifest = manifest  # Export manifest for sharded workbooks, if any
+        self.spilled = spilled
+
+    def __len__(self):
+        return self.rows
+
+    def __repr__(self):
+        return f"WrittenOutput(rows={self.rows}, files={self.files!r}, spilled={self.spilled})"
+
+def run_processor(max_workers=20, specific_pans=None, progress_callback=None, output_file=OUTPUT_FILE, should_stop=None,
+                  scheduler=None, priority_class='bulk', adaptive=False, min_workers=2, run_stats=None,
+                  use_result_store=True, use_pan_index=None, memory_budget_mb=MEMORY_BUDGET_MB, csv_file=None,
+                  rows_per_file=EXPORT_ROWS_PER_FILE, split_by='rows', row_sink=None, shard=None, rollup=None,
+                  hedge=HEDGE_REQUESTS, raise_errors=False):
     """
     Executes the processing logic.
     :param max_workers: Int, number of threads.
     :param specific_pans: List[str], optional list of PANs to filter by.
-    :param progress_callback: Function(current, total, message) for UI updates.
-    :return: DataFrame (processed data) or None if error/empty.
+    :param progress_callback: Function(current, total, message[, event]) for UI updates. Called from a reporter
+                              thread at most PROGRESS_MAX_RATE times per second with coalesced state; a 4th
+                              parameter receives the event dict (throughput, ETA, failures, fallback hits).
+    :param output_file: Str, path of the Excel file to write, or None to skip writing.
+    :param should_stop: Function() -> bool, polled between tasks; returning True cancels the run.
+    :param scheduler: scheduler.PriorityScheduler shared between jobs. If given, tasks run on it instead of a private pool of max_workers threads.
+    :param priority_class: Str, scheduler priority class for this run's tasks ('interactive', 'bulk', 'background').
+    :param adaptive: Bool, tune in-flight downloads between min_workers and max_workers from observed latency/errors (AIMD).
+    :param min_workers: Int, lower bound on in-flight downloads in adaptive mode.
+    :param run_stats: Dict, optional; filled with run statistics (task counts, timings, concurrency over time).
+    :param use_result_store: Bool, serve reports already transformed today (same transform version) from the local result store.
+    :param use_pan_index: Bool, resolve the task list from the local PAN index (refreshed incrementally; PANs it
+                          lacks are queried directly only if it is stale, and an unbuilt index is built in the background).
+                          Defaults to USE_PAN_INDEX.
+    :param memory_budget_mb: Int, estimated MB of buffered rows before they spill to temporary files. None = unlimited.
+    :param csv_file: Str, optional path to also write the rows as CSV.
+    :param rows_per_file: Int, Excel outputs larger than this are split into several workbooks plus a manifest (export.py).
+    :param split_by: Str, 'rows' or 'pan' (never split one PAN's rows across workbooks).
+    :param row_sink: sinks.* object; if given, rows are written to it as reports finish instead of being
+                     buffered, and no output file or DataFrame is produced. The caller closes the sink.
+    :param shard: Tuple(int, int) (i, N), only process PANs in shard i of N (1-based, see pan_in_shard).
+    :param rollup: rollup.PanRollup; every PAN's rows are folded into it as they complete. The caller writes it
+                   (rollup.write(path)), so one rollup can span several batches.
+    :param hedge: Bool, send a duplicate request for downloads outstanding longer than a percentile of recent
+                  latencies (capped at HEDGE_MAX_RATE of requests); the first response wins. The hedger and its
+                  latency samples are shared by all runs in the process (hedging.get_hedged_fetcher).
+    :param raise_errors: Bool, let failures of the run itself (database, row_sink, output files) propagate instead of
+                         logging them and returning None. Reports that fail to download never abort the run; they are
+                         counted in run_stats['failed_tasks'] either way.
+    :return: DataFrame (processed data); WrittenOutput if the rows spilled to disk (the output files are then
+             written by streaming the spill files, nothing is held in memory) or went to row_sink;
+             None if error/empty/cancelled.
     """
-    if progress_callback: progress_callback(0, 0, "Initializing Database Connection...")
+    if run_stats is None:
+        run_stats = {}
+    reporter = ProgressReporter(progress_callback) if progress_callback else None
+    hedger = get_hedged_fetcher() if hedge else None
+    hedge_start = hedger.stats() if hedger else None
+    try:
+        return _run_processor(
+            reporter, run_stats, max_workers=max_workers, specific_pans=specific_pans, output_file=output_file,
+            should_stop=should_stop, scheduler=scheduler, priority_class=priority_class, adaptive=adaptive,
+            min_workers=min_workers, use_result_store=use_result_store, use_pan_index=use_pan_index,
+            memory_budget_mb=memory_budget_mb, csv_file=csv_file, rows_per_file=rows_per_file, split_by=split_by,
+            row_sink=row_sink, shard=shard, rollup=rollup, hedger=hedger, raise_errors=raise_errors
+        )
+    finally:
+        if hedger:
+            # Counters are process-wide; report this run's share (concurrent runs blur into each other).
+            run_stats['hedging'] = {
+                name: (val - hedge_start[name] if name in ('requests', 'hedges_issued', 'hedges_won') else val)
+                for name, val in hedger.stats().items()
+            }
+            print(f"Hedged downloads: {run_stats['hedging']['hedges_issued']} issued, "
+                  f"{run_stats['hedging']['hedges_won']} won, of {run_stats['hedging']['requests']} requests.")
+        if reporter:
+            reporter.close()
+            run_stats['progress'] = reporter.event()
+
+def _run_processor(reporter, run_stats, max_workers, specific_pans, output_file, should_stop, scheduler, priority_class,
+                   adaptive, min_workers, use_result_store, use_pan_index, memory_budget_mb, csv_file, rows_per_file,
+                   split_by, row_sink, shard, rollup, hedger, raise_errors):
+    report = reporter.update if reporter else (lambda current, total, message: None)
+    report(0, 0, "Initializing Database Connection...")
     print("Starting process...")
-    all_final_rows = []
+    all_final_rows = RowBuffer(TARGET_HEADERS, memory_budget_mb * 1024 * 1024 if memory_budget_mb else None)
+    sunk_rows = 0
+    failed_tasks = 0
+    limiter = None
+    if adaptive:
+        limiter = AdaptiveConcurrencyLimiter(min_limit=min_workers, max_limit=max_workers)
+        run_stats['concurrency'] = limiter.stats()
+    else:
+        run_stats['concurrency'] = {'mode': 'fixed', 'max': max_workers}
+    result_store = get_result_store() if use_result_store else None
+    shapes_at_start = get_payload_shape_counts()
+    if use_pan_index is None:
+        use_pan_index = USE_PAN_INDEX
 
+    conn = None
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db_connection(DB_CONFIG)
         cursor = conn.cursor()
         
-        query = ""
+        pan_index = None
+        if use_pan_index:
+            report(0, 0, "Refreshing local PAN index...")
+            pan_index = get_ready_pan_index(cursor)
+
         query_params = None
         # 1. BUILD QUERY
         if specific_pans and len(specific_pans) > 0:
             msg = f"Fetching records for {len(specific_pans)} specific PANs..."
             print(msg)
-            if progress_callback: progress_callback(0, 0, msg)
+            report(0, 0, msg)
 
-            normalized_pans = [str(p).strip().upper() for p in specific_pans if p and str(p).strip()]
-            placeholders = _build_in_clause(normalized_pans)
-            query = f"SELECT pancardNumber, recommendationJsonFile FROM qfinance.q_report WHERE UPPER(TRIM(pancardNumber)) IN ({placeholders}) ORDER BY createdAt DESC"
-            query_params = normalized_pans
+            query_params = [str(p).strip().upper() for p in specific_pans if p and str(p).strip()]
             
         else:
             msg = "Fetching ALL records from database..."
             print(msg)
-            if progress_callback: progress_callback(0, 0, msg)
-            
-            query = "SELECT pancardNumber, recommendationJsonFile FROM qfinance.q_report ORDER BY createdAt DESC"
+            report(0, 0, msg)
         
-        cursor.execute(query, query_params or ())
-        records = cursor.fetchall()
-        print(f"Found {len(records)} total records to process.")
+        records = resolve_qfinance_records(cursor, pan_index, query_params)
+        if pan_index:
+            print(f"Resolved {len(records)} latest reports from the local PAN index.")
+        else:
+            print(f"Found {len(records)} total records to process.")
         
         # 2. IDENTIFY UNIQUE TASKS (Main Thread)
         unique_tasks = []
         seen_pans = set()
         
-        if progress_callback: progress_callback(0, len(records), "Filtering Duplicates (Latest Wins)...")
+        report(0, len(records), "Filtering Duplicates (Latest Wins)...")
         print("Identifying unique/latest reports assigned to tasks...")
         for idx, (pan, json_filename) in enumerate(records):
             if not json_filename or str(json_filename).lower() == 'null':
@@ -924,88 +1814,363 @@ def run_processor(max_workers=20, specific_pans=None, progress_callback=None):
             
             unique_tasks.append((pan, json_filename))
         
+        if shard:
+            unique_tasks = [task for task in unique_tasks if pan_in_shard(task[0], *shard)]
+            print(f"Shard {shard[0]}/{shard[1]}: kept {len(unique_tasks)} tasks.")
+
         total_tasks = len(unique_tasks)
         print(f"Total Unique Valid Tasks to Process: {total_tasks}")
 
         fallback_rows = []
         fallback_pans = []
+        fallback_groups = []
         if specific_pans and len(specific_pans) > 0:
             normalized_requested = [str(p).strip().upper() for p in specific_pans if p and str(p).strip()]
-            missing_pans = [p for p in normalized_requested if p not in seen_pans]
+            missing_pans = [p for p in normalized_requested if p not in seen_pans and (not shard or pan_in_shard(p, *shard))]
             if missing_pans:
                 fallback_msg = f"Falling back to api_server for {len(missing_pans)} PAN(s) missing in qfinance..."
                 print(fallback_msg)
-                if progress_callback: progress_callback(0, max(total_tasks, 1), fallback_msg)
-                fallback_rows, fallback_pans = fetch_api_server_fallback_rows(cursor, missing_pans)
+                report(0, max(total_tasks, 1), fallback_msg)
+                fallback_rows, fallback_pans = fetch_api_server_fallback_rows(
+                    cursor, missing_pans, result_store=result_store,
+                    latest_reports=resolve_api_server_reports(cursor, pan_index, missing_pans) if pan_index else None,
+                    row_groups=fallback_groups
+                )
                 if fallback_pans:
                     print(f"api_server fallback returned data for: {', '.join(fallback_pans)}")
                 else:
                     print("api_server fallback returned no matching tradelines.")
 
         if total_tasks == 0 and not fallback_rows:
-            if progress_callback: progress_callback(0, 0, "No records found matching criteria.")
+            report(0, 0, "No records found matching criteria.")
             conn.close()
             return None
 
-        if total_tasks > 0 and progress_callback:
-            progress_callback(0, total_tasks, f"Starting Parallel Processing for {total_tasks} Tasks...")
+        if total_tasks > 0:
+            report(0, total_tasks, f"Starting Parallel Processing for {total_tasks} Tasks...")
         
         # 3. PARALLEL EXECUTION
         start_time = time.time()
+        if reporter and total_tasks > 0: reporter.start_tasks(total_tasks)
         
         if total_tasks > 0:
-            print(f"Starting {max_workers} parallel threads...")
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                future_to_pan = {executor.submit(fetch_and_process_task, task): task[0] for task in unique_tasks}
-                
-                for i, future in enumerate(concurrent.futures.as_completed(future_to_pan)):
-                    pan = future_to_pan[future]
+            executor = None
+            if scheduler is not None:
+                print(f"Submitting {total_tasks} tasks to the shared scheduler as '{priority_class}'...")
+                submit = lambda task: scheduler.submit(priority_class, fetch_and_process_task, task, limiter, result_store, hedger,
+                                                       raise_errors=True)
+            else:
+                print(f"Starting {max_workers} parallel threads{' (adaptive concurrency)' if limiter else ''}...")
+                executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+                submit = lambda task: executor.submit(fetch_and_process_task, task, limiter, result_store, hedger,
+                                                      raise_errors=True)
+
+            # On the shared scheduler, max_workers caps this run's in-flight tasks so
+            # several jobs interleave instead of one flooding the queue.
+            completed = _iter_completed(submit, unique_tasks, window=max_workers if scheduler is not None else None)
+            try:
+                for i, (future, (pan, json_filename)) in enumerate(completed):
+                    if should_stop and should_stop():
+                        print("Stop requested. Cancelling pending tasks...")
+                        break
+
                     try:
                         rows = future.result()
-                        all_final_rows.extend(rows)
+                        if rollup is not None:
+                            rollup.add(rows)
+                        if row_sink is not None:
+                            row_sink.write(rows, source=qfinance_source_key(json_filename, pan))
+                            sunk_rows += len(rows)
+                        else:
+                            all_final_rows.extend(rows)
                         
-                        # Update Progress
-                        if progress_callback:
-                            msg = f"Processed {i+1}/{total_tasks}: {pan}"
-                            progress_callback(i+1, total_tasks, msg)
+                        # Update Progress (recorded only; the reporter thread talks to the UI)
+                        if reporter: reporter.task_done(pan, rows=len(rows))
                             
                         if (i + 1) % 50 == 0:
                             print(f"Processed {i + 1}/{total_tasks} records...")
                             
                     except Exception as exc:
+                        # A failed download costs this PAN's rows; anything else (e.g. the sink) fails the run if asked to.
+                        if raise_errors and not isinstance(exc, ReportFetchError):
+                            raise
                         print(f"Task for {pan} generated an exception: {exc}")
+                        failed_tasks += 1
+                        if reporter: reporter.task_done(pan, failed=True)
+            finally:
+                completed.close()
+                if executor is not None:
+                    executor.shutdown(wait=True)
 
         if fallback_rows:
-            all_final_rows.extend(fallback_rows)
-            if progress_callback:
-                progress_callback(total_tasks, max(total_tasks, 1), f"api_server fallback added data for {len(fallback_pans)} PAN(s).")
+            if rollup is not None:
+                rollup.add(fallback_rows)
+            if row_sink is not None:
+                for source_key, rows in fallback_groups:
+                    row_sink.write(rows, source=source_key)
+                sunk_rows += len(fallback_rows)
+            else:
+                all_final_rows.extend(fallback_rows)
+            if reporter: reporter.add(fallback_hits=len(fallback_pans))
+            report(total_tasks, max(total_tasks, 1), f"api_server fallback added data for {len(fallback_pans)} PAN(s).")
                     
         elapsed_time = time.time() - start_time
         print(f"\nProcessing completed in {elapsed_time:.2f} seconds.")
+        run_stats.update({
+            'total_tasks': total_tasks,
+            'failed_tasks': failed_tasks,
+            'fallback_pans': len(fallback_pans),
+            'rows': sunk_rows if row_sink is not None else len(all_final_rows),
+            'spill_files': len(all_final_rows.spill_files),
+            'rollup_pans': len(rollup) if rollup is not None else 0,
+            'single_flight': get_single_flight_stats(),
+            'elapsed_seconds': round(elapsed_time, 2),
+            # Process-wide counters, so concurrent jobs in one worker blur into each other's deltas.
+            'payload_shapes': {
+                name: count - shapes_at_start.get(name, 0)
+                for name, count in get_payload_shape_counts().items()
+                if count > shapes_at_start.get(name, 0)
+            },
+        })
+        for name, count in sorted(run_stats['payload_shapes'].items(), key=lambda item: -item[1]):
+            print(f"  payload shape {count:>7}  {name}")
+        if limiter:
+            run_stats['concurrency'] = limiter.stats()
+            print(f"Adaptive concurrency finished at {limiter.stats()['final']} in-flight downloads.")
 
         cursor.close()
         conn.close()
 
+        if should_stop and should_stop():
+            report(0, 0, "Job cancelled.")
+            all_final_rows.close()
+            return None
+
     except Exception as e:
         print(f"CRITICAL ERROR: {e}")
-        if progress_callback: progress_callback(0, 0, f"Error: {e}")
+        report(0, 0, f"Error: {e}")
+        if conn is not None:
+            conn.close()  # Back to the pool (a pooled handle ignores a second close)
+        all_final_rows.close()
+        if raise_errors:
+            raise
+        return None
+
+    if row_sink is not None:
+        print(f"\nWrote {sunk_rows} rows to {getattr(row_sink, 'path', 'the output sink')}")
+        return WrittenOutput(sunk_rows, [row_sink.path] if getattr(row_sink, 'path', None) else []) if sunk_rows else None
+
+    if not len(all_final_rows):
+        print("\nNo data processed.")
         return None
 
-    if all_final_rows:
-        if progress_callback: progress_callback(total_tasks, total_tasks, "Generating Excel File...")
-        df = pd.DataFrame(all_final_rows)
-        df = df.reindex(columns=TARGET_HEADERS)
+    report(total_tasks, total_tasks, "Generating Excel File...")
+    if all_final_rows.spilled:
+        rows = len(all_final_rows)
         try:
-            df.to_excel(OUTPUT_FILE, index=False)
-            print(f"\nSUCCESS! Wrote {len(df)} rows to {OUTPUT_FILE}")
-            return df
+            manifest = write_spilled_outputs(all_final_rows, output_file, csv_file, rows_per_file, split_by)
+            if manifest:
+                run_stats['export'] = {'files': [f['path'] for f in manifest['files']], 'elapsed_seconds': manifest['elapsed_seconds']}
         except Exception as e:
-            print(f"Error writing Excel: {e}")
+            print(f"Error writing output: {e}")
+            if raise_errors:
+                raise
+            return None
+        finally:
+            all_final_rows.close()
+        files = [csv_file] if csv_file else []
+        if manifest:
+            files += [os.path.join(os.path.dirname(output_file), f['path']) for f in manifest['files']]
+        return WrittenOutput(rows, files, manifest=manifest, spilled=True)
+
+    df = build_frame(all_final_rows.rows)
+    all_final_rows.close()
+    if csv_file:
+        df.to_csv(csv_file, index=False)
+    if not output_file:
+        return df
+    try:
+        if len(df) > rows_per_file:
+            manifest = export_workbooks(iter_frame_chunks(df), output_file, TARGET_HEADERS, rows_per_file=rows_per_file,
+                                        split_by=split_by, date_columns=DATE_COLUMNS)
+            run_stats['export'] = {'files': [f['path'] for f in manifest['files']], 'elapsed_seconds': manifest['elapsed_seconds']}
             return df
-    else:
-        print("\nNo data processed.")
+        write_excel(df, output_file)
+        print(f"\nSUCCESS! Wrote {len(df)} rows to {output_file}")
+        return df
+    except Exception as e:
+        print(f"Error writing Excel: {e}")
+        if raise_errors:
+            raise
+        return df
+
+def write_excel(df, output_file):
+    """Writes an in-memory frame as one workbook, with the same date cells as the streaming writers."""
+    with pd.ExcelWriter(output_file, date_format="YYYY-MM-DD", datetime_format="YYYY-MM-DD") as writer:
+        excel_frame(df).to_excel(writer, index=False)
+        # The openpyxl engine ignores datetime_format; match the streaming writers' YYYY-MM-DD cells.
+        sheet = next(iter(writer.sheets.values()))
+        for col in DATE_COLUMNS:
+            column = TARGET_HEADERS.index(col) + 1
+            for (cell,) in sheet.iter_rows(min_row=2, min_col=column, max_col=column):
+                if cell.is_date:
+                    cell.number_format = 'YYYY-MM-DD'
+
+def write_spilled_outputs(buffer, output_file=None, csv_file=None, rows_per_file=EXPORT_ROWS_PER_FILE, split_by='rows'):
+    """
+    Writes a spilled RowBuffer to CSV and/or sharded Excel workbooks, streaming
+    its chunks so at most one spill block of rows is in memory at a time.
+    :return: Dict, the export manifest, or None if no Excel output was requested.
+    """
+    if csv_file:
+        first_chunk = True
+        for chunk in buffer.iter_chunks():
+            build_frame(chunk).to_csv(
+                csv_file, index=False, mode='w' if first_chunk else 'a', header=first_chunk
+            )
+            first_chunk = False
+    if not output_file:
         return None
+    return export_workbooks(buffer.iter_chunks(), output_file, TARGET_HEADERS, rows_per_file=rows_per_file,
+                            split_by=split_by, date_columns=DATE_COLUMNS)
+
+def iter_frame_chunks(df, chunk_rows=20000):
+    for start in range(0, len(df), chunk_rows):
+        yield frame_to_rows(df.iloc[start:start + chunk_rows])
+
+# ==========================================
+# COMMAND LINE INTERFACE
+# ==========================================
+def pan_in_shard(pan, index, count):
+    """
+    Deterministic PAN partitioning for --shard i/N: the same PAN always lands in
+    the same shard on every machine and run (crc32, not the salted built-in hash).
+    :param index: Int, 1-based shard number.
+    :param count: Int, total shards.
+    """
+    normalized = str(pan).strip().upper().encode('utf-8')
+    return zlib.crc32(normalized) % count == index - 1
+
+def parse_shard(text):
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must look like i/N, got {text!r}")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"Shard {text!r} out of range: need 1 <= i <= N")
+    return index, count
+
+def iter_pans(paths):
+    """
+    Streams unique, uppercased PANs found anywhere in the given files, in order of
+    first appearance. .xlsx workbooks are read cell by cell, anything else as text; '-' reads stdin.
+    """
+    seen = PanSet()
+    for path in paths:
+        if path == '-':
+            matches = iter_text_pans(sys.stdin)
+            fh = None
+        else:
+            fh = open(path, 'rb')
+            matches = iter_file_pans(fh, path)
+        try:
+            for pan in matches:
+                if seen.add(pan):
+                    yield pan
+        finally:
+            if fh is not None:
+                fh.close()
+
+def iter_batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def default_output_path(fmt, shard=None):
+    stem = os.path.splitext(OUTPUT_FILE)[0]
+    if shard:
+        stem += f".shard{shard[0]}of{shard[1]}"
+    return f"{stem}.{fmt}"
+
+# CLI exit statuses besides 0 (success) and 2 (bad arguments, from argparse)
+EXIT_FAILED = 1  # A batch, the output or the rollup failed; the output is incomplete
+EXIT_PARTIAL = 3  # Finished, but some reports failed to download
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract tradelines from credit reports without the UI.",
+                                     epilog=f"Exit status: 0 success, {EXIT_FAILED} run failed, "
+                                            f"{EXIT_PARTIAL} finished with failed downloads, 2 bad arguments.")
+    parser.add_argument('--pans-file', action='append', default=[], metavar='PATH',
+                        help="File with PANs in any layout; repeatable. '-' reads stdin. Default: every PAN in the database.")
+    parser.add_argument('--batch-size', type=int, default=5000, help="PANs per run_processor batch when reading PAN files.")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help="Parallel downloads (upper bound with --adaptive).")
+    parser.add_argument('--adaptive', action='store_true', help="Tune in-flight downloads from latency/errors.")
+    parser.add_argument('--hedge', action='store_true', default=HEDGE_REQUESTS,
+                        help="Re-send downloads that run past the recent latency percentile; the first response wins.")
+    parser.add_argument('--format', choices=SINK_FORMATS, help="Output format. Default: from --output's extension, else xlsx.")
+    parser.add_argument('--output', help="Output path (sqlite file for --format sqlite). Default: processed_trade_lines[.shardIofN].<format>.")
+    parser.add_argument('--table', default='tradelines', help="Table for the sqlite/mysql sinks (mysql target: OUTPUT_DB_* env).")
+    parser.add_argument('--shard', type=parse_shard, metavar='i/N', help="Only process PANs in shard i of N (1-based, by PAN hash).")
+    parser.add_argument('--no-result-store', action='store_true', help="Recompute every report instead of reusing today's results.")
+    parser.add_argument('--rollup', metavar='PATH', help="Also write one summary row per PAN (format from the extension, default csv).")
+    parser.add_argument('--rollup-aggregates', metavar='NAMES',
+                        help=f"Comma-separated rollup columns. Default: ROLLUP_AGGREGATES env or all of: {', '.join(ROLLUP_AGGREGATES)}.")
+    args = parser.parse_args(argv)
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    rollup = None
+    if args.rollup:
+        try:
+            rollup = PanRollup([name.strip() for name in (args.rollup_aggregates or '').split(',') if name.strip()] or None)
+        except ValueError as e:
+            parser.error(str(e))
+
+    fmt = args.format or infer_format(args.output)
+    output_path = args.output or default_output_path(fmt, args.shard)
+    sink = open_sink(fmt, output_path, TARGET_HEADERS, table=args.table, column_types=SQL_COLUMN_TYPES,
+                     db_config=OUTPUT_DB_CONFIG, date_columns=DATE_COLUMNS)
+    output_path = sink.path
+    run_options = dict(
+        max_workers=args.workers, adaptive=args.adaptive, hedge=args.hedge, shard=args.shard,
+        use_result_store=not args.no_result_store, row_sink=sink, rollup=rollup,
+    )
+    start_time = time.time()
+    failed_tasks = 0
+    stage = "run"
+    try:
+        if args.pans_file:
+            pans = iter_pans(args.pans_file)
+            if args.shard:
+                pans = (pan for pan in pans if pan_in_shard(pan, *args.shard))
+            for batch_no, batch in enumerate(iter_batches(pans, args.batch_size), start=1):
+                stage = f"batch {batch_no}"
+                print(f"\n=== Batch {batch_no}: {len(batch)} PANs ===")
+                run_stats = {}
+                run_processor(specific_pans=batch, run_stats=run_stats, raise_errors=True, **run_options)
+                failed_tasks += run_stats.get('failed_tasks', 0)
+        else:
+            run_stats = {}
+            run_processor(run_stats=run_stats, raise_errors=True, **run_options)
+            failed_tasks += run_stats.get('failed_tasks', 0)
+        stage = "rollup"
+        if rollup is not None:
+            rollup.write(args.rollup)
+    except Exception as e:
+        # A cron or sharded run must not look successful when a batch did not finish.
+        print(f"\n[ERROR] {stage} failed: {e}")
+        return EXIT_FAILED
+    finally:
+        sink.close()
+    print(f"\nDone: {sink.rows} rows written to {output_path} in {time.time() - start_time:.1f}s.")
+    if failed_tasks:
+        print(f"[WARN] {failed_tasks} report(s) failed to download; their PANs have no rows in the output.")
+        return EXIT_PARTIAL
+    return 0
 
 if __name__ == "__main__":
-    # Standard CLI execution
-    run_processor(max_workers=MAX_WORKERS)
+    sys.exit(main())
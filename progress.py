@@ -0,0 +1,156 @@
+"""
+Rate-limited progress reporting.
+
+ProgressReporter sits between run_processor's collector loop and the UI
+callback. The loop only records state (a lock and a few integer updates);
+a background thread delivers at most max_rate events per second, each one
+coalescing everything that happened since the previous event, with aggregated
+counters (throughput, ETA, failures, fallback hits). A slow callback delays
+the next event instead of the collector loop.
+"""
+import inspect
+import os
+import threading
+import time
+
+PROGRESS_MAX_RATE = float(os.getenv('PROGRESS_MAX_RATE', '4'))  # Events per second delivered to the callback
+
+def _accepts_event(callback):
+    try:
+        params = list(inspect.signature(callback).parameters.values())
+    except (TypeError, ValueError):
+        return False
+    if any(p.kind == p.VAR_POSITIONAL for p in params):
+        return True
+    return len([p for p in params if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]) >= 4
+
+def format_duration(seconds):
+    if seconds is None:
+        return '?'
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+class ProgressReporter:
+    def __init__(self, callback, max_rate=PROGRESS_MAX_RATE):
+        """
+        :param callback: Function(current, total, message[, event]). Called from the reporter thread;
+                         gets the event dict as a 4th argument if it accepts one.
+        :param max_rate: Float, maximum callback invocations per second.
+        """
+        self.callback = callback
+        self.interval = 1.0 / max(max_rate, 0.01)
+        self._wants_event = _accepts_event(callback)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._phase = (0, 0, '')
+        self._in_tasks = False
+        self._tasks_total = 0
+        self._tasks_started_at = None
+        self._tasks_finished_at = None
+        self._last_label = None
+        self.counters = {'completed': 0, 'failed': 0, 'rows': 0, 'fallback_hits': 0}
+        self.events = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='progress-reporter', daemon=True)
+        self._thread.start()
+
+    # ------------------------------------------
+    # COLLECTOR SIDE (never calls the callback)
+    # ------------------------------------------
+
+    def update(self, current, total, message):
+        """Phase message (connecting, resolving, exporting...)."""
+        with self._lock:
+            self._phase = (current, total, message)
+            self._in_tasks = False
+            self._dirty = True
+
+    def start_tasks(self, total):
+        with self._lock:
+            self._tasks_total = total
+            self._tasks_started_at = time.time()
+            self._tasks_finished_at = None
+            self._in_tasks = True
+            self._dirty = True
+
+    def task_done(self, label=None, rows=0, failed=False):
+        with self._lock:
+            self.counters['completed'] += 1
+            self.counters['rows'] += rows
+            if failed:
+                self.counters['failed'] += 1
+            self._last_label = label
+            if self.counters['completed'] >= self._tasks_total:
+                self._tasks_finished_at = time.time()
+            self._in_tasks = True
+            self._dirty = True
+
+    def add(self, **counters):
+        with self._lock:
+            for key, val in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + val
+            self._dirty = True
+
+    # ------------------------------------------
+    # EVENTS
+    # ------------------------------------------
+
+    def _event_locked(self):
+        done = self.counters['completed']
+        elapsed = (self._tasks_finished_at or time.time()) - self._tasks_started_at if self._tasks_started_at else 0.0
+        throughput = done / elapsed if elapsed > 0 else 0.0
+        remaining = max(self._tasks_total - done, 0)
+        eta = remaining / throughput if throughput > 0 else None
+        if self._in_tasks:
+            current, total = done, self._tasks_total
+            message = f"Processed {done}/{total}"
+            if self._last_label:
+                message += f": {self._last_label}"
+            message += f" · {throughput:.1f}/s · ETA {format_duration(eta)}"
+            if self.counters['failed']:
+                message += f" · {self.counters['failed']} failed"
+        else:
+            current, total, message = self._phase
+        return {
+            'current': current,
+            'total': total,
+            'message': message,
+            'tasks_total': self._tasks_total,
+            'throughput': round(throughput, 2),
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'elapsed_seconds': round(elapsed, 1),
+            **self.counters,
+        }
+
+    def event(self):
+        with self._lock:
+            return self._event_locked()
+
+    def _emit(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            event = self._event_locked()
+        self.events += 1
+        try:
+            if self._wants_event:
+                self.callback(event['current'], event['total'], event['message'], event)
+            else:
+                self.callback(event['current'], event['total'], event['message'])
+        except Exception as e:
+            print(f"[WARN] Progress callback failed: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._emit()
+
+    def close(self):
+        """Stops the reporter thread and delivers the final state."""
+        self._stop.set()
+        self._thread.join()
+        self._emit()
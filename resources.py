@@ -0,0 +1,146 @@
+"""
+Process-wide shared resources.
+
+Heavy modules (pandas, requests, mysql.connector) are imported on first use
+through LazyModule, so importing the processing code is cheap for the UI and
+for quick CLI calls. Database connections and the HTTP session live for the
+whole process and are reused by every run, job and rerun instead of being
+opened per run.
+"""
+import importlib
+import os
+import re
+import threading
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))  # Idle MySQL connections kept per configuration
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '64'))  # Keep-alive connections per host for object-store downloads
+
+# Standard Indian PAN: 5 letters, 4 digits, 1 letter.
+PAN_PATTERN = re.compile(r'[A-Za-z]{5}\d{4}[A-Za-z]')
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access."""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<lazy module {self.__dict__['_name']!r} ({state})>"
+
+mysql_connector = LazyModule('mysql.connector')
+requests = LazyModule('requests')
+
+_lock = threading.Lock()
+_db_pools = {}
+_http_session = None
+
+# ------------------------------------------
+# MYSQL CONNECTION POOL
+# ------------------------------------------
+
+class _PooledConnection:
+    """Connection handle whose close() hands the connection back to its pool."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+class ConnectionPool:
+    """
+    Lazily filled pool: connections are opened on demand and up to max_idle of
+    them are kept for reuse. Idle connections are pinged (reconnecting if the
+    server dropped them) before being handed out.
+    """
+
+    def __init__(self, db_config, max_idle=DB_POOL_SIZE):
+        self.db_config = dict(db_config)
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def get(self):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = mysql_connector.connect(**self.db_config)
+                with self._lock:
+                    self.opened += 1
+                return _PooledConnection(self, conn)
+            try:
+                conn.ping(reconnect=True, attempts=1, delay=0)
+            except Exception:
+                _close_quietly(conn)
+                continue
+            with self._lock:
+                self.reused += 1
+            return _PooledConnection(self, conn)
+
+    def release(self, conn):
+        try:
+            # Ends the implicit read transaction, so the next user sees fresh data.
+            if conn.unread_result:
+                conn.consume_results()
+            conn.rollback()
+        except Exception:
+            _close_quietly(conn)
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        _close_quietly(conn)
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+def get_db_connection(db_config):
+    """Connection for db_config from the process-wide pool; call close() to return it."""
+    key = tuple(sorted((k, str(v)) for k, v in db_config.items()))
+    with _lock:
+        pool = _db_pools.get(key)
+        if pool is None:
+            pool = _db_pools[key] = ConnectionPool(db_config)
+    return pool.get()
+
+# ------------------------------------------
+# HTTP SESSION
+# ------------------------------------------
+
+def get_http_session():
+    """Shared requests.Session with a connection pool sized for parallel downloads."""
+    global _http_session
+    if _http_session is None:
+        with _lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _http_session = session
+    return _http_session
@@ -0,0 +1,136 @@
+"""
+Persistent store of already-computed tradeline rows.
+
+Rows produced by process_single_record for one report are stored column-wise
+(one list per header, zlib-compressed JSON) in a local SQLite file, keyed by
+(source report, transform version, as-of date). The as-of date is part of the
+key because enquiry counts, pending tenure and settled flags are relative to
+today; the transform version changes whenever the transform code does, so
+stale entries are never served and are pruned on open.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import date
+
+RESULT_STORE_PATH = os.getenv('RESULT_STORE_PATH', os.path.join('cache', 'results.sqlite3'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    source_key TEXT NOT NULL,
+    version TEXT NOT NULL,
+    as_of TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    payload BLOB NOT NULL,
+    PRIMARY KEY (source_key, version, as_of)
+);
+"""
+
+def _json_default(val):
+    # numpy scalars (rows taken back out of a DataFrame) unwrap to Python values; anything else is stored as text.
+    if hasattr(val, 'item'):
+        return val.item()
+    return str(val)
+
+def encode_rows(rows, headers):
+    columns = {header: [row.get(header) for row in rows] for header in headers}
+    return zlib.compress(json.dumps({'n': len(rows), 'columns': columns}, separators=(',', ':'), default=_json_default).encode('utf-8'))
+
+def decode_rows(payload):
+    doc = json.loads(zlib.decompress(payload).decode('utf-8'))
+    columns = doc['columns']
+    headers = list(columns)
+    return [{header: columns[header][idx] for header in headers} for idx in range(doc['n'])]
+
+class ResultStore:
+    def __init__(self, version, headers, path=RESULT_STORE_PATH):
+        """
+        :param version: Str, transform-code version; entries from other versions are ignored and pruned.
+        :param headers: List[str], row columns to persist.
+        :param path: Str, SQLite file location.
+        """
+        self.version = version
+        self.headers = list(headers)
+        self.path = path
+        self._local = threading.local()
+        self._pruned_for = None
+        self.hits = 0
+        self.misses = 0
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _as_of(self):
+        as_of = date.today().isoformat()
+        if self._pruned_for != as_of:
+            self._pruned_for = as_of
+            self.prune(as_of)
+        return as_of
+
+    def get(self, source_key):
+        """Returns the stored rows for a report, or None if not computed under the current version today."""
+        try:
+            row = self._conn().execute(
+                "SELECT payload FROM results WHERE source_key = ? AND version = ? AND as_of = ?",
+                (source_key, self.version, self._as_of())
+            ).fetchone()
+        except sqlite3.Error as e:
+            # The store is only a cache; fall back to recomputing.
+            print(f"[WARN] Result store read failed for {source_key}: {e}")
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return decode_rows(row[0])
+
+    def get_many(self, source_keys):
+        """Returns {source_key: rows} for the keys that are stored."""
+        found = {}
+        keys = list(source_keys)
+        try:
+            as_of = self._as_of()
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ", ".join(["?"] * len(chunk))
+                for source_key, payload in self._conn().execute(
+                    f"SELECT source_key, payload FROM results WHERE version = ? AND as_of = ? AND source_key IN ({placeholders})",
+                    [self.version, as_of] + chunk
+                ):
+                    found[source_key] = decode_rows(payload)
+        except sqlite3.Error as e:
+            # The store is only a cache; every key is recomputed.
+            print(f"[WARN] Result store read failed for {len(keys)} keys: {e}")
+            found = {}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, source_key, rows):
+        if not rows:
+            return
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO results (source_key, version, as_of, created_at, payload) VALUES (?, ?, ?, ?, ?)",
+                (source_key, self.version, self._as_of(), time.time(), encode_rows(rows, self.headers))
+            )
+        except sqlite3.Error as e:
+            print(f"[WARN] Result store write failed for {source_key}: {e}")
+
+    def prune(self, as_of=None):
+        """Deletes entries from other transform versions or earlier days."""
+        as_of = as_of or date.today().isoformat()
+        self._conn().execute("DELETE FROM results WHERE version != ? OR as_of != ?", (self.version, as_of))
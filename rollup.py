@@ -0,0 +1,119 @@
+"""
+Per-PAN rollups maintained while a run is in progress.
+
+PanRollup receives every PAN's tradeline rows as the report completes and
+folds them into a fixed-size list of running aggregates per PAN, so the
+summary costs O(PANs) memory no matter how many tradelines there are, and
+downstream systems never have to group the detail rows again.
+"""
+import os
+
+from sinks import infer_format, open_sink
+
+BUCKETS = ('current', '30+', '60+', '90+')  # Worst delinquency bucket, mildest first
+
+def _number(val):
+    try:
+        number = float(val)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if number != number else number
+
+def _is_yes(val):
+    return str(val).strip().lower() in ('yes', 'y', 'true', '1')
+
+def _bucket(row):
+    for idx, col in ((3, 'delinquencies90Days'), (2, 'delinquencies60Days'), (1, 'delinquencies30Days')):
+        if _number(row.get(col)) > 0:
+            return idx
+    return 0
+
+# Aggregate name -> (operation, source column). Operations: count, sum, max, any, worst_bucket.
+ROLLUP_AGGREGATES = {
+    'accounts': ('count', None),
+    'totalOutstanding': ('sum', 'currentOutstanding'),
+    'totalSanctioned': ('sum', 'totalSanctionedAmount'),
+    'totalEMI': ('sum', 'EMI'),
+    'totalOverdue': ('sum', 'OverdueAmount'),
+    'totalWrittenOffAmount': ('sum', 'WrittenOffAmount'),
+    'worstDelinquencyBucket': ('worst_bucket', None),
+    'maxCurrentDpd': ('max', 'currentDpd'),
+    'anyWrittenOff': ('any', 'WrittenOffFlag'),
+    'anySuitFiled': ('any', 'SuitFiled'),
+    # Enquiry counts are report-level, repeated on every row of the PAN.
+    'Enq_30Days': ('max', 'Enq_30Days'),
+    'Enq_60Days': ('max', 'Enq_60Days'),
+    'Enq_90Days': ('max', 'Enq_90Days'),
+    'Enq_1Year': ('max', 'Enq_1Year'),
+}
+# Comma-separated aggregate names; unset = all of ROLLUP_AGGREGATES.
+DEFAULT_ROLLUP = [name.strip() for name in os.getenv('ROLLUP_AGGREGATES', '').split(',') if name.strip()] or list(ROLLUP_AGGREGATES)
+
+class PanRollup:
+    def __init__(self, aggregates=None, pan_column='pan'):
+        """
+        :param aggregates: List[str], names from ROLLUP_AGGREGATES, in output order. Defaults to DEFAULT_ROLLUP.
+        :param pan_column: Str, column rows are grouped by.
+        """
+        aggregates = list(aggregates or DEFAULT_ROLLUP)
+        unknown = [name for name in aggregates if name not in ROLLUP_AGGREGATES]
+        if unknown:
+            raise ValueError(f"Unknown rollup aggregate(s): {', '.join(unknown)}")
+        self.aggregates = aggregates
+        self.pan_column = pan_column
+        self.headers = [pan_column] + aggregates
+        self._specs = [ROLLUP_AGGREGATES[name] for name in aggregates]
+        self._initial = [0.0 if op in ('sum', 'max') else 0 for op, _ in self._specs]
+        self._state = {}  # pan -> list of running values, one per aggregate
+
+    def add(self, rows):
+        """Folds one batch of tradeline rows (usually one report) into the rollups."""
+        for row in rows:
+            pan = row.get(self.pan_column) or ''
+            state = self._state.get(pan)
+            if state is None:
+                state = self._state[pan] = list(self._initial)
+            for idx, (op, col) in enumerate(self._specs):
+                if op == 'count':
+                    state[idx] += 1
+                elif op == 'sum':
+                    state[idx] += _number(row.get(col))
+                elif op == 'max':
+                    state[idx] = max(state[idx], _number(row.get(col)))
+                elif op == 'any':
+                    state[idx] = state[idx] or _is_yes(row.get(col))
+                elif op == 'worst_bucket':
+                    state[idx] = max(state[idx], _bucket(row))
+
+    def __len__(self):
+        return len(self._state)
+
+    def iter_rows(self):
+        for pan, state in self._state.items():
+            row = {self.pan_column: pan}
+            for name, (op, _), val in zip(self.aggregates, self._specs, state):
+                if op == 'any':
+                    val = "Yes" if val else "No"
+                elif op == 'worst_bucket':
+                    val = BUCKETS[val]
+                elif op == 'max' and val.is_integer():
+                    val = int(val)  # Counters (enquiries) come back as counts, not 3.0
+                row[name] = val
+            yield row
+
+    def write(self, path, fmt=None):
+        """Writes one row per PAN to path (format from the extension: xlsx, csv, jsonl or sqlite)."""
+        sink = open_sink(fmt or infer_format(path, default='csv'), path, self.headers, table='pan_rollup')
+        try:
+            batch = []
+            for row in self.iter_rows():
+                batch.append(row)
+                if len(batch) >= 5000:
+                    sink.write(batch)
+                    batch = []
+            if batch:
+                sink.write(batch)
+        finally:
+            sink.close()
+        print(f"Wrote rollups for {len(self)} PANs to {sink.path}")
+        return sink.path
@@ -0,0 +1,103 @@
+"""
+Shared priority scheduler for fetch/transform tasks.
+
+One pool of threads serves every running job. Tasks are tagged with a
+priority class; idle threads always take the highest-priority runnable task,
+and each class has a quota on how many threads it may occupy at once, so a
+bulk run can never take the capacity reserved for interactive lookups.
+"""
+import collections
+import concurrent.futures
+import os
+import threading
+
+# Highest priority first.
+PRIORITY_CLASSES = ('interactive', 'bulk', 'background')
+
+DEFAULT_TOTAL_WORKERS = int(os.getenv('MAX_TOTAL_WORKERS', '40'))
+DEFAULT_CLASS_QUOTAS = {
+    'interactive': int(os.getenv('INTERACTIVE_WORKER_QUOTA', str(DEFAULT_TOTAL_WORKERS))),
+    'bulk': int(os.getenv('BULK_WORKER_QUOTA', str(max(1, DEFAULT_TOTAL_WORKERS * 3 // 4)))),
+    'background': int(os.getenv('BACKGROUND_WORKER_QUOTA', '2')),
+}
+
+class PriorityScheduler:
+    """
+    Thread pool with priority classes and per-class concurrency quotas.
+    submit() returns a concurrent.futures.Future, so callers can keep using
+    as_completed() and Future.cancel() exactly as with a ThreadPoolExecutor.
+    """
+
+    def __init__(self, total_workers=DEFAULT_TOTAL_WORKERS, quotas=None, name='scheduler'):
+        self.total_workers = max(1, int(total_workers))
+        self.quotas = dict(DEFAULT_CLASS_QUOTAS)
+        if quotas:
+            self.quotas.update(quotas)
+        self._queues = {cls: collections.deque() for cls in PRIORITY_CLASSES}
+        self._in_flight = {cls: 0 for cls in PRIORITY_CLASSES}
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self._threads = []
+        for idx in range(self.total_workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"{name}-{idx}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, priority_class, fn, *args, **kwargs):
+        if priority_class not in self._queues:
+            raise ValueError(f"Unknown priority class: {priority_class}")
+        future = concurrent.futures.Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Scheduler has been shut down")
+            self._queues[priority_class].append((future, fn, args, kwargs))
+            self._cond.notify()
+        return future
+
+    def stats(self):
+        with self._cond:
+            return {
+                cls: {'queued': len(self._queues[cls]), 'in_flight': self._in_flight[cls], 'quota': self.quotas.get(cls)}
+                for cls in PRIORITY_CLASSES
+            }
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._shutdown = True
+            for queue in self._queues.values():
+                while queue:
+                    queue.popleft()[0].cancel()
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _next_runnable(self):
+        for cls in PRIORITY_CLASSES:
+            if self._queues[cls] and self._in_flight[cls] < self.quotas.get(cls, self.total_workers):
+                return cls, self._queues[cls].popleft()
+        return None, None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                cls, item = self._next_runnable()
+                while item is None:
+                    if self._shutdown:
+                        return
+                    self._cond.wait()
+                    cls, item = self._next_runnable()
+                self._in_flight[cls] += 1
+
+            future, fn, args, kwargs = item
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as exc:
+                        future.set_exception(exc)
+            finally:
+                with self._cond:
+                    self._in_flight[cls] -= 1
+                    # A freed quota slot may unblock a task another thread skipped.
+                    self._cond.notify_all()
@@ -0,0 +1,72 @@
+"""
+Process-wide single-flight for report fetches.
+
+When several runs (jobs, CLI batches, analysts) ask for the same report at the
+same time, the first caller performs the download and transform and every
+concurrent caller for the same key waits for that one result instead of
+repeating the work. Nothing is cached once the call finishes; the result
+store covers later requests.
+"""
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def begin(self, key):
+        """
+        Joins or starts the call for key.
+        :return: (call, leader). The leader must call finish(); everyone else calls call.wait().
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.leaders += 1
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.result = result
+        call.error = error
+        call.done.set()
+
+    def do(self, key, fn, share=None):
+        """
+        Runs fn() once for all concurrent callers with the same key.
+        :param share: Function(result) -> result handed to each waiting caller (e.g. a copy). Default: the same object.
+        """
+        call, leader = self.begin(key)
+        if not leader:
+            result = call.wait()
+            return share(result) if share else result
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result=result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'leaders': self.leaders, 'shared': self.shared, 'in_flight': len(self._calls)}
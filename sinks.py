@@ -0,0 +1,289 @@
+"""
+Row sinks for streaming output.
+
+A sink receives tradeline rows as each report finishes (write, tagged with the
+source report they came from) and is closed once at the end of the run
+(close), so a run never needs to hold its output in memory.
+run_processor(row_sink=...) and the command-line interface write through these.
+File sinks ignore the source; database sinks upsert by (pan, source report).
+"""
+import csv
+import json
+import os
+import sqlite3
+import time
+
+from export import ROWS_PER_SHEET, excel_cell, excel_row
+from resources import mysql_connector
+
+SINK_FORMATS = ('xlsx', 'csv', 'jsonl', 'sqlite', 'mysql')
+SQLITE_EXTENSIONS = ('sqlite', 'sqlite3', 'db')
+
+class CsvSink:
+    def __init__(self, path, headers):
+        self.path = path
+        self.headers = list(headers)
+        self.rows = 0
+        self._fh = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._fh)
+        self._writer.writerow(self.headers)
+
+    def write(self, rows, source=None):
+        self._writer.writerows([['' if row.get(h) is None else row.get(h) for h in self.headers] for row in rows])
+        self.rows += len(rows)
+
+    def close(self):
+        self._fh.close()
+
+class JsonlSink:
+    def __init__(self, path, headers):
+        self.path = path
+        self.headers = list(headers)
+        self.rows = 0
+        self._fh = open(path, 'w', encoding='utf-8')
+
+    def write(self, rows, source=None):
+        for row in rows:
+            self._fh.write(json.dumps({h: row.get(h) for h in self.headers}, default=str))
+            self._fh.write('\n')
+        self.rows += len(rows)
+
+    def close(self):
+        self._fh.close()
+
+class ExcelSink:
+    """Write-only workbook; continues on a new sheet before Excel's row limit."""
+
+    def __init__(self, path, headers, rows_per_sheet=ROWS_PER_SHEET, date_columns=()):
+        import openpyxl
+
+        self.path = path
+        self.headers = list(headers)
+        self.date_columns = frozenset(date_columns or ())
+        self.rows_per_sheet = max(1, min(int(rows_per_sheet), ROWS_PER_SHEET))
+        self.rows = 0
+        self._workbook = openpyxl.Workbook(write_only=True)
+        self._sheet = None
+        self._sheet_rows = 0
+        self._sheets = 0
+
+    def _next_sheet(self):
+        self._sheets += 1
+        self._sheet = self._workbook.create_sheet(f"Sheet{self._sheets}")
+        self._sheet.append(self.headers)
+        self._sheet_rows = 0
+
+    def write(self, rows, source=None):
+        for row in rows:
+            if self._sheet is None or self._sheet_rows >= self.rows_per_sheet:
+                self._next_sheet()
+            self._sheet.append(excel_row(self._sheet, row, self.headers, self.date_columns))
+            self._sheet_rows += 1
+        self.rows += len(rows)
+
+    def close(self):
+        if self._sheet is None:
+            self._next_sheet()
+        self._workbook.save(self.path)
+
+class TeeSink:
+    """Writes the same rows to several sinks, e.g. a CSV and a workbook of one run."""
+
+    def __init__(self, *sinks):
+        self.sinks = list(sinks)
+        self.path = ', '.join(str(getattr(sink, 'path', '?')) for sink in self.sinks)
+
+    @property
+    def rows(self):
+        return self.sinks[0].rows if self.sinks else 0
+
+    def write(self, rows, source=None):
+        for sink in self.sinks:
+            sink.write(rows, source=source)
+
+    def close(self):
+        errors = []
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+def infer_format(path, default='xlsx'):
+    ext = os.path.splitext(path or '')[1].lower().lstrip('.')
+    if ext in SQLITE_EXTENSIONS:
+        return 'sqlite'
+    return ext if ext in SINK_FORMATS else default
+
+def open_sink(fmt, path, headers, table='tradelines', column_types=None, db_config=None, date_columns=None):
+    """
+    :param fmt: Str, one of SINK_FORMATS.
+    :param path: Str, output file (ignored for mysql).
+    :param headers: List[str], columns to write, in order.
+    :param table: Str, target table for database sinks.
+    :param column_types: Dict[str, 'int'|'float'], column types for database sinks (others are text).
+    :param db_config: Dict, mysql.connector.connect() arguments for the mysql sink.
+    :param date_columns: List[str], columns whose ISO date text the xlsx sink writes as Excel dates.
+    """
+    if fmt == 'mysql':
+        if not db_config or not db_config.get('database'):
+            raise ValueError("The mysql sink needs a target database (OUTPUT_DB_NAME).")
+        return MySqlSink(db_config, headers, table=table, column_types=column_types)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if fmt == 'sqlite':
+        return SqliteSink(path, headers, table=table, column_types=column_types)
+    if fmt == 'csv':
+        return CsvSink(path, headers)
+    if fmt == 'jsonl':
+        return JsonlSink(path, headers)
+    if fmt == 'xlsx':
+        return ExcelSink(path, headers, date_columns=date_columns)
+    raise ValueError(f"Unknown output format: {fmt}")
+
+# ------------------------------------------
+# DATABASE SINKS
+# ------------------------------------------
+
+class _DatabaseSink:
+    """
+    Bulk loader into a tradelines table keyed by (pan, source_report, line_no).
+    Rows are buffered per source report and flushed in large transactions; each
+    flush deletes the previous rows of the reports it contains before inserting,
+    so rerunning a report replaces its tradelines instead of duplicating them.
+    """
+    placeholder = '?'
+
+    def __init__(self, headers, table, column_types=None, batch_rows=5000):
+        self.headers = list(headers)
+        self.table = table
+        self.column_types = column_types or {}
+        self.batch_rows = max(1, int(batch_rows))
+        self.rows = 0
+        self.reports = 0
+        self._pending = {}
+        self._pending_rows = 0
+
+    def _quote(self, name):
+        return f'"{name}"'
+
+    def _sql_type(self, header):
+        return {'int': 'INTEGER', 'float': 'REAL'}.get(self.column_types.get(header), 'TEXT')
+
+    def _key_types(self):
+        return 'TEXT', 'TEXT'
+
+    def _create_table_sql(self):
+        pan_type, source_type = self._key_types()
+        columns = [f"{self._quote(h)} {pan_type if h == 'pan' else self._sql_type(h)}" for h in self.headers]
+        if 'pan' not in self.headers:
+            columns.insert(0, f"{self._quote('pan')} {pan_type}")
+        return (
+            f"CREATE TABLE IF NOT EXISTS {self._quote(self.table)} ("
+            f"{self._quote('source_report')} {source_type} NOT NULL, {self._quote('line_no')} INTEGER NOT NULL, "
+            + ", ".join(columns)
+            + f", {self._quote('loaded_at')} REAL, "
+            f"PRIMARY KEY ({self._quote('pan')}, {self._quote('source_report')}, {self._quote('line_no')}))"
+        )
+
+    def write(self, rows, source=None):
+        if source is None:
+            # Without a report id, a PAN's rows replace that PAN's earlier unattributed rows.
+            by_pan = {}
+            for row in rows:
+                by_pan.setdefault(row.get('pan'), []).append(row)
+            for pan, pan_rows in by_pan.items():
+                self._add((pan or '', ''), pan_rows)
+        else:
+            pan = rows[0].get('pan') if rows else source.rsplit(':', 1)[-1]
+            self._add((pan or '', source), rows)
+        if self._pending_rows >= self.batch_rows:
+            self.flush()
+
+    def _add(self, key, rows):
+        self._pending_rows += len(rows) - len(self._pending.get(key, ()))
+        self._pending[key] = list(rows)
+
+    def flush(self):
+        if not self._pending:
+            return
+        now = time.time()
+        columns = ['source_report', 'line_no'] + self.headers + ['loaded_at']
+        if 'pan' not in self.headers:
+            columns.insert(2, 'pan')
+        values = []
+        for (pan, source), rows in self._pending.items():
+            for line_no, row in enumerate(rows):
+                record = {'pan': pan, 'source_report': source, 'line_no': line_no, 'loaded_at': now}
+                values.append([record[c] if c in record else excel_cell(row.get(c)) for c in columns])
+        ph = self.placeholder
+        delete_sql = (f"DELETE FROM {self._quote(self.table)} "
+                      f"WHERE {self._quote('pan')} = {ph} AND {self._quote('source_report')} = {ph}")
+        insert_sql = (f"INSERT INTO {self._quote(self.table)} ({', '.join(self._quote(c) for c in columns)}) "
+                      f"VALUES ({', '.join([ph] * len(columns))})")
+        cursor = self._conn.cursor()
+        try:
+            self._begin()
+            cursor.executemany(delete_sql, list(self._pending))
+            if values:
+                cursor.executemany(insert_sql, values)
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        self.rows += len(values)
+        self.reports += len(self._pending)
+        self._pending = {}
+        self._pending_rows = 0
+
+    def _begin(self):
+        pass
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._conn.close()
+
+class SqliteSink(_DatabaseSink):
+    """Default database target: an embedded SQLite file."""
+
+    def __init__(self, path, headers, table='tradelines', column_types=None, batch_rows=5000):
+        super().__init__(headers, table, column_types, batch_rows)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(self._create_table_sql())
+        self._conn.commit()
+
+class MySqlSink(_DatabaseSink):
+    placeholder = '%s'
+
+    def __init__(self, db_config, headers, table='tradelines', column_types=None, batch_rows=5000):
+        super().__init__(headers, table, column_types, batch_rows)
+        self.path = f"mysql://{db_config.get('host')}/{db_config.get('database')}.{table}"
+        self._conn = mysql_connector.connect(**db_config)
+        self._conn.autocommit = False
+        cursor = self._conn.cursor()
+        cursor.execute(self._create_table_sql())
+        cursor.close()
+        self._conn.commit()
+
+    def _quote(self, name):
+        return f"`{name}`"
+
+    def _sql_type(self, header):
+        return {'int': 'INT', 'float': 'DOUBLE'}.get(self.column_types.get(header), 'TEXT')
+
+    def _key_types(self):
+        return 'VARCHAR(16)', 'VARCHAR(255)'
+
+    def _begin(self):
+        if not self._conn.in_transaction:
+            self._conn.start_transaction()
@@ -0,0 +1,119 @@
+"""
+Memory-budgeted row buffer.
+
+RowBuffer collects tradeline rows in memory until their estimated size passes
+a budget, then writes them to a temporary columnar spill file (the same
+zlib-compressed column-wise encoding the result store uses) and starts over.
+Reading the buffer back streams the spill files in order followed by whatever
+is still in memory, so row order is exactly the order rows were added.
+"""
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+from result_store import encode_rows, decode_rows
+
+SPILL_DIR = os.getenv('SPILL_DIR') or None  # Parent directory for spill files; system temp dir if unset
+_SAMPLE_EVERY = 64  # After the first rows, re-estimate row size on every Nth row
+_WARMUP_ROWS = 200
+_LENGTH = struct.Struct('<Q')
+
+def estimate_row_bytes(row):
+    """Rough in-memory size of a row dict: the dict plus each key/value object it references."""
+    size = sys.getsizeof(row)
+    for key, val in row.items():
+        size += sys.getsizeof(val)
+    return size
+
+class RowBuffer:
+    def __init__(self, headers, memory_budget_bytes=None, spill_dir=SPILL_DIR, chunk_rows=20000):
+        """
+        :param headers: List[str], row columns to keep when spilling.
+        :param memory_budget_bytes: Int, estimated bytes of buffered rows before spilling. None keeps everything in memory.
+        :param spill_dir: Str, parent directory for the temporary spill directory.
+        :param chunk_rows: Int, rows per encoded block inside a spill file.
+        """
+        self.headers = list(headers)
+        self.memory_budget_bytes = memory_budget_bytes
+        self.spill_dir = spill_dir
+        self.chunk_rows = max(1, int(chunk_rows))
+        self.rows = []
+        self.spill_files = []
+        self.spilled_rows = 0
+        self._buffered_bytes = 0
+        self._avg_row_bytes = None
+        self._sampled = 0
+        self._tmpdir = None
+
+    def __len__(self):
+        return self.spilled_rows + len(self.rows)
+
+    @property
+    def spilled(self):
+        return bool(self.spill_files)
+
+    def _row_bytes(self, row):
+        if self._sampled < _WARMUP_ROWS or len(self.rows) % _SAMPLE_EVERY == 0:
+            size = estimate_row_bytes(row)
+            self._sampled += 1
+            if self._avg_row_bytes is None:
+                self._avg_row_bytes = size
+            else:
+                self._avg_row_bytes += (size - self._avg_row_bytes) / min(self._sampled, 1000)
+        return self._avg_row_bytes
+
+    def extend(self, rows):
+        if self.memory_budget_bytes is None:
+            self.rows.extend(rows)
+            return
+        for row in rows:
+            self.rows.append(row)
+            self._buffered_bytes += self._row_bytes(row)
+        if self._buffered_bytes >= self.memory_budget_bytes:
+            self.spill()
+
+    def spill(self):
+        """Writes the in-memory rows to a new spill file."""
+        if not self.rows:
+            return
+        if self._tmpdir is None:
+            if self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+            self._tmpdir = tempfile.mkdtemp(prefix='tradelines-spill-', dir=self.spill_dir)
+        path = os.path.join(self._tmpdir, f"spill-{len(self.spill_files):05d}.bin")
+        with open(path, 'wb') as fh:
+            for start in range(0, len(self.rows), self.chunk_rows):
+                block = encode_rows(self.rows[start:start + self.chunk_rows], self.headers)
+                fh.write(_LENGTH.pack(len(block)))
+                fh.write(block)
+        self.spill_files.append(path)
+        self.spilled_rows += len(self.rows)
+        print(f"Spilled {len(self.rows)} rows to {path} ({self.spilled_rows} on disk).")
+        self.rows = []
+        self._buffered_bytes = 0
+
+    def iter_chunks(self):
+        """Yields lists of rows in insertion order: each spill block, then the in-memory tail."""
+        for path in self.spill_files:
+            with open(path, 'rb') as fh:
+                while True:
+                    header = fh.read(_LENGTH.size)
+                    if not header:
+                        break
+                    yield decode_rows(fh.read(_LENGTH.unpack(header)[0]))
+        for start in range(0, len(self.rows), self.chunk_rows):
+            yield self.rows[start:start + self.chunk_rows]
+
+    def iter_rows(self):
+        for chunk in self.iter_chunks():
+            yield from chunk
+
+    def close(self):
+        """Deletes the spill files and drops the in-memory rows."""
+        self.rows = []
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+        self.spill_files = []
@@ -0,0 +1,41 @@
+import json
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+# The modules under test live in the repository root, next to this directory.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import process_experian as pe
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+class FrozenDatetime(datetime):
+    """The date the golden outputs were recorded on; recent-window and tenure rules depend on it."""
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2025, 6, 17, 10, 30)
+
+@pytest.fixture
+def frozen_clock(monkeypatch):
+    monkeypatch.setattr(pe, 'datetime', FrozenDatetime)
+    return FrozenDatetime
+
+def load_golden(name):
+    """
+    Cases recorded from the implementation before the change under test.
+    Row outputs are stored as value lists under a leading {"columns": [...]} line.
+    :return: (cases, columns or None)
+    """
+    with open(os.path.join(GOLDEN_DIR, name), encoding='utf-8') as fh:
+        cases = [json.loads(line) for line in fh]
+    columns = cases.pop(0)['columns'] if cases and 'columns' in cases[0] else None
+    return cases, columns
+
+def unpack_rows(rows, columns):
+    if rows is None:
+        return None
+    return [dict(zip(columns, values)) for values in rows]
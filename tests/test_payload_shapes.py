@@ -0,0 +1,71 @@
+"""
+Payload shape counting in extract_report_sections.
+Golden rows were recorded from the extraction before shapes were counted.
+"""
+import threading
+
+import pytest
+
+import process_experian as pe
+from conftest import load_golden, unpack_rows
+
+CARD = {'provider': 'HDFC', 'accountType': 'Credit Card', 'outstanding': 100}
+LOAN = {'provider': 'Axis', 'accountType': 'Home Loan', 'outstanding': 200}
+ENQUIRY = {'date': '2025-06-01', 'lender': 'Bajaj'}
+
+def payload(credit_analysis=None, report_summary=None):
+    return {'data': {'reportData': {
+        'reportSummary': {'personalDetails': {'pan': 'ABCDE1234F'}, **(report_summary or {})},
+        'creditAnalysis': {
+            'creditCards': [CARD],
+            'loans': {'homeLoan': [LOAN], 'note': 'not a list'},
+            'enquiries': {'recent': [ENQUIRY], 'summary': {'last30Days': 1}},
+            **(credit_analysis or {}),
+        },
+    }}}
+
+def shape_counts_during(fn):
+    before = pe.get_payload_shape_counts()
+    fn()
+    after = pe.get_payload_shape_counts()
+    return {name: count - before.get(name, 0) for name, count in after.items() if count != before.get(name, 0)}
+
+def test_sections_are_extracted_and_shape_counted():
+    report = payload(report_summary={'enquiries': {'all': [ENQUIRY]}})
+    results = []
+    counts = shape_counts_during(lambda: results.extend(pe.extract_report_sections(report) for _ in range(3)))
+    assert counts == {'accounts[creditCards,loans:dict] analysisEnq[recent,summary] summaryEnq[all]': 3}
+    for result in results:
+        assert result == ('ABCDE1234F', [ENQUIRY, ENQUIRY], {'last30Days': 1}, [CARD, LOAN])
+    assert pe.extract_report_sections(report, pan_from_db='ZZZZZ9999Z')[0] == 'ZZZZZ9999Z'
+
+def test_unusual_sections_are_type_checked():
+    # A dict where an enquiry list belongs is iterated for its keys, which are then skipped as non-records.
+    report = payload({'enquiries': {'recent': {'date': '2025-06-01'}}, 'otherLoans': None})
+    counts = shape_counts_during(lambda: pe.extract_report_sections(report))
+    assert list(counts) == ['accounts[creditCards,loans:dict] analysisEnq[recent] summaryEnq[]']
+    assert pe.extract_report_sections(report) == ('ABCDE1234F', ['date'], {}, [CARD, LOAN])
+
+@pytest.mark.parametrize('report', [None, [], {'data': None}, {'data': {'reportData': None}}])
+def test_non_reports_produce_no_rows(report):
+    assert pe.process_single_record(report) == []
+
+def test_counts_from_finished_threads_are_kept():
+    report = payload()
+    def extract():
+        for _ in range(50):
+            pe.extract_report_sections(report)
+    def run_threads():
+        threads = [threading.Thread(target=extract) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    counts = shape_counts_during(run_threads)
+    assert counts == {'accounts[creditCards,loans:dict] analysisEnq[recent,summary] summaryEnq[]': 200}
+    assert shape_counts_during(lambda: None) == {}
+
+def test_rows_match_recorded_outputs(frozen_clock):
+    cases, columns = load_golden('qfinance_payloads.jsonl')
+    for case in cases:
+        assert pe.process_single_record(case['payload'], pan_from_db=case['pan']) == unpack_rows(case['rows'], columns), case['payload']
@@ -0,0 +1,65 @@
+"""
+scan_payment_history: delinquency buckets and suit-filed status in one pass.
+Golden cases were recorded from the separate get_delinquency_buckets /
+get_suit_filed_info scans it replaced.
+"""
+import pytest
+
+import process_experian as pe
+from conftest import load_golden
+
+def buckets(total=0, months='', d30=0, d60=0, d90=0, r30=0, r60=0, r90=0):
+    return {'totalDelinquencies': total, 'delinquencies': months, 'delinq30': d30, 'delinq60': d60, 'delinq90': d90,
+            'recent30': r30, 'recent60': r60, 'recent90': r90}
+
+@pytest.mark.parametrize('history', [None, [], {}, ''])
+def test_missing_history_keeps_empty_list(history):
+    assert pe.scan_payment_history(history) == (buckets(months=[]), "No", None)
+
+def test_oldest_first_history_is_listed_newest_first(frozen_clock):
+    history = [
+        {'month': '01-25', 'status': '030'},
+        {'month': '03-25', 'status': 'SMA1'},  # Before the 90-day window (2025-03-19)
+        {'month': '05-25', 'status': 'DBT'},
+        {'month': '06-25', 'status': 'STD'},
+        {'month': '13-25', 'status': '090'},  # Unparseable month: ignored
+        'not a record',
+    ]
+    assert pe.scan_payment_history(history) == (
+        buckets(total=3, months='05-25,03-25,01-25', d30=3, d60=1, d90=1, r30=1, r60=1, r90=1), "No", None)
+
+def test_latest_dated_suit_status_wins_over_undated(frozen_clock):
+    history = [
+        {'month': '01-25', 'status': '0', 'suitFiledStatus': 'SUIT FILED'},
+        {'month': 'bad', 'status': '0', 'suitFiledStatus': 'UNDATED'},
+        {'month': '03-25', 'status': '0', 'suitFiledStatus': '*WILFUL DEFAULT*'},
+        {'month': '05-25', 'status': '0', 'suitFiledStatus': 'null'},
+    ]
+    assert pe.scan_payment_history(history)[1:] == ("Yes", "WILFUL DEFAULT")
+    assert pe.get_suit_filed_info(history[1:2]) == ("Yes", "UNDATED")
+
+def test_suit_status_is_only_read_from_lists(frozen_clock):
+    history = ({'month': '05-25', 'status': '30', 'suitFiledStatus': 'SUIT FILED'},)
+    assert pe.scan_payment_history(history) == (buckets(total=1, months='05-25', d30=1, r30=1), "No", None)
+
+def test_unclassifiable_status_raises_only_when_strict(frozen_clock):
+    # '²' passes str.isdigit() but not int().
+    history = [{'month': '05-25', 'status': '²', 'suitFiledStatus': 'SUIT FILED'}]
+    with pytest.raises(ValueError):
+        pe.scan_payment_history(history)
+    with pytest.raises(ValueError):
+        pe.get_delinquency_buckets(history)
+    assert pe.scan_payment_history(history, strict=False)[1:] == ("Yes", "SUIT FILED")
+    assert pe.get_suit_filed_info(history) == ("Yes", "SUIT FILED")
+
+def test_matches_recorded_outputs(frozen_clock):
+    cases, _ = load_golden('payment_history.jsonl')
+    for case in cases:
+        history = case['history']
+        assert list(pe.get_suit_filed_info(history)) == case['suit'], history
+        if 'error' in case:
+            with pytest.raises(ValueError):
+                pe.scan_payment_history(history)
+            continue
+        assert pe.get_delinquency_buckets(history) == case['buckets'], history
+        assert pe.scan_payment_history(history) == (case['buckets'], *case['suit']), history
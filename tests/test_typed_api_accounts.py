@@ -0,0 +1,68 @@
+"""
+The typed api_server path: TypedAccount objects read directly by process_single_record.
+Golden rows were recorded from the dict payload path it replaced.
+"""
+from datetime import datetime
+
+import pytest
+
+import process_experian as pe
+from conftest import load_golden, unpack_rows
+
+ACCOUNT = {
+    'accountNumber': 'ACC1',
+    'productName': 'Personal Loan',
+    'sanctioned': '50,000',
+    'outstanding': '*12,500*',
+    'emi': 0,
+    'accountOpenDate': '2024-01',
+    'accountCloseDate': 'garbage',
+    'accountStatus': 'ACTIVE',
+    'paymentHistory': [
+        {'date': '2025-05', 'daysLate': 45},
+        {'month': '04-25', 'status': 'STD'},
+        {'date': '2025-03-01', 'assetClassification': 'SUB'},
+        {'date': 'bad', 'status': '90'},
+    ],
+}
+RAW_ACCOUNT = {
+    'accountNumber': 'ACC1',
+    'subscriberName': 'HDFC BANK',
+    'suitFiledWilfulDefault': '01',
+    'creditLimitAmount': 0,
+    'scheduledMonthlyPaymentAmount': '1,200',
+    'repaymentTenure': '36.0',
+    'dateOfLastPayment': '20250510',
+}
+
+def test_typed_account_holds_parsed_values():
+    account = pe.transform_api_account(ACCOUNT, RAW_ACCOUNT, typed=True)
+    assert account.provider == 'HDFC BANK'
+    assert account.sanctioned_amount == 50000.0 and account.outstanding == 12500.0 and account.emi == 1200.0
+    assert (account.total_tenure, account.tenure_months) == ('36', 36)
+    assert account.open_date == datetime(2024, 1, 1) and account.close_date == 'garbage'
+    assert account.last_payment_date == datetime(2025, 5, 10)
+    assert account.account_status == 'Current Account'
+    assert account.payment_history == [(2025 * 12 + 4, '45'), (2025 * 12 + 3, '0'), (2025 * 12 + 2, 'SUB')]
+    assert account.suit_filed_status == '01'
+
+@pytest.mark.parametrize('now', [datetime(2025, 6, 17, 10, 30), datetime(2025, 6, 30)])  # Cutoff mid-month / on the 1st
+def test_typed_scan_matches_dict_scan(monkeypatch, now):
+    class Clock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(now.year, now.month, now.day, now.hour, now.minute)
+
+    monkeypatch.setattr(pe, 'datetime', Clock)
+    history = [{'date': f"2025-{month:02d}", 'daysLate': 30 * month} for month in range(1, 7)]
+    months, suit_status = pe.parse_api_payment_history(history, suit_filed_status='SUIT FILED')
+    expected = pe.scan_payment_history(pe.normalize_api_payment_history(history, suit_filed_status='SUIT FILED'))
+    assert pe.scan_typed_payment_history(months, suit_status) == expected
+
+@pytest.mark.parametrize('typed', [True, False])
+def test_rows_match_recorded_outputs(frozen_clock, typed):
+    cases, columns = load_golden('api_reports.jsonl')
+    for case in cases:
+        payload = pe.build_qfinance_like_payload_from_api(case['report_data'], case['raw_report_data'], case['pan'], typed=typed)
+        rows = pe.process_single_record(payload, pan_from_db=case['pan']) if payload else None
+        assert rows == unpack_rows(case['rows'], columns), case['report_data']